@@ -0,0 +1,203 @@
+"""DesktopSimulator を相手に Client / ClaudeRepl / SSE パーサの性能を測る
+
+Claude for Desktop なしで（Linux でも）実行できる。
+
+    $ uv run python benchmarks/bench_client.py [--tokens 2000] [--chunk-size 256] [--buffer-bytes 65536 --buffer-policy spill]
+"""
+
+import io
+import time
+import asyncio
+import argparse
+import statistics
+import tracemalloc
+from contextlib import redirect_stdout
+
+from claude_inspect.buffer import BufferConfig, BufferStats, PageBatching
+from claude_inspect.client import Client, ClaudeRepl
+from claude_inspect.simulator import DesktopSimulator, SimulatorConfig, make_sse_response
+from claude_inspect.sse import SSEParser
+
+
+def report(name: str, **values: str):
+    print(f"{name:24s} " + " ".join(f"{k}={v}" for k, v in values.items()))
+
+
+def ms(seconds: float) -> str:
+    return f"{seconds * 1e3:.3f}ms"
+
+
+async def bench_op_roundtrip(client: Client, n: int):
+    latencies = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        await client.call_op("ping", [])
+        latencies.append(time.perf_counter() - t0)
+    report(
+        "op round-trip",
+        n=str(n),
+        mean=ms(statistics.mean(latencies)),
+        p50=ms(statistics.median(latencies)),
+        p99=ms(statistics.quantiles(latencies, n=100)[98]),
+    )
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client.call_op("ping", []) for _ in range(n)))
+    report("op concurrent", n=str(n), ops_per_sec=f"{n / (time.perf_counter() - t0):.0f}")
+
+
+async def bench_ttft(client: Client, n: int):
+    ttfts = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        ttft = None
+        async for event in client.communicate("hello"):
+            if ttft is None and event.event == "content_block_delta":
+                ttft = time.perf_counter() - t0
+        ttfts.append(ttft)
+    report("time to first token", n=str(n), mean=ms(statistics.mean(ttfts)), p50=ms(statistics.median(ttfts)))
+
+
+async def bench_stream(client: Client, sim: DesktopSimulator, tokens: int):
+    chunks = sim.chunks_sent
+    events = 0
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    async for event in client.communicate("hello"):
+        events += 1
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    chunks = sim.chunks_sent - chunks
+    report(
+        "communicate",
+        tokens=str(tokens),
+        chunks_per_sec=f"{chunks / elapsed:.0f}",
+        events_per_sec=f"{events / elapsed:.0f}",
+        tokens_per_sec=f"{tokens / elapsed:.0f}",
+        peak_mem=f"{peak / 1024:.0f}KiB",
+    )
+
+
+async def bench_slow_consumer(client: Client, tokens: int, delay: float):
+    # 読み手が遅いときにバッファがどこまで溜まり、その間も op が応答を返せるかを見る
+    client.buffer_stats = BufferStats()
+    pings = []
+
+    async def ping_loop():
+        while True:
+            t0 = time.perf_counter()
+            await client.call_op("ping", [])
+            pings.append(time.perf_counter() - t0)
+            await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(ping_loop())
+    t0 = time.perf_counter()
+    try:
+        async for _ in client.communicate("hello"):
+            await asyncio.sleep(delay)
+    finally:
+        task.cancel()
+    elapsed = time.perf_counter() - t0
+    stats = client.buffer_stats
+    report(
+        "slow consumer",
+        policy=client.buffer.policy,
+        elapsed=ms(elapsed),
+        high_water=f"{stats.high_water_bytes / 1024:.0f}KiB/{stats.high_water_depth}",
+        coalesced=str(stats.coalesced),
+        blocked=str(stats.blocked),
+        spilled=f"{stats.spilled_bytes / 1024:.0f}KiB",
+        ping_max=ms(max(pings, default=0.0)),
+    )
+
+
+async def bench_repl(client: Client, tokens: int):
+    repl = ClaudeRepl(client)
+    t0 = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        async for msg in repl.eval("hello"):
+            repl.print(msg)
+    elapsed = time.perf_counter() - t0
+    report("ClaudeRepl eval+print", tokens=str(tokens), tokens_per_sec=f"{tokens / elapsed:.0f}")
+
+
+async def bench_framing(port: int, tokens: int, tokens_per_sec: float):
+    # ページ側でチャンクをまとめる／まとめない、圧縮する／しないで、フレーム数と CPU 時間を比べる
+    # CPU 時間は同じプロセスで動くシミュレータの分も含む
+    for batching in [None, PageBatching()]:
+        for compression in ["deflate", None]:
+            client = Client(port=port, attach=True, batching=batching, compression=compression)
+            config = SimulatorConfig(response_tokens=tokens, tokens_per_sec=tokens_per_sec, reconnect_delay=0.05)
+            async with DesktopSimulator(f"ws://127.0.0.1:{port}", config) as sim:
+                async with client.run():
+                    frames = sim.frames_sent
+                    cpu = time.process_time()
+                    async for _ in client.communicate("hello"):
+                        pass
+                    cpu = time.process_time() - cpu
+                    frames = sim.frames_sent - frames
+            report(
+                "framing",
+                batching="on" if batching else "off",
+                compression=str(compression),
+                frames=str(frames),
+                cpu_per_token=f"{cpu / tokens * 1e6:.1f}us",
+            )
+            port += 1
+
+
+def bench_sse(tokens: int, chunk_size: int):
+    data = b"".join(make_sse_response(["token"] * tokens))
+    frames = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+    t0 = time.perf_counter()
+    parser = SSEParser()
+    n = sum(len(parser.feed(frame)) for frame in frames)
+    elapsed = time.perf_counter() - t0
+    report(
+        "SSEParser",
+        frames=str(len(frames)),
+        chunks_per_sec=f"{len(frames) / elapsed:.0f}",
+        events_per_sec=f"{n / elapsed:.0f}",
+        mb_per_sec=f"{len(data) / elapsed / 1e6:.1f}",
+    )
+
+
+async def amain(args: argparse.Namespace):
+    buffer = BufferConfig(max_bytes=args.buffer_bytes, policy=args.buffer_policy)
+    client = Client(port=args.port, attach=True, buffer=buffer)
+    config = SimulatorConfig(response_tokens=args.tokens, chunk_size=args.chunk_size, reconnect_delay=0.05)
+    async with DesktopSimulator(f"ws://127.0.0.1:{args.port}", config) as sim:
+        async with client.run():
+            await bench_op_roundtrip(client, args.ops)
+
+            sim.config.response_tokens = 10
+            await bench_ttft(client, 20)
+
+            sim.config.response_tokens = args.tokens
+            await bench_stream(client, sim, args.tokens)
+            await bench_repl(client, args.tokens)
+
+            sim.config.response_tokens = args.tokens // 5
+            await bench_slow_consumer(client, args.tokens // 5, args.consumer_delay)
+
+    await bench_framing(args.port + 1, args.tokens, args.framing_rate)
+    bench_sse(args.tokens, args.chunk_size or 64)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9323)
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--ops", type=int, default=500)
+    parser.add_argument("--buffer-bytes", type=int, default=BufferConfig.max_bytes)
+    parser.add_argument("--buffer-policy", choices=["block", "spill"], default="block")
+    parser.add_argument("--consumer-delay", type=float, default=0.0005)
+    parser.add_argument("--framing-rate", type=float, default=5000, help="framing の比較に使う生成速度（トークン/秒）")
+    args = parser.parse_args()
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
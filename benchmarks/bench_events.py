@@ -0,0 +1,109 @@
+"""テキストの取り出し方ごとの速さを比べる
+
+- legacy: ServerSentEvent を作り、content_block_delta ごとに json.loads する（従来の ClaudeRepl.print と同じ）
+- typed: make_event で型付きのイベントを作り、ContentBlockDelta.text だけを読む
+- Client.communicate + json.loads と Client.stream_text（DesktopSimulator 相手）
+
+    $ uv run python benchmarks/bench_events.py [--tokens 20000] [--chunk-size 256]
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from claude_inspect.client import Client
+from claude_inspect.events import ContentBlockDelta, make_event
+from claude_inspect.simulator import DesktopSimulator, SimulatorConfig, make_sse_response
+from claude_inspect.sse import SSEParser
+
+
+def report(name: str, tokens: int, elapsed: float, peak: int | None = None):
+    line = f"{name:28s} tokens_per_sec={tokens / elapsed:10.0f} us_per_token={elapsed / tokens * 1e6:6.2f}"
+    if peak is not None:
+        line += f" peak_mem={peak / 1024:.0f}KiB"
+    print(line)
+
+
+def extract_legacy(frames: list[bytes]) -> list[str]:
+    texts = []
+    parser = SSEParser()
+    for frame in frames:
+        for event in parser.feed(frame):
+            if event.event == "content_block_delta":
+                delta = json.loads(event.data)["delta"]
+                if delta.get("type", "text_delta") == "text_delta":
+                    texts.append(delta["text"])
+    return texts
+
+
+def extract_typed(frames: list[bytes]) -> list[str]:
+    texts = []
+    parser = SSEParser(make_event)
+    for frame in frames:
+        for event in parser.feed(frame):
+            if type(event) is ContentBlockDelta and (text := event.text) is not None:
+                texts.append(text)
+    return texts
+
+
+def bench_parse(tokens: list[str], chunk_size: int):
+    data = b"".join(make_sse_response(tokens))
+    frames = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+    expected = None
+    for name, func in [("parse legacy", extract_legacy), ("parse typed", extract_typed)]:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        texts = func(frames)
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # tracemalloc の影響を除いた時間も測る
+        t0 = time.perf_counter()
+        func(frames)
+        elapsed = time.perf_counter() - t0
+        expected = expected or texts
+        assert texts == expected == tokens, name
+        report(name, len(tokens), elapsed, peak)
+
+
+async def bench_client(tokens: list[str], port: int):
+    config = SimulatorConfig(response_tokens=len(tokens), tokens=tokens, reconnect_delay=0.05)
+    client = Client(port=port, attach=True)
+    async with DesktopSimulator(f"ws://127.0.0.1:{port}", config):
+        async with client.run():
+            t0 = time.perf_counter()
+            texts = []
+            async for event in client.communicate("hello"):
+                if event.event == "content_block_delta":
+                    texts.append(json.loads(event.data)["delta"]["text"])
+            report("communicate + json.loads", len(tokens), time.perf_counter() - t0)
+            assert texts == tokens
+
+            t0 = time.perf_counter()
+            texts = [text async for text in client.stream_text("hello")]
+            report("stream_text", len(tokens), time.perf_counter() - t0)
+            assert texts == tokens
+
+            t0 = time.perf_counter()
+            completion = await client.complete("hello")
+            report("complete", len(tokens), time.perf_counter() - t0)
+            assert completion.text == "".join(tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--port", type=int, default=9330)
+    args = parser.parse_args()
+
+    base = ["Hello", ",", " world", "!", " こんにちは", "。", "\n\n", ' "quoted"', " \\n"]
+    tokens = [base[i % len(base)] for i in range(args.tokens)]
+    bench_parse(tokens, args.chunk_size)
+    asyncio.run(bench_client(tokens, args.port))
+
+
+if __name__ == "__main__":
+    main()
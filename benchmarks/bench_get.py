@@ -0,0 +1,98 @@
+"""ストリームの読み出し（ChunkBuffer.get）のレイテンシとアイドル時 CPU を旧実装（10ms ポーリングの Client.get）と比較する
+
+    $ uv run python benchmarks/bench_get.py
+"""
+
+import time
+import asyncio
+import statistics
+
+from claude_inspect.buffer import ChunkBuffer
+
+
+CHUNKS = 200
+IDLE_SECONDS = 2.0
+CHUNK = b"event: content_block_delta\ndata: {}\n\n"
+
+
+async def legacy_get(self, timeout: float | None = None, *, get_ping=False) -> bytes | None:
+    # 変更前の実装
+    t0 = time.time()
+    while timeout is None or time.time() - t0 < timeout:
+        try:
+            v = self.q_out.get_nowait()
+            if isinstance(v, bytes) and v.startswith(b"event: ping\n") and not get_ping:
+                continue
+            return v
+        except asyncio.QueueEmpty:
+            await asyncio.sleep(0.01)
+    return None
+
+
+class LegacyChannel:
+    def __init__(self):
+        self.q_out = asyncio.Queue(4)
+
+    async def put(self, chunk: bytes):
+        await self.q_out.put(chunk)
+
+    async def get(self, timeout: float | None = None) -> bytes | None:
+        return await legacy_get(self, timeout)
+
+
+class CurrentChannel:
+    def __init__(self):
+        self.buffer = ChunkBuffer()
+
+    async def put(self, chunk: bytes):
+        await self.buffer.put(chunk)
+
+    async def get(self, timeout: float | None = None) -> bytes | None:
+        return await self.buffer.get(timeout)
+
+
+async def measure_latency(channel) -> list[float]:
+    sent: list[float] = []
+    latencies: list[float] = []
+
+    async def producer():
+        for i in range(CHUNKS):
+            # トークン間隔を模した不定期な送信
+            await asyncio.sleep(0.001 + (i % 7) * 0.0005)
+            sent.append(time.perf_counter())
+            await channel.put(CHUNK)
+
+    async def consumer():
+        received = 0
+        while received < CHUNKS * len(CHUNK):
+            chunk = await channel.get()
+            received += len(chunk)
+            # ChunkBuffer は続けて届いたチャンクをまとめて返すので、読めた分だけ記録する
+            t = time.perf_counter()
+            while len(latencies) < received // len(CHUNK):
+                latencies.append(t - sent[len(latencies)])
+
+    await asyncio.gather(producer(), consumer())
+    return latencies
+
+
+async def measure_idle_cpu(channel) -> float:
+    t0 = time.process_time()
+    await channel.get(IDLE_SECONDS)
+    return time.process_time() - t0
+
+
+async def amain():
+    for name, make_channel in [("legacy", LegacyChannel), ("current", CurrentChannel)]:
+        latencies = await measure_latency(make_channel())
+        cpu = await measure_idle_cpu(make_channel())
+        print(
+            f"{name:8s}"
+            f" latency mean={statistics.mean(latencies) * 1e3:7.3f}ms"
+            f" p99={statistics.quantiles(latencies, n=100)[98] * 1e3:7.3f}ms"
+            f" idle_cpu={cpu * 1e3:7.2f}ms/{IDLE_SECONDS:.0f}s"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(amain())
@@ -0,0 +1,92 @@
+"""コマンドの各モジュールを読み込むのにかかる時間を -X importtime で測り、予算と比べる
+
+    $ uv run python benchmarks/bench_import.py [--budget-ms 150] [--repeat 5] [--top 8]
+
+モジュールごとに新しいインタプリタで import し、最も速かった回の累積時間を予算と比べる。
+予算を超えたか、起動時に読み込んではいけない重い依存（anthropic SDK など）が読み込まれていれば
+終了コード 1 で終わる。同じ検査を tests/test_import_time.py が行う。
+"""
+
+import sys
+import argparse
+import subprocess
+import statistics
+
+
+# コマンドの入口になるモジュール
+MODULES = [
+    "claude_inspect.client",
+    "claude_inspect.batch",
+    "claude_inspect.gateway",
+    "claude_inspect.tap",
+]
+
+# 実際に使うときまで読み込まないはずの依存
+FORBIDDEN = ["anthropic", "httpx", "pydantic", "natsort", "websockets", "claco", "claude_inspect.win"]
+
+# 1 モジュールの累積時間の上限（ミリ秒）
+BUDGET_MS = 150.0
+
+
+def importtime(module: str) -> list[tuple[str, int, int]]:
+    """(モジュール名, 自身の時間 [us], 累積時間 [us]) を読み込んだ順に返す"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def forbidden_imports(rows: list[tuple[str, int, int]]) -> list[str]:
+    """rows のうち FORBIDDEN に含まれるモジュール"""
+    loaded = {name for name, _, _ in rows}
+    return sorted(name for name in loaded if any(name == f or name.startswith(f + ".") for f in FORBIDDEN))
+
+
+def measure(module: str, repeat: int) -> tuple[list[int], list[tuple[str, int, int]]]:
+    totals = []
+    best = None
+    for _ in range(repeat):
+        rows = importtime(module)
+        total = next(cumulative for name, _, cumulative in reversed(rows) if name == module)
+        totals.append(total)
+        if best is None or total <= min(totals):
+            best = rows
+    return totals, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="1 モジュールの累積時間の上限（ミリ秒）")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="自身の時間が長いモジュールをいくつ表示するか")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        totals, rows = measure(module, args.repeat)
+        best = min(totals) / 1e3
+        ok = best <= args.budget_ms
+        print(f"{module:28s} best={best:7.1f}ms median={statistics.median(totals) / 1e3:7.1f}ms budget={args.budget_ms:.0f}ms {'ok' if ok else 'OVER'}")
+        for name, self_us, _ in sorted(rows, key=lambda row: row[1], reverse=True)[: args.top]:
+            print(f"    {self_us / 1e3:7.2f}ms {name}")
+
+        forbidden = forbidden_imports(rows)
+        if forbidden:
+            print(f"    forbidden imports: {', '.join(forbidden)}")
+        failed |= not ok or bool(forbidden)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
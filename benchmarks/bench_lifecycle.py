@@ -0,0 +1,76 @@
+"""FakeBackend と DesktopSimulator で Client の起動・停止にかかる時間を測る
+
+固定の待ち時間がなければ、起動時間はウィンドウの出現と注入にかかる時間だけになる。
+
+    $ uv run python benchmarks/bench_lifecycle.py [--instances 4] [--window-delay 0.2] [--inject-mode cdp]
+
+--inject-mode cdp では各インスタンスのリモートデバッグ用ポートに CDPSimulator を立てる。
+"""
+
+import re
+import time
+import asyncio
+import argparse
+from contextlib import AsyncExitStack
+
+from claude_inspect.backend import FakeBackend
+from claude_inspect.client import Client
+from claude_inspect.simulator import CDPSimulator, DesktopSimulator, SimulatorConfig
+
+
+async def amain(args: argparse.Namespace):
+    async with AsyncExitStack() as sims:
+
+        async def on_evaluate(script: str):
+            # 注入されたスクリプトの接続先にシミュレータをつなぐ
+            url = re.search(r'"(ws://[^"]+)"', script).group(1)
+            await sims.enter_async_context(DesktopSimulator(url, SimulatorConfig(reconnect_delay=0.05)))
+
+        backend = FakeBackend(
+            window_delay=args.window_delay,
+            inject_delay=args.inject_delay,
+            on_inject=lambda pid, script: on_evaluate(script),
+        )
+        if args.inject_mode == "cdp":
+            for i in range(args.instances):
+                await sims.enter_async_context(CDPSimulator(args.debugging_port + i, on_evaluate=on_evaluate))
+        clients = [
+            Client(
+                "claude.exe",
+                ".",
+                port=args.port + i,
+                backend=backend,
+                inject_mode=args.inject_mode,
+                debugging_port=args.debugging_port + i,
+            )
+            for i in range(args.instances)
+        ]
+
+        t0 = time.perf_counter()
+        async with AsyncExitStack() as stack:
+            await asyncio.gather(*(stack.enter_async_context(client.run()) for client in clients))
+            t_started = time.perf_counter() - t0
+            await asyncio.gather(*(client.ping() for client in clients))
+            t1 = time.perf_counter()
+        t_stopped = time.perf_counter() - t1
+
+    print(f"mode={args.inject_mode} instances={args.instances} window_delay={args.window_delay}s inject_delay={args.inject_delay}s")
+    print(f"start={t_started * 1e3:.1f}ms stop={t_stopped * 1e3:.1f}ms")
+    for t, name, pid in backend.events:
+        print(f"  {t * 1e3:8.1f}ms {pid} {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=4)
+    parser.add_argument("--window-delay", type=float, default=0.2)
+    parser.add_argument("--inject-delay", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=9340)
+    parser.add_argument("--inject-mode", choices=["console", "cdp"], default="console")
+    parser.add_argument("--debugging-port", type=int, default=9440)
+    args = parser.parse_args()
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""記録したログを再生して、Python 側のデコードの速さを測る
+
+ログを指定しなければ DesktopSimulator との通信を記録してから再生する。
+再生はアプリにもページにも接続しないので、実際の通信をそのまま何度でもプロファイルできる。
+
+    $ uv run python benchmarks/bench_replay.py [--log session.log] [--prompts 5] [--tokens 5000]
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+
+from claude_inspect.client import Client
+from claude_inspect.recorder import RECV, FrameLog
+from claude_inspect.simulator import DesktopSimulator, SimulatorConfig
+
+
+async def record(path: str, port: int, prompts: int, tokens: int):
+    config = SimulatorConfig(response_tokens=tokens, chunk_size=64, reconnect_delay=0.05)
+    client = Client(port=port, attach=True, record=path)
+    async with DesktopSimulator(f"ws://127.0.0.1:{port}", config):
+        async with client.run():
+            for i in range(prompts):
+                await client.complete(f"prompt {i}")
+
+
+async def replay(path: str, prompts: int, mode: str) -> int:
+    tokens = 0
+    client = Client(replay=path)
+    async with client.run():
+        for i in range(prompts):
+            if mode == "communicate":
+                async for event in client.communicate(f"prompt {i}"):
+                    tokens += event.event == "content_block_delta"
+            else:
+                async for _ in client.stream_text(f"prompt {i}"):
+                    tokens += 1
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", help="再生するログ。省略時はシミュレータとの通信を記録する")
+    parser.add_argument("--prompts", type=int, default=5, help="ログに含まれるプロンプトの数")
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--port", type=int, default=9331)
+    args = parser.parse_args()
+
+    path = args.log
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "session.log")
+        asyncio.run(record(path, args.port, args.prompts, args.tokens))
+
+    with FrameLog(path) as log:
+        frames = [(f.direction, len(f.payload)) for f in log]
+    received = sum(n for d, n in frames if d == RECV)
+    print(f"log={path} size={os.path.getsize(path) / 1024:.0f}KiB frames={len(frames)} received={received / 1024:.0f}KiB")
+
+    for mode in ["communicate", "stream_text"]:
+        t0 = time.perf_counter()
+        tokens = asyncio.run(replay(path, args.prompts, mode))
+        elapsed = time.perf_counter() - t0
+        print(f"{mode:12s} tokens={tokens} elapsed={elapsed * 1e3:.1f}ms tokens_per_sec={tokens / elapsed:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""長くトークン密度の高い応答で SSE デコードのスループットを測る
+
+    $ uv run python benchmarks/bench_sse.py [--events 50000]
+
+legacy は変更前の Client.communicate と同じくフレームごとに decode + splitlines + SSEDecoder を行う。
+legacy はフレーム境界がイベント境界と一致している場合しか正しく動かないので、その条件でだけ比較する。
+legacy は anthropic SDK の SSEDecoder を使うので、SDK が入っていなければ飛ばす。
+"""
+
+import time
+import json
+import random
+import argparse
+
+from claude_inspect.sse import SSEParser
+
+
+def make_response(n_events: int) -> list[bytes]:
+    rng = random.Random(0)
+    words = ["hello", "world", "こんにちは", "世界", "🙂", "token", "\\n", "ストリーム"]
+    events = [b'event: message_start\ndata: {"type":"message_start","message":{}}\n\n']
+    for _ in range(n_events):
+        delta = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": rng.choice(words)}}
+        events.append(f"event: content_block_delta\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n".encode())
+    events.append(b'event: message_stop\ndata: {"type":"message_stop"}\n\n')
+    return events
+
+
+def split_random(data: bytes, lo: int, hi: int) -> list[bytes]:
+    rng = random.Random(1)
+    frames = []
+    i = 0
+    while i < len(data):
+        n = rng.randint(lo, hi)
+        frames.append(data[i : i + n])
+        i += n
+    return frames
+
+
+def run_legacy(frames: list[bytes]) -> int:
+    from anthropic._streaming import SSEDecoder
+
+    decoder = SSEDecoder()
+    n = 0
+    for msg in frames:
+        for line in msg.decode().splitlines():
+            if decoder.decode(line):
+                n += 1
+    return n
+
+
+def run_parser(frames: list[bytes]) -> int:
+    parser = SSEParser()
+    n = 0
+    for msg in frames:
+        n += len(parser.feed(msg))
+    return n
+
+
+def run_parser_memoryview(frames: list[bytes]) -> int:
+    # Client では websocket フレームからヘッダを除いた memoryview が渡される
+    parser = SSEParser()
+    n = 0
+    for msg in frames:
+        n += len(parser.feed(memoryview(msg)[4:]))
+    return n
+
+
+def bench(name: str, func, frames: list[bytes], size: int, repeat: int = 5):
+    best = float("inf")
+    n = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = func(frames)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{name:28s} {len(frames):7d} frames {n:7d} events {size / best / 1e6:8.1f} MB/s {n / best / 1e3:8.1f} kev/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=50000)
+    args = parser.parse_args()
+
+    events = make_response(args.events)
+    data = b"".join(events)
+    size = len(data)
+    print(f"response: {size / 1e6:.2f} MB, {len(events)} events")
+
+    try:
+        import anthropic  # noqa: F401
+    except ImportError:
+        print("legacy: skipped (anthropic is not installed)")
+    else:
+        bench("legacy (event aligned)", run_legacy, events, size)
+    bench("parser (event aligned)", run_parser, events, size)
+    bench("parser (1-64B frames)", run_parser, split_random(data, 1, 64), size)
+    bench("parser (256-4096B frames)", run_parser, split_random(data, 256, 4096), size)
+    with_header = [b"\0\0\0\1" + frame for frame in split_random(data, 256, 4096)]
+    bench("parser memoryview", run_parser_memoryview, with_header, size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""DesktopSimulator を相手に、大きなプロンプトと添付ファイルをページに渡す時間を測る
+
+put_chat を 1 つの JSON の op で送る場合（json）と、バイナリフレームに分けて送り paste op で貼り付ける
+場合（upload）、添付ファイルとして送る場合（attach）を比べる。
+
+    $ uv run python benchmarks/bench_upload.py [--sizes 1k,10k,100k,1m,10m] [--chunk-size 262144] [--no-compression]
+"""
+
+import time
+import asyncio
+import argparse
+import statistics
+
+from claude_inspect.client import Client
+from claude_inspect.simulator import DesktopSimulator, SimulatorConfig
+from claude_inspect.upload import DEFAULT_CHUNK_SIZE, Attachment
+
+
+UNITS = {"k": 1 << 10, "m": 1 << 20}
+
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower()
+    if s[-1] in UNITS:
+        return int(float(s[:-1]) * UNITS[s[-1]])
+    return int(s)
+
+
+def make_text(size: int) -> str:
+    """改行と日本語を含む、UTF-8 でおよそ size バイトのテキスト"""
+    line = "The quick brown fox jumps over the lazy dog. いろはにほへと ちりぬるを。\n"
+    n = size // len(line.encode()) + 1
+    return (line * n)[:size]
+
+
+def report(name: str, size: int, seconds: list[float]):
+    t = statistics.median(seconds)
+    print(f"{name:8s} size={size:>9d} n={len(seconds):<3d} median={t * 1e3:9.2f}ms {size / t / (1 << 20):8.1f}MiB/s")
+
+
+async def measure(n: int, func) -> list[float]:
+    seconds = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        await func()
+        seconds.append(time.perf_counter() - t0)
+    return seconds
+
+
+async def amain(args: argparse.Namespace):
+    client = Client(
+        port=args.port,
+        attach=True,
+        compression=None if args.no_compression else "deflate",
+        upload_chunk_size=args.chunk_size,
+    )
+    sim = DesktopSimulator(f"ws://127.0.0.1:{args.port}", SimulatorConfig(reconnect_delay=0.05))
+    async with sim, client.run():
+        for size in map(parse_size, args.sizes.split(",")):
+            text = make_text(size)
+            data = text.encode()
+            # 大きいものほど回数を減らす
+            n = max(3, min(args.repeat, (32 << 20) // max(size, 1)))
+
+            async def put_json():
+                await client.call_op("put_chat", [text])
+
+            async def put_upload():
+                await client.put_chat(text)
+
+            async def attach():
+                await client.attach(Attachment("input.txt", data))
+                sim.attachments.clear()
+
+            client.upload_threshold = 0
+            report("json", size, await measure(n, put_json))
+            report("upload", size, await measure(n, put_upload))
+            assert sim.input == text
+            report("attach", size, await measure(n, attach))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9345)
+    parser.add_argument("--sizes", default="1k,10k,100k,1m,10m")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--no-compression", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import time
+import asyncio
+import logging
+import itertools
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class PlatformBackend(ABC):
+    """ClaudeDesktopProcess が使う OS 依存の操作"""
+
+    @abstractmethod
+    def spawn(self, exe_path: str, wd: str, env: dict[str, str], args: list[str] | None = None) -> int:
+        """アプリを起動して pid を返す"""
+
+    @abstractmethod
+    async def wait_window(self, title: str, timeout: float, exclude: set[int]) -> int | None:
+        """タイトルが一致し exclude に含まれないウィンドウが現れたらそのハンドルを返す"""
+
+    @abstractmethod
+    def get_pid_from_hwnd(self, hwnd: int) -> int | None:
+        pass
+
+    @abstractmethod
+    def minimize_window(self, hwnd: int):
+        pass
+
+    @abstractmethod
+    async def inject(self, app_title: str, devtools_title: str, hwnd_dev_tools: int, script: str) -> bool:
+        """DevTools の Console にスクリプトを入力して実行する"""
+
+    @abstractmethod
+    async def terminate_process(self, pid: int) -> int | None:
+        """プロセスを終了して終了コードを返す。失敗時は None"""
+
+
+class WinBackend(PlatformBackend):
+    """Win32 API と claco によるバックエンド"""
+
+    POLL_INTERVAL = 0.005
+    POLL_INTERVAL_MAX = 0.05
+
+    def __init__(self):
+        from claco.sender import Sender
+        import claude_inspect.win as win
+
+        self._win = win
+        self._keysender = Sender()
+
+    def spawn(self, exe_path: str, wd: str, env: dict[str, str], args: list[str] | None = None) -> int:
+        import subprocess
+
+        startupinfo = subprocess.STARTUPINFO()
+        # ウィンドウを最小化するフラグを設定
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = 6  # SW_MINIMIZE
+
+        process = subprocess.Popen(
+            [exe_path, *(args or [])],
+            cwd=wd,
+            env=env,
+            startupinfo=startupinfo,
+        )
+
+        if process.poll() is not None:
+            raise RuntimeError("Failed to start process")
+        return process.pid
+
+    async def wait_window(self, title: str, timeout: float, exclude: set[int]) -> int | None:
+        # ウィンドウの出現を知らせるイベントはないので、間隔を伸ばしながら探す
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = self.POLL_INTERVAL
+        while True:
+            for hwnd in self._win.find_windows_by_title(title):
+                if hwnd not in exclude:
+                    return hwnd
+            if loop.time() >= deadline:
+                return None
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.POLL_INTERVAL_MAX)
+
+    def get_pid_from_hwnd(self, hwnd: int) -> int | None:
+        return self._win.get_pid_from_hwnd(hwnd)
+
+    def minimize_window(self, hwnd: int):
+        self._win.minimize_window(hwnd)
+
+    async def inject(self, app_title: str, devtools_title: str, hwnd_dev_tools: int, script: str) -> bool:
+        def send():
+            self._win.click_window_at_position(hwnd_dev_tools, 146, 14)  # Console タブをクリック
+            return self._keysender.sends(
+                app_title,
+                [(script, False), ("{Enter}", True)],
+                window_title=devtools_title,
+            )
+
+        h, e = await asyncio.to_thread(send)
+        if not h:
+            logger.warning(f"Failed to send keys: {e}")
+        return bool(h)
+
+    async def terminate_process(self, pid: int) -> int | None:
+        return await asyncio.to_thread(self._win.terminate_process, pid)
+
+
+class FakeBackend(PlatformBackend):
+    """ウィンドウの出現や注入を指定した遅延で模倣するバックエンド
+
+    実際のアプリなしでライフサイクルを動かし、所要時間を測るために使う。
+    各操作は (経過秒, 名前, pid) として events に記録される。
+    """
+
+    def __init__(
+        self,
+        *,
+        window_delay: float = 0.1,
+        inject_delay: float = 0.01,
+        exit_delay: float = 0.0,
+        on_inject: Callable[[int, str], Awaitable[None] | None] | None = None,
+    ):
+        """
+        Args:
+            window_delay: 起動からウィンドウが現れるまでの時間（秒）
+            inject_delay: スクリプトの入力にかかる時間（秒）
+            exit_delay: 終了要求からプロセスが終了するまでの時間（秒）
+            on_inject: 注入時に (pid, script) で呼ばれる。シミュレータの接続などに使う
+        """
+        self.window_delay = window_delay
+        self.inject_delay = inject_delay
+        self.exit_delay = exit_delay
+        self.on_inject = on_inject
+        self.events: list[tuple[float, str, int]] = []
+        self._t0 = time.perf_counter()
+        self._pids = itertools.count(1000)
+        # hwnd -> (title, pid, 出現イベント)
+        self._windows: dict[int, tuple[str, int, asyncio.Event]] = {}
+        self._alive: set[int] = set()
+
+    def _record(self, name: str, pid: int):
+        self.events.append((time.perf_counter() - self._t0, name, pid))
+
+    def spawn(self, exe_path: str, wd: str, env: dict[str, str], args: list[str] | None = None) -> int:
+        from claude_inspect.process import ClaudeDesktopProcess
+
+        pid = next(self._pids)
+        self._alive.add(pid)
+        self._record("spawn", pid)
+        titles = [ClaudeDesktopProcess.MAIN_APP_TITLE]
+        if env.get("CLAUDE_DEV_TOOLS") == "detach":
+            titles.append(ClaudeDesktopProcess.DEVTOOLS_TITLE)
+        for i, title in enumerate(titles):
+            shown = asyncio.Event()
+            self._windows[pid * 2 + i] = (title, pid, shown)
+            asyncio.get_running_loop().call_later(self.window_delay, shown.set)
+        return pid
+
+    async def wait_window(self, title: str, timeout: float, exclude: set[int]) -> int | None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            candidates = {
+                hwnd: shown for hwnd, (t, _, shown) in self._windows.items() if t == title and hwnd not in exclude
+            }
+            for hwnd, shown in sorted(candidates.items()):
+                if shown.is_set():
+                    self._record(f"window {title}", self._windows[hwnd][1])
+                    return hwnd
+            remaining = deadline - loop.time()
+            if not candidates or remaining <= 0:
+                return None
+            # どれかのウィンドウが現れるまで待ち、exclude を確認し直す
+            waiters = [asyncio.ensure_future(shown.wait()) for shown in candidates.values()]
+            await asyncio.wait(waiters, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+
+    def get_pid_from_hwnd(self, hwnd: int) -> int | None:
+        window = self._windows.get(hwnd)
+        return window[1] if window else None
+
+    def minimize_window(self, hwnd: int):
+        pass
+
+    async def inject(self, app_title: str, devtools_title: str, hwnd_dev_tools: int, script: str) -> bool:
+        pid = self.get_pid_from_hwnd(hwnd_dev_tools)
+        await asyncio.sleep(self.inject_delay)
+        self._record("inject", pid)
+        if self.on_inject is not None:
+            result = self.on_inject(pid, script)
+            if asyncio.iscoroutine(result):
+                await result
+        return True
+
+    async def terminate_process(self, pid: int) -> int | None:
+        if pid not in self._alive:
+            return None
+        await asyncio.sleep(self.exit_delay)
+        self._alive.discard(pid)
+        for hwnd in [h for h, (_, p, _) in self._windows.items() if p == pid]:
+            del self._windows[hwnd]
+        self._record("terminate", pid)
+        return 0
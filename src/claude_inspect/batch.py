@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+from claude_inspect.buffer import PageBatching
+from claude_inspect.cache import ResponseCache
+from claude_inspect.metrics import ClientMetrics
+from claude_inspect.pool import ClientPool
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchItem:
+    id: str
+    prompt: str
+    new_chat: bool = False
+    project: str | None = None
+    # 入力の行番号と、読めなかった行ならその理由。理由があれば送らずにエラーとして記録する
+    line: int | None = None
+    error: str | None = None
+
+
+@dataclass
+class BatchStats:
+    total: int = 0
+    skipped: int = 0
+    succeeded: int = 0
+    failed: int = 0
+
+
+def read_items(path: str, *, new_chat: bool = False) -> Iterator[BatchItem]:
+    """入力 JSONL を 1 行ずつ読む
+
+    各行は {"prompt": str, "id"?: str, "new_chat"?: bool, "project"?: str}。
+    id を省略した場合は行番号を使う。読めない行も error を付けて返し、バッチ全体は止めない。
+    """
+    with open(path, encoding="utf-8") as io:
+        for lineno, line in enumerate(io, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield BatchItem(id=str(lineno), prompt="", line=lineno, error=f"line {lineno}: invalid JSON: {e}")
+                continue
+            if not isinstance(obj, dict):
+                yield BatchItem(id=str(lineno), prompt="", line=lineno, error=f"line {lineno}: expected an object")
+                continue
+            item_id = str(obj.get("id", lineno))
+            prompt = obj.get("prompt")
+            if not isinstance(prompt, str):
+                yield BatchItem(id=item_id, prompt="", line=lineno, error=f'line {lineno}: "prompt" must be a string')
+                continue
+            yield BatchItem(
+                id=item_id,
+                prompt=prompt,
+                new_chat=obj.get("new_chat", new_chat) or obj.get("project") is not None,
+                project=obj.get("project"),
+                line=lineno,
+            )
+
+
+def load_done(path: str) -> set[str]:
+    """出力 JSONL から成功済みの id を集める。途中で切れた最終行など、読めない行は無視する"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as io:
+        for line in io:
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(obj, dict) or "id" not in obj:
+                continue
+            if obj.get("error") is None:
+                done.add(str(obj["id"]))
+    return done
+
+
+class BatchRunner:
+    """プロンプトを ClientPool に流し込み、終わったものから JSONL に書き出すクラス
+
+    出力ファイルがそのままチェックポイントになる。再実行時は成功済みの id を読み飛ばし、
+    エラーになった項目だけをやり直す。
+    """
+
+    def __init__(self, pool: ClientPool, output: str, *, timeout: float | None = None):
+        """
+        Args:
+            timeout: 1 項目の応答の期限（秒）。過ぎたらアプリの生成を止めてエラーとして記録する
+        """
+        self.pool = pool
+        self.output = output
+        self.timeout = timeout
+        self.stats = BatchStats()
+
+    async def run(self, items: Iterable[BatchItem]) -> BatchStats:
+        done = load_done(self.output)
+        # 各インスタンスが応答を返したら待たずに次の項目を取れるよう、少し先読みしておく
+        workers = max(len(self.pool.clients), 1)
+        queue: asyncio.Queue[BatchItem | None] = asyncio.Queue(workers * 2)
+
+        with open(self.output, "a", encoding="utf-8") as io:
+
+            async def worker():
+                while (item := await queue.get()) is not None:
+                    record = await self._process(item)
+                    io.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    io.flush()
+
+            tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+            try:
+                for item in items:
+                    self.stats.total += 1
+                    if item.id in done:
+                        self.stats.skipped += 1
+                        continue
+                    await queue.put(item)
+                for _ in tasks:
+                    await queue.put(None)
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        return self.stats
+
+    async def _process(self, item: BatchItem) -> dict:
+        if item.error is not None:
+            # 入力を直して再実行すればやり直される
+            logger.warning(f"item {item.id} skipped: {item.error}")
+            self.stats.failed += 1
+            return {"id": item.id, "error": item.error, "line": item.line, "elapsed": 0.0}
+
+        t0 = time.perf_counter()
+        try:
+            async with self.pool.acquire() as client:
+                completion = await client.complete(item.prompt, timeout=self.timeout, fresh=item.new_chat, project=item.project)
+        except Exception as e:
+            logger.warning(f"item {item.id} failed: {e!r}")
+            self.stats.failed += 1
+            return {"id": item.id, "error": str(e), "elapsed": time.perf_counter() - t0}
+
+        self.stats.succeeded += 1
+        return {
+            "id": item.id,
+            "text": completion.text,
+            "stop_reason": completion.stop_reason,
+            "elapsed": time.perf_counter() - t0,
+        }
+
+
+def _exporting(metrics: ClientMetrics, path: str | None, interval: float):
+    if path is None:
+        return nullcontext()
+    return metrics.registry.exporting(path, interval)
+
+
+async def amain(args: argparse.Namespace):
+    cache = ResponseCache(args.cache, ttl=args.cache_ttl) if args.cache else None
+    metrics = ClientMetrics()
+    pool = ClientPool(
+        args.instances,
+        exe_path=args.exe,
+        base_port=args.port,
+        attach=args.attach,
+        inject_mode=args.inject_mode,
+        # 途中経過は表示しないので、ページ側でチャンクをまとめて送らせる
+        batching=None if args.no_batching else PageBatching(),
+        cache=cache,
+        observers=[metrics] if args.metrics else (),
+        prewarm=args.prewarm,
+    )
+    async with pool.run(), _exporting(metrics, args.metrics, args.metrics_interval):
+        runner = BatchRunner(pool, args.output, timeout=args.timeout)
+        stats = await runner.run(read_items(args.input, new_chat=args.new_chat))
+    print(f"total={stats.total} skipped={stats.skipped} succeeded={stats.succeeded} failed={stats.failed}")
+    if cache is not None:
+        print(f"cache hits={cache.stats.hits} misses={cache.stats.misses} bypassed={cache.stats.bypassed}")
+        cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSONL のプロンプトを Claude for Desktop で順に処理する")
+    parser.add_argument("input", help="入力 JSONL")
+    parser.add_argument("output", help="出力 JSONL（チェックポイントを兼ねる）")
+    parser.add_argument("-n", "--instances", type=int, default=1, help="起動するインスタンス数")
+    parser.add_argument("--port", type=int, default=9223, help="最初のインスタンスのポート番号")
+    parser.add_argument("--exe", default=r"%LOCALAPPDATA%\AnthropicClaude\claude.exe")
+    parser.add_argument("--attach", action="store_true", help="起動済みのインスタンスに接続する")
+    parser.add_argument("--inject-mode", choices=["console", "cdp"], default="console", help="スクリプトの注入方法")
+    parser.add_argument("--no-batching", action="store_true", help="ページ側でチャンクをまとめずに送らせる")
+    parser.add_argument("--cache", help="応答をキャッシュする SQLite ファイル。new_chat する項目だけが対象")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="キャッシュの有効期間（秒）")
+    parser.add_argument("--metrics", help="計測値を書き出すファイル。拡張子が .prom なら Prometheus のテキスト形式、それ以外は JSON")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="計測値を書き出す間隔（秒）")
+    parser.add_argument("--timeout", type=float, default=None, help="1 項目の応答の期限（秒）")
+    parser.add_argument("--new-chat", action="store_true", help="項目ごとに新しいチャットを開始する")
+    parser.add_argument("--prewarm", action="store_true", help="次の項目用の新しいチャットを応答の合間に開いておく")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
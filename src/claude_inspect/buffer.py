@@ -0,0 +1,252 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import IO, Literal, overload
+
+
+logger = logging.getLogger(__name__)
+
+
+Chunk = bytes | bytearray | memoryview
+
+
+@dataclass
+class BufferConfig:
+    """ChunkBuffer の設定
+
+    Attributes:
+        max_bytes: メモリ上に溜めておけるバイト数。件数ではなくバイト数で数える
+        policy: max_bytes を超えたときの振る舞い
+            "block": 読み手が追いつくまで書き手を待たせる
+            "drop": 溢れたチャンクを捨てる。欠けても構わない観測用の読み手向け。
+                チャンクは SSE のイベントの途中で切れているので、SSEParser で読むバッファ（Client の buffer）には使えない
+            "spill": 溢れた分を一時ファイルに書き出し、順番を保ったまま読み出す
+        coalesce: 読み手が追いついていないとき、隣り合うチャンクをこのバイト数まで 1 つにまとめる。0 なら無効
+        spill_dir: policy="spill" の一時ファイルを置くディレクトリ
+        spill_read_size: 一時ファイルから一度に読み出すバイト数
+    """
+
+    max_bytes: int = 1 << 20
+    policy: Literal["block", "drop", "spill"] = "block"
+    coalesce: int = 64 * 1024
+    spill_dir: str | None = None
+    spill_read_size: int = 64 * 1024
+
+
+@dataclass
+class PageBatching:
+    """ページ側で SSE のチャンクを 1 つのフレームにまとめて送る設定
+
+    inject.js が "coalesce" に対応していれば、接続時に configure op で伝える。
+    1 トークンずつの小さなフレームが減る代わりに、最大 flush_interval だけ表示が遅れる。
+
+    Attributes:
+        flush_interval: 最初のチャンクを受け取ってから送るまでの最大の待ち時間（秒）
+        flush_bytes: 溜まったバイト数がこれを超えたら待たずに送る。0 なら flush_interval だけで送る
+    """
+
+    flush_interval: float = 0.01
+    flush_bytes: int = 16 * 1024
+
+    def to_args(self) -> dict:
+        return {"flush_interval_ms": round(self.flush_interval * 1000), "flush_bytes": self.flush_bytes}
+
+
+@dataclass
+class BufferStats:
+    """ChunkBuffer の累積の統計"""
+
+    chunks_in: int = 0
+    bytes_in: int = 0
+    coalesced: int = 0
+    high_water_bytes: int = 0
+    high_water_depth: int = 0
+    blocked: int = 0
+    dropped: int = 0
+    dropped_bytes: int = 0
+    spilled_bytes: int = 0
+
+    def merge(self, other: "BufferStats"):
+        """other の値を足し込む。最高水位は大きい方を取る"""
+        self.chunks_in += other.chunks_in
+        self.bytes_in += other.bytes_in
+        self.coalesced += other.coalesced
+        self.high_water_bytes = max(self.high_water_bytes, other.high_water_bytes)
+        self.high_water_depth = max(self.high_water_depth, other.high_water_depth)
+        self.blocked += other.blocked
+        self.dropped += other.dropped
+        self.dropped_bytes += other.dropped_bytes
+        self.spilled_bytes += other.spilled_bytes
+
+
+class ChunkBuffer:
+    """バイト数で上限を決める、書き手 1 つ・読み手 1 つ向けのバイト列の FIFO
+
+    チャンクの境界は保存しない。SSE のようにバイトストリームとして読むデータ向け。
+    """
+
+    def __init__(self, config: BufferConfig | None = None):
+        self.config = config or BufferConfig()
+        self.stats = BufferStats()
+        self._chunks: deque[Chunk] = deque()
+        # 末尾のチャンクがまとめるために自前で確保した bytearray かどうか
+        self._tail_owned = False
+        self._nbytes = 0
+        self._spill: IO[bytes] | None = None
+        self._spill_read = 0
+        self._spill_write = 0
+        self._closed = False
+        self._error: Exception | None = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+
+    @property
+    def depth(self) -> int:
+        """メモリ上のチャンク数"""
+        return len(self._chunks)
+
+    @property
+    def nbytes(self) -> int:
+        """メモリ上のバイト数"""
+        return self._nbytes
+
+    @property
+    def spilled(self) -> int:
+        """一時ファイルに書き出されてまだ読まれていないバイト数"""
+        return self._spill_write - self._spill_read
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def put(self, chunk: Chunk):
+        n = len(chunk)
+        if n == 0 or self._closed:
+            return
+        self.stats.chunks_in += 1
+        self.stats.bytes_in += n
+
+        if self.spilled:
+            # 書き出し中は順番を保つため、ファイルが読み切られるまで後続もファイルに回す
+            self._spill_out(chunk)
+            return
+
+        max_bytes = self.config.max_bytes
+        if self._nbytes and self._nbytes + n > max_bytes:
+            match self.config.policy:
+                case "drop":
+                    self.stats.dropped += 1
+                    self.stats.dropped_bytes += n
+                    return
+                case "spill":
+                    self._spill_out(chunk)
+                    return
+                case _:
+                    self.stats.blocked += 1
+                    while self._nbytes and self._nbytes + n > max_bytes and not self._closed:
+                        self._writable.clear()
+                        await self._writable.wait()
+                    if self._closed:
+                        return
+
+        self._append(chunk)
+
+    def _append(self, chunk: Chunk):
+        n = len(chunk)
+        coalesce = self.config.coalesce
+        if coalesce and self._chunks and len(self._chunks[-1]) + n <= coalesce:
+            # 読み手が追いついていないなら小さいチャンクを 1 つにまとめる。最初の 1 つはコピーしない
+            if not self._tail_owned:
+                self._chunks[-1] = bytearray(self._chunks[-1])
+                self._tail_owned = True
+            self._chunks[-1] += chunk
+            self.stats.coalesced += 1
+        else:
+            self._chunks.append(chunk)
+            self._tail_owned = False
+        self._nbytes += n
+        self.stats.high_water_bytes = max(self.stats.high_water_bytes, self._nbytes)
+        self.stats.high_water_depth = max(self.stats.high_water_depth, len(self._chunks))
+        self._readable.set()
+
+    def _spill_out(self, chunk: Chunk):
+        if self._spill is None:
+            import tempfile
+
+            self._spill = tempfile.TemporaryFile(dir=self.config.spill_dir)
+            logger.debug("spilling buffer to disk")
+        self._spill.seek(self._spill_write)
+        self._spill.write(chunk)
+        self._spill_write += len(chunk)
+        self.stats.spilled_bytes += len(chunk)
+        self._readable.set()
+
+    def _spill_in(self) -> bytes:
+        self._spill.seek(self._spill_read)
+        data = self._spill.read(min(self.config.spill_read_size, self.spilled))
+        self._spill_read += len(data)
+        if not self.spilled:
+            # 読み切ったらファイルを使い回す
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._spill_read = self._spill_write = 0
+        return data
+
+    def close(self, error: Exception | None = None):
+        """終端を通知する。溜まっているデータは読み出せる"""
+        if self._closed:
+            return
+        self._closed = True
+        self._error = error
+        self._readable.set()
+        self._writable.set()
+
+    def discard(self):
+        """溜まっているデータを捨てて閉じる"""
+        self._chunks.clear()
+        self._tail_owned = False
+        self._nbytes = 0
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            self._spill_read = self._spill_write = 0
+        self.close()
+
+    def get_nowait(self) -> Chunk | None:
+        """次のチャンクを返す。空なら None、終端では b"" を返し、エラーで閉じられていれば送出する"""
+        if self._chunks:
+            chunk = self._chunks.popleft()
+            if not self._chunks:
+                self._tail_owned = False
+            self._nbytes -= len(chunk)
+            self._writable.set()
+            return chunk
+        if self.spilled:
+            return self._spill_in()
+        if self._closed:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            if self._error is not None:
+                raise self._error
+            return b""
+        return None
+
+    @overload
+    async def get(self) -> Chunk: ...
+
+    @overload
+    async def get(self, timeout: float) -> Chunk | None: ...
+
+    async def get(self, timeout: float | None = None) -> Chunk | None:
+        """次のチャンクを返す。終端では b"" を、タイムアウト時は None を返す"""
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        while (chunk := self.get_nowait()) is None:
+            self._readable.clear()
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await self._readable.wait()
+            except TimeoutError:
+                return None
+        return chunk
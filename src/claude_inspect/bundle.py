@@ -0,0 +1,286 @@
+import os
+import json
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+from claude_inspect.script_wrapper import load_script_file, raw_script
+
+
+logger = logging.getLogger(__name__)
+
+
+# ビルド結果の形式を変えたら上げる。古いキャッシュは使われなくなる
+BUNDLE_VERSION = 1
+
+# 実行時の設定はバンドルに埋め込まず、末尾の呼び出しの引数として渡す
+_BUNDLE_HEAD = "(function(__config) {\n"
+_BUNDLE_TAIL = "\n})"
+
+
+def _cache_dir() -> str:
+    if path := os.environ.get("CLAUDE_INSPECT_CACHE_DIR"):
+        return path
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "claude-inspect")
+
+
+_IDENT_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$\\")
+# この直後の / は除算ではなく正規表現リテラルの開始
+_REGEX_PREFIX_KEYWORDS = frozenset(
+    ["return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do", "else", "yield", "await"]
+)
+# 前後がこれらなら改行を消しても自動セミコロン挿入の結果が変わらない
+_NEWLINE_AFTER_OK = frozenset("{;,([")
+_NEWLINE_BEFORE_OK = frozenset(")]},;.")
+
+
+def _is_ident(c: str) -> bool:
+    return c in _IDENT_CHARS or c > "\x7f"
+
+
+def minify_js(code: str) -> str:
+    """コメントと余分な空白を取り除く
+
+    識別子の短縮などはせず、文字列・テンプレートリテラル・正規表現リテラルの中身には触れない。
+    自動セミコロン挿入に頼ったコードを壊さないよう、改行は意味が変わらない場所でしか消さない。
+    """
+    out: list[str] = []
+    n = len(code)
+    i = 0
+    # テンプレートリテラルの ${ ... } の中にいるときの波括弧の深さ
+    templates: list[int] = []
+    pending = ""  # 直前に読み飛ばした空白（"", " ", "\n"）
+
+    def last() -> str:
+        return out[-1][-1] if out else ""
+
+    def last_word() -> str:
+        j = len(out) - 1
+        word = []
+        while j >= 0 and len(out[j]) == 1 and _is_ident(out[j]):
+            word.append(out[j])
+            j -= 1
+        return "".join(reversed(word))
+
+    def emit(token: str):
+        nonlocal pending
+        if pending and out:
+            prev, next_ = last(), token[0]
+            if pending == "\n":
+                if prev not in _NEWLINE_AFTER_OK and next_ not in _NEWLINE_BEFORE_OK:
+                    out.append("\n")
+            elif (_is_ident(prev) and _is_ident(next_)) or (prev in "+-/" and next_ == prev):
+                out.append(" ")
+        pending = ""
+        out.append(token)
+
+    def scan_template(i: int) -> int:
+        # i は ` の次、または ${...} を閉じる } の次
+        start = i
+        while i < n:
+            c = code[i]
+            if c == "\\":
+                i += 2
+                continue
+            if c == "`":
+                out.append(code[start : i + 1])
+                return i + 1
+            if c == "$" and i + 1 < n and code[i + 1] == "{":
+                out.append(code[start : i + 2])
+                templates.append(0)
+                return i + 2
+            i += 1
+        raise ValueError("unterminated template literal")
+
+    while i < n:
+        c = code[i]
+
+        if c in " \t\r\n\f\v\u00a0\ufeff":
+            if c in "\r\n":
+                pending = "\n"
+            elif not pending:
+                pending = " "
+            i += 1
+            continue
+
+        if c == "/" and i + 1 < n and code[i + 1] == "/":
+            j = code.find("\n", i)
+            i = n if j < 0 else j
+            continue
+
+        if c == "/" and i + 1 < n and code[i + 1] == "*":
+            j = code.find("*/", i + 2)
+            if j < 0:
+                raise ValueError("unterminated comment")
+            if "\n" in code[i:j]:
+                pending = "\n"
+            elif not pending:
+                pending = " "
+            i = j + 2
+            continue
+
+        if c in "'\"":
+            j = i + 1
+            while j < n and code[j] != c:
+                if code[j] == "\\":
+                    j += 1
+                elif code[j] == "\n":
+                    raise ValueError("unterminated string literal")
+                j += 1
+            emit(code[i : j + 1])
+            i = j + 1
+            continue
+
+        if c == "`":
+            emit("`")
+            i = scan_template(i + 1)
+            continue
+
+        if c == "/":
+            prev = last()
+            if not prev or (not _is_ident(prev) and prev not in ")]}'\"`") or last_word() in _REGEX_PREFIX_KEYWORDS:
+                # 正規表現リテラル
+                j = i + 1
+                in_class = False
+                while j < n:
+                    d = code[j]
+                    if d == "\\":
+                        j += 2
+                        continue
+                    if d == "\n":
+                        raise ValueError("unterminated regular expression")
+                    if d == "[":
+                        in_class = True
+                    elif d == "]":
+                        in_class = False
+                    elif d == "/" and not in_class:
+                        break
+                    j += 1
+                j += 1
+                while j < n and _is_ident(code[j]):
+                    j += 1  # フラグ
+                emit(code[i:j])
+                i = j
+                continue
+
+        if templates:
+            if c == "{":
+                templates[-1] += 1
+            elif c == "}":
+                if templates[-1] == 0:
+                    templates.pop()
+                    emit("}")
+                    i = scan_template(i + 1)
+                    continue
+                templates[-1] -= 1
+
+        emit(c)
+        i += 1
+
+    return "".join(out)
+
+
+@dataclass(frozen=True)
+class Bundle:
+    """注入するスクリプトをまとめたもの
+
+    code は (function(__config) {...}) の形で、render() で実行時の設定を引数として付け足す。
+    ポートごとに作り直す必要はない。
+    """
+
+    code: str
+    digest: str
+    raw_size: int
+
+    @property
+    def size(self) -> int:
+        return len(self.code.encode("utf-8"))
+
+    def render(self, config: dict[str, Any]) -> str:
+        return f"{self.code}({json.dumps(config, separators=(',', ':'))});"
+
+
+def build_bundle(
+    names: Sequence[str],
+    *,
+    defines: dict[str, str] | None = None,
+    minify: bool = True,
+    cache: bool = True,
+) -> Bundle:
+    """パッケージ内のスクリプトを 1 つのバンドルにまとめる
+
+    Args:
+        names: claude_inspect.js 内のファイル名。この順で実行される
+        defines: ビルド時に置き換えるプレースホルダとコード
+        minify: コメントと空白を取り除く
+        cache: ソースの内容とビルド設定から求めたハッシュをキーにディスクへキャッシュする
+    """
+    source = _BUNDLE_HEAD + "\n\n".join(load_script_file(name) for name in names) + _BUNDLE_TAIL
+    for k, v in (defines or {}).items():
+        source = source.replace(k, v)
+    raw_size = len(source.encode("utf-8"))
+
+    h = hashlib.sha256()
+    h.update(f"{BUNDLE_VERSION}:{int(minify)}:".encode())
+    h.update(source.encode("utf-8"))
+    digest = h.hexdigest()[:16]
+
+    path = os.path.join(_cache_dir(), f"bundle-{digest}.js")
+    if cache:
+        try:
+            with open(path, encoding="utf-8") as io:
+                code = io.read()
+            logger.debug(f"bundle cache hit: {path}")
+            return Bundle(code, digest, raw_size)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"failed to read bundle cache: {e}")
+
+    code = minify_js(source) if minify else source
+    bundle = Bundle(code, digest, raw_size)
+    logger.info(f"bundle {digest}: {bundle.raw_size} -> {bundle.size} bytes")
+
+    if cache:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as io:
+                io.write(code)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"failed to write bundle cache: {e}")
+
+    return bundle
+
+
+# Client が注入するスクリプト
+DEFAULT_SCRIPTS = ("auto-approve.js", "inject.js")
+
+
+def default_bundle(*, minify: bool = True, cache: bool = True) -> Bundle:
+    """Client が注入するバンドル。render() には server_url, auto_approve_tools, auto_approve_patterns を渡す"""
+    defines = {"$OPERATIONS": raw_script("_operations.js")}
+    return build_bundle(DEFAULT_SCRIPTS, defines=defines, minify=minify, cache=cache)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="注入するスクリプトのバンドルを作り、サイズを表示する")
+    parser.add_argument("-o", "--output", help="バンドルの出力先")
+    parser.add_argument("--no-minify", action="store_true")
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args()
+
+    bundle = default_bundle(minify=not args.no_minify, cache=not args.no_cache)
+    print(f"digest={bundle.digest} raw={bundle.raw_size} bytes size={bundle.size} bytes ({bundle.size / bundle.raw_size:.1%})")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as io:
+            io.write(bundle.code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+
+logger = logging.getLogger(__name__)
+
+
+# キーの作り方を変えたら上げる
+CACHE_VERSION = 1
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    stores: int = 0
+    evictions: int = 0
+    expired: int = 0
+
+
+class ResponseCache:
+    """プロンプトとチャットの文脈をキーに、応答の SSE をそのまま SQLite に保存するキャッシュ
+
+    容量を超えたら最後に使われてから長いものから捨てる（LRU）。ttl を過ぎたものは使わない。
+    複数の Client から共有してよい。
+    """
+
+    def __init__(self, path: str, *, max_bytes: int = 256 << 20, ttl: float | None = None):
+        """
+        Args:
+            path: SQLite のファイル。":memory:" ならプロセス内だけで使う
+            max_bytes: 保存する応答の合計バイト数の上限
+            ttl: 保存してからこの秒数を過ぎた応答は使わない。None なら期限なし
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        # キャッシュを使わないコマンドの起動を遅くしないよう、使うときに読み込む
+        import sqlite3
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " body BLOB NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def key(prompt: str, context: dict[str, Any]) -> str:
+        """プロンプトと文脈（プロジェクトなど）からキーを作る"""
+        obj = {"v": CACHE_VERSION, "prompt": prompt, "context": context}
+        return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def _get(self, key: str) -> bytes | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT created, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            created, body = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.stats.expired += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return body
+
+    def _put(self, key: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, created, accessed, size, body) VALUES (?, ?, ?, ?, ?)",
+                    (key, now, now, len(body), body),
+                )
+                if self.ttl is not None:
+                    cur = self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                    self.stats.expired += cur.rowcount
+                self._evict()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        self.stats.stores += 1
+
+    def _evict(self):
+        (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            victims.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.stats.evictions += len(victims)
+        logger.debug(f"evicted {len(victims)} responses")
+
+    async def get(self, key: str) -> bytes | None:
+        """保存された応答の SSE を返す。なければ None"""
+        body = await asyncio.to_thread(self._get, key)
+        if body is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return body
+
+    async def put(self, key: str, body: bytes):
+        """最後まで受け取れた応答の SSE を保存する"""
+        await asyncio.to_thread(self._put, key, body)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    @property
+    def size(self) -> int:
+        """保存している応答の合計バイト数"""
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
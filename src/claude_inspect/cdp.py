@@ -0,0 +1,115 @@
+import json
+import asyncio
+import logging
+import itertools
+import urllib.request
+from contextlib import asynccontextmanager
+from typing import Any
+
+import websockets
+
+
+logger = logging.getLogger(__name__)
+
+
+class CDPError(Exception):
+    pass
+
+
+def _list_targets(host: str, port: int) -> list[dict]:
+    with urllib.request.urlopen(f"http://{host}:{port}/json/list", timeout=1.0) as res:
+        return json.load(res)
+
+
+async def wait_target(
+    port: int,
+    host: str = "127.0.0.1",
+    *,
+    url_prefix: str = "https://claude.ai",
+    timeout: float = 10.0,
+) -> dict:
+    """リモートデバッグのエンドポイントが立ち上がり、url_prefix のページが現れるまで待つ"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    interval = 0.005
+    while True:
+        try:
+            for target in await asyncio.to_thread(_list_targets, host, port):
+                if target.get("type") == "page" and target.get("url", "").startswith(url_prefix):
+                    return target
+        except OSError:
+            # まだ待ち受けていない
+            pass
+        if loop.time() >= deadline:
+            raise TimeoutError(f"CDP target not found: {host}:{port} {url_prefix}")
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, 0.1)
+
+
+class CDPSession:
+    """Chrome DevTools Protocol の最小限のクライアント"""
+
+    def __init__(self, ws: websockets.ClientConnection):
+        self._ws = ws
+        self._ids = itertools.count(1)
+        self._results: dict[int, asyncio.Future] = {}
+        self._reader = asyncio.create_task(self._read())
+
+    @classmethod
+    @asynccontextmanager
+    async def connect(cls, url: str):
+        async with websockets.connect(url, max_size=None) as ws:
+            session = cls(ws)
+            try:
+                yield session
+            finally:
+                session._reader.cancel()
+
+    async def _read(self):
+        error = ConnectionError("CDP connection closed")
+        try:
+            async for msg in self._ws:
+                obj = json.loads(msg)
+                result = self._results.pop(obj.get("id"), None)
+                if result is None or result.done():
+                    # イベント通知は使わない
+                    continue
+                if "error" in obj:
+                    result.set_exception(CDPError(obj["error"].get("message", obj["error"])))
+                else:
+                    result.set_result(obj.get("result", {}))
+        except websockets.ConnectionClosed as e:
+            # 異常終了（close フレームなしの切断）は反復からこの例外で抜けてくる
+            # タスクの例外として握りつぶさず、待っている呼び出し側に渡す
+            error = ConnectionError(f"CDP connection closed: {e}")
+        finally:
+            for result in self._results.values():
+                if not result.done():
+                    result.set_exception(error)
+            self._results.clear()
+
+    async def send(self, method: str, params: dict | None = None) -> dict[str, Any]:
+        if self._reader.done():
+            raise ConnectionError("CDP connection closed")
+        msg_id = next(self._ids)
+        result = asyncio.get_running_loop().create_future()
+        self._results[msg_id] = result
+        try:
+            await self._ws.send(json.dumps({"id": msg_id, "method": method, "params": params or {}}))
+        except websockets.ConnectionClosed as e:
+            self._results.pop(msg_id, None)
+            raise ConnectionError(f"CDP connection closed: {e}") from e
+        return await result
+
+    async def evaluate(self, expression: str) -> dict[str, Any]:
+        result = await self.send("Runtime.evaluate", {"expression": expression})
+        if "exceptionDetails" in result:
+            raise CDPError(f"evaluation failed: {result['exceptionDetails'].get('text')}")
+        return result
+
+    async def add_script_on_new_document(self, source: str) -> str:
+        """以降のページ読み込みでも source を実行させる。登録はこのセッションが閉じるまで有効"""
+        # 読み込み直後は document.body がまだないので DOM の構築を待って実行する
+        source = f"window.addEventListener('DOMContentLoaded', function() {{\n{source}\n}});"
+        result = await self.send("Page.addScriptToEvaluateOnNewDocument", {"source": source})
+        return result["identifier"]
@@ -1,24 +1,39 @@
 import os
-import glob
+import sys
 import json
-import asyncio
 import time
+import asyncio
+import argparse
+import itertools
+import re
 import shlex
-from contextlib import asynccontextmanager
+import threading
+from contextlib import aclosing, asynccontextmanager, nullcontext
 from functools import lru_cache
 import logging
-from typing import overload, AsyncIterator
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Literal, overload, AsyncIterator
+
+from claude_inspect.buffer import BufferConfig, BufferStats, ChunkBuffer, PageBatching
+from claude_inspect.cache import ResponseCache
+from claude_inspect.events import Completion, ContentBlockDelta, ContentBlockStart, Event, MessageDelta, make_event
+from claude_inspect.metrics import ClientMetrics, ClientObserver
+from claude_inspect.recorder import RECV, SENT, FrameLog, FrameRecorder
+from claude_inspect.sse import ServerSentEvent, SSEParser
+from claude_inspect.tap import Tap, TapSubscription
+from claude_inspect.upload import DEFAULT_CHUNK_SIZE, Attachment, upload_frames
 
-from natsort import natsorted
-import websockets
-from anthropic._streaming import SSEDecoder, ServerSentEvent
+if TYPE_CHECKING:
+    import websockets
 
-from claude_inspect.process import ClaudeDesktopProcess
-from claude_inspect.script_wrapper import load_script_file, raw_script
+    from claude_inspect.backend import PlatformBackend
+    from claude_inspect.bundle import Bundle
 
 
 logger = logging.getLogger(__name__)
 
+# ページから受け取ったフレームをこの数ごとに ack する（"resume"）
+_ACK_INTERVAL = 64
+
 
 class SSEError(Exception):
     def __init__(
@@ -26,18 +41,28 @@ class SSEError(Exception):
         addr: str,
         message: str,
     ):
+        error_type = "unknown"
         if message.lstrip().startswith("{"):
             try:
                 data = json.loads(message)
                 error_type = data.get("error", "unknown")
-                message = data.get("message", message)
+                if isinstance(error_type, dict):
+                    # {"type": "error", "error": {"type": ..., "message": ...}}
+                    message = error_type.get("message", message)
+                    error_type = error_type.get("type", "unknown")
+                else:
+                    message = data.get("message", message)
             except json.JSONDecodeError:
-                error_type = "unknown"
+                pass
 
         super().__init__(f"Error on SSE connection to {addr}: {error_type} {message}")
 
 
 def _get_wd(exe_path: str) -> str:
+    import glob
+
+    from natsort import natsorted
+
     base_dir = os.path.dirname(exe_path)
     wd = glob.glob(os.path.join(base_dir, "app-*/"))
     # get newest version
@@ -45,18 +70,62 @@ def _get_wd(exe_path: str) -> str:
 
 
 @lru_cache(1)
-def _load_script_auto_approve():
-    code = load_script_file("auto-approve.js")
-    code = code.replace("$AUTO_APPROVE_TOOLS", json.dumps([]))
-    return code
+def _load_bundle() -> "Bundle":
+    # スクリプトを読み込むのはアプリを起動するときだけ
+    from claude_inspect.bundle import default_bundle
 
+    return default_bundle()
 
-@lru_cache(1)
-def _load_script_inject(addr: str, port: int):
-    code = load_script_file("inject.js")
-    code = code.replace("$SERVER_URL", json.dumps(f"ws://{addr}:{port}"))
-    code = code.replace("$OPERATIONS", raw_script("_operations.js"))
-    return code
+
+def _load_script_inject(addr: str, port: int, auto_approve_tools: list[str], auto_approve_patterns: list[str]) -> str:
+    # バンドルは共通で、ポートごとに変わるのは末尾の設定だけ
+    return _load_bundle().render(
+        {
+            "server_url": f"ws://{addr}:{port}",
+            "auto_approve_tools": auto_approve_tools,
+            "auto_approve_patterns": auto_approve_patterns,
+        }
+    )
+
+
+class Stream:
+    """inject.js から転送される 1 本の SSE レスポンス"""
+
+    def __init__(self, stream_id: int, owner: int | None, url: str | None, buffer: BufferConfig | None = None):
+        self.id = stream_id
+        self.owner = owner
+        self.url = url
+        self.buffer = ChunkBuffer(buffer)
+
+    async def put(self, chunk: bytes | memoryview):
+        await self.buffer.put(chunk)
+
+    def close(self, error: Exception | None = None):
+        """終端を通知する。読み手が詰まっていても待たない"""
+        self.buffer.close(error)
+
+    def discard(self):
+        """読み手がいなくなったストリームのバッファを捨てる"""
+        self.buffer.discard()
+
+    @overload
+    async def get(self) -> bytes | bytearray | memoryview: ...
+
+    @overload
+    async def get(self, timeout: float) -> bytes | bytearray | memoryview | None: ...
+
+    async def get(self, timeout: float | None = None) -> bytes | bytearray | memoryview | None:
+        """次のチャンクを返す。終端では b"" を、タイムアウト時は None を返す"""
+        return await self.buffer.get(timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes | bytearray | memoryview:
+        v = await self.get()
+        if not v:
+            raise StopAsyncIteration
+        return v
 
 
 class Client:
@@ -68,165 +137,1050 @@ class Client:
         wd: str | None = None,
         addr: str = "127.0.0.1",
         port: int = 9223,
+        *,
+        attach: bool = False,
+        backend: "PlatformBackend | None" = None,
+        inject_mode: Literal["console", "cdp"] = "console",
+        debugging_port: int = 9222,
+        buffer: BufferConfig | None = None,
+        batching: PageBatching | None = None,
+        compression: Literal["deflate"] | None = "deflate",
+        record: str | None = None,
+        replay: str | None = None,
+        replay_speed: float | None = None,
+        replay_passive: bool = False,
+        cache: ResponseCache | None = None,
+        observers: Iterable[ClientObserver] = (),
+        auto_approve_tools: Iterable[str] = (),
+        auto_approve_patterns: Iterable[str] = (),
+        stop_timeout: float = 10.0,
+        prewarm: bool = False,
+        upload_threshold: int = 64 << 10,
+        upload_chunk_size: int = DEFAULT_CHUNK_SIZE,
+        resume_timeout: float = 5.0,
     ):
-        exe_path = os.path.expandvars(exe_path)
-
-        if not wd:
-            wd = _get_wd(exe_path)
-
-        scripts = [
-            _load_script_auto_approve(),
-            _load_script_inject(addr, port),
-        ]
-
-        self.process = ClaudeDesktopProcess(
-            exe_path,
-            wd,
-            "\n\n".join(scripts),
-        )
+        """
+        Args:
+            attach: True ならアプリを起動せず、スクリプト注入済みのページ（またはシミュレータ）からの接続を待つ
+            backend: アプリの起動に使う OS 依存の操作。省略時は WinBackend
+            inject_mode: スクリプトの注入方法。"cdp" なら Chrome DevTools Protocol を使う
+            debugging_port: inject_mode="cdp" のときのリモートデバッグ用ポート
+            buffer: 受信した SSE を読み手に渡すまで溜めておくバッファの設定。ストリームごとに確保される。
+                SSE として読むので policy="drop" は使えない。欠けても構わない観測には subscribe を使う
+            batching: 指定するとページ側で SSE のチャンクをまとめてから送らせる。ページが対応していなければ使われない
+            compression: websocket の permessage-deflate。ループバックでは None にすると CPU を節約できる
+            record: 指定するとページとの間で送受信したフレームをこのファイルに追記する
+            replay: 指定するとアプリにもページにも接続せず、record で記録したログを再生する
+            replay_speed: 再生速度。1.0 なら記録時と同じ間隔で、None なら待たずに再生する
+            replay_passive: True なら記録時に送った op が送られるのを待たず、受信したフレームだけを流す。
+                op を送らずに応答を眺める用途（chat-tap）向けで、送った op は ConnectionError で失敗する
+            cache: 応答のキャッシュ。new_chat 直後の最初のプロンプトだけが対象になる
+            observers: op や応答の各段階で呼ばれるフック（ClientMetrics など）。空なら計測はしない
+            auto_approve_tools: MCP ツールの実行確認で自動的に許可するツール名
+            auto_approve_patterns: 同じく自動的に許可するツール名の正規表現（名前全体に一致させる）
+            stop_timeout: 応答を途中でやめたときに、アプリの生成が止まるのを待つ時間（秒）
+            prewarm: True なら fresh な要求の応答が終わるたびに、次のプロンプト用の新しいチャットを
+                裏で開いておく。開いたチャットで続きを話すことはできなくなるので、会話を続ける用途では使わない。
+                replay では使われない
+            upload_threshold: これより長い（文字数）プロンプトは JSON の op に入れず、分割して送ってから貼り付ける
+            upload_chunk_size: プロンプトや添付ファイルを分割して送るときの 1 フレームのバイト数
+            resume_timeout: ページとの接続が切れたとき、同じページが再接続して続きを送ってくるのを待つ時間（秒）。
+                過ぎたら待っている op や応答を ConnectionError で失敗させる。0 なら切れた時点で失敗させる
+        """
+        self.stop_timeout = stop_timeout
+        self.prewarm = prewarm and replay is None
+        self.upload_threshold = upload_threshold
+        self.upload_chunk_size = upload_chunk_size
+        self.resume_timeout = resume_timeout
+        self.auto_approve_tools = list(auto_approve_tools)
+        self.auto_approve_patterns = list(auto_approve_patterns)
+        # set_auto_approve で変えたら、再接続したページにも送り直す
+        self._auto_approve_changed = False
+
+        self.process = None
+        if not attach and replay is None:
+            # Windows 専用の依存を読み込むのは実際に起動するときだけにする
+            from claude_inspect.process import ClaudeDesktopProcess
+
+            exe_path = os.path.expandvars(exe_path)
+
+            if not wd:
+                wd = _get_wd(exe_path)
+
+            self.process = ClaudeDesktopProcess(
+                exe_path,
+                wd,
+                _load_script_inject(addr, port, self.auto_approve_tools, self.auto_approve_patterns),
+                backend=backend,
+                ready=self.wait_connected,
+                inject_mode=inject_mode,
+                debugging_port=debugging_port,
+            )
 
         self.addr = addr
         self.port = port
         # self._server = None
 
-        self.q_in: asyncio.Queue[dict] = asyncio.Queue(4)
-        self.q_out: asyncio.Queue[bytes] = asyncio.Queue(4)
+        self.q_in: asyncio.Queue[dict | bytes] = asyncio.Queue(4)
         self.__CLOSE = object()
 
-    async def __handler(self, ws: websockets.ServerConnection):
+        # op id ごとの応答と、op が開始する SSE ストリームの待ち合わせ
+        self._ids = itertools.count(1)
+        self._results: dict[int, asyncio.Future] = {}
+        self._stream_owners: dict[int, asyncio.Future[Stream]] = {}
+        self._streams: dict[int, Stream] = {}
+        self.buffer = buffer or BufferConfig()
+        if self.buffer.policy == "drop":
+            # 途中のチャンクが抜けると SSEParser がイベントをつなぎ間違え、壊れた応答を返してしまう
+            raise ValueError('policy="drop" cannot be used for the buffers that communicate reads; use "block" or "spill"')
+        self.batching = batching
+        self.compression = compression
+        # 接続してきたページが対応している機能
+        self.page_features: set[str] = set()
+        self.record = record
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.replay_passive = replay_passive
+        self._recorder: FrameRecorder | None = None
+        self.cache = cache
+        # 今のチャットの文脈。new_chat で開いたチャットでなければ None
+        self._chat_context: dict | None = None
+        self._chat_turns = 0
+        # 今のチャットにまだ何も送っていなければ True。fresh な要求はそのまま使える
+        self._chat_empty = False
+        # 名前で開いたプロジェクト -> UUID。new_chat が返した URL から覚える
+        self._project_ids: dict[str, str] = {}
+        # 次のプロンプト用にチャットを開いておくタスクと、そのプロジェクト
+        self._prewarm_task: asyncio.Task | None = None
+        self._prewarm_project: str | None = None
+        self.observers: list[ClientObserver] = list(observers)
+        # ページが報告した op の処理時間（秒）。observers があるときだけ記録する
+        self._page_elapsed: dict[int, float] = {}
+        # 終わったストリームのバッファの統計を合算したもの
+        self.buffer_stats = BufferStats()
+        self._connected = asyncio.Event()
+        # チャット欄は 1 つしかないので put_chat から応答の終わりまでは直列化する
+        self._chat_lock = asyncio.Lock()
+        self._upload_lock = asyncio.Lock()
+        self._last_cached = False
+        # 読んでいる途中の応答のストリームと、cancel() で止めたかどうか
+        self._active_stream: Stream | None = None
+        self._cancel_requested = False
+        # 中継されたすべてのストリームの購読（subscribe）
+        self.tap = Tap()
+        # 再接続したページから続きを受け取る（"resume"）ための、ページのセッションと受け取ったフレームの数
+        self._session: str | None = None
+        self._seq = 0
+        self._acked = 0
+        # ページに送ったが応答がまだの op。切断中に届かなかったものは再接続後に送り直す
+        self._in_flight: dict[int, dict] = {}
+        self._unsent: dict[int, dict] = {}
+        # 切断後、同じページの再接続を待っている間だけ設定される
+        self._resume_timer: asyncio.TimerHandle | None = None
+        self._resume_task: asyncio.Task | None = None
+
+    async def __handler(self, ws: "websockets.ServerConnection"):
+        from websockets.exceptions import ConnectionClosedError
+
         async def to_claude():
             while True:
                 v = await self.q_in.get()
                 if v is self.__CLOSE:
                     break
-                logger.info(f"to claude: {v}")
-                await ws.send(json.dumps(v))
+                if isinstance(v, bytes):
+                    # 大きな入力の一部。upload_frames を参照
+                    logger.debug(f"to claude: {len(v)} bytes")
+                    await ws.send(v)
+                    if self._recorder is not None:
+                        self._recorder.write(SENT, v)
+                    continue
+                if "id" in v:
+                    self._in_flight[v["id"]] = v
+                    logger.info(f"to claude: {v}")
+                else:
+                    logger.debug(f"to claude: {v}")
+                data = json.dumps(v)
+                await ws.send(data)
+                if self._recorder is not None:
+                    self._recorder.write(SENT, data)
 
         async def from_claude():
             async for msg in ws:
                 logger.debug(f"from claude: {msg}")
-                assert isinstance(msg, bytes), msg
-                await self.q_out.put(msg)
-
+                if self._recorder is not None:
+                    self._recorder.write(RECV, msg)
+                if isinstance(msg, str):
+                    obj = json.loads(msg)
+                    # ping 以外のフレームにはページが順に番号を振っている
+                    if obj.get("type") != "ping":
+                        self._seq += 1
+                    await self._on_control(obj)
+                else:
+                    self._seq += 1
+                    await self._on_chunk(msg)
+                if self._seq - self._acked >= _ACK_INTERVAL and "resume" in self.page_features:
+                    self._acked = self._seq
+                    await self.q_in.put({"ack": self._seq})
+
+        tasks = [asyncio.create_task(to_claude()), asyncio.create_task(from_claude())]
         try:
-            await asyncio.gather(to_claude(), from_claude())
-        except websockets.exceptions.ConnectionClosedError:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        except ConnectionClosedError:
             # connection closed
             pass
         except Exception as e:
             logger.exception("handler error")
-
-    @overload
-    async def get(self, *, get_ping=False) -> bytes: ...
-
-    @overload
-    async def get(self, timeout: float, *, get_ping=False) -> bytes | None: ...
-
-    async def get(self, timeout: float | None = None, *, get_ping=False) -> bytes | None:
-        t0 = time.time()
-        while timeout is None or time.time() - t0 < timeout:
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._on_disconnect()
+
+    async def _on_control(self, msg: dict):
+        match msg.get("type"):
+            case "ping":
+                self.page_features = set(msg.get("features", ()))
+                self._on_page_connected(msg)
+                if self.batching is not None and "coalesce" in self.page_features:
+                    await self._configure_page()
+                if self._auto_approve_changed and "auto_approve" in self.page_features:
+                    await self._configure_auto_approve()
+                self._connected.set()
+                self._notify("on_connect", self.page_features)
+                if self.prewarm:
+                    self._schedule_prewarm(self._prewarm_project)
+            case "result":
+                self._in_flight.pop(msg["id"], None)
+                result = self._results.pop(msg["id"], None)
+                if result is None or result.done():
+                    return
+                if self.observers and "elapsed_ms" in msg:
+                    self._page_elapsed[msg["id"]] = msg["elapsed_ms"] / 1000
+                if msg.get("ok"):
+                    result.set_result(msg.get("value"))
+                else:
+                    error = json.dumps({"type": "error", "error": msg.get("error")})
+                    result.set_exception(SSEError(f"{self.addr}:{self.port}", error))
+            case "stream":
+                await self._on_stream(msg)
+            case _:
+                logger.warning(f"unknown message: {msg}")
+
+    async def _on_stream(self, msg: dict):
+        stream_id = msg["stream"]
+        if msg.get("state") == "open":
+            waiter = self._stream_owners.pop(msg.get("owner"), None)
+            owned = waiter is not None and not waiter.done()
+            # passive な replay では op を送らないので、記録時に op が開始したかどうかを tap に伝える
+            self.tap.open(stream_id, msg.get("url"), owned or (self.replay_passive and msg.get("owner") is not None))
+            if not owned:
+                # アプリ上で直接開始されたチャットなど、誰も待っていないストリーム。tap にだけ流す
+                logger.debug(f"unclaimed stream: {msg}")
+                self._chat_empty = False
+                return
+            stream = Stream(stream_id, msg.get("owner"), msg.get("url"), self.buffer)
+            self._streams[stream_id] = stream
+            waiter.set_result(stream)
+            self._notify("on_stream_open", stream)
+        else:
+            error = msg.get("error")
+            self.tap.close(stream_id, error)
+            stream = self._release_stream(stream_id)
+            if stream is not None:
+                stream.close(ConnectionError(error) if error else None)
+
+    async def _on_chunk(self, msg: bytes):
+        stream_id = int.from_bytes(msg[:4])
+        data = memoryview(msg)[4:]
+        # 購読者には同じバッファを渡す
+        self.tap.chunk(stream_id, data)
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return
+        await stream.put(data)
+
+    def _on_page_connected(self, msg: dict):
+        """ping を受け取ったときに、切断前の続きを受け取るか、新しいページとして始めるかを決める"""
+        session = msg.get("session")
+        resumable = "resume" in self.page_features
+        resumed = False
+        if self._resume_timer is not None:
+            self._resume_timer.cancel()
+            self._resume_timer = None
+            if resumable and session == self._session:
+                resumed = True
+            else:
+                # 読み込み直されたページ。切断前の op や応答の続きは届かない
+                self._fail_pending(ConnectionError(f"page was reloaded: {self.addr}:{self.port}"))
+        self._session = session
+        unsent, self._unsent = self._unsent, {}
+        if not resumable or self.replay_passive:
+            # passive な replay では resume を送らない。ページが送り直したフレームはログに残っている
+            return
+        if not resumed:
+            # 新しいセッションでは ping より後のフレームから数える
+            self._seq = msg.get("seq", 0)
+        self._acked = self._seq
+        # ページが受け取っていない op は送り直す
+        last_op = msg.get("last_op", 0)
+        ops = [op for op_id, op in sorted(unsent.items()) if op_id > last_op]
+        if resumed:
+            logger.info(f"resuming from frame {self._seq} ({len(ops)} ops to resend): {self.addr}:{self.port}")
+        self._resume_task = asyncio.create_task(self._resume(self._seq, ops))
+
+    async def _resume(self, seq: int, ops: list[dict]):
+        # ページは resume を受け取るまでフレームを送らずに溜めている
+        try:
+            result = await self.call_op("resume", [seq])
+        except (SSEError, ConnectionError) as e:
+            # 続きが残っていなければ、ページは新しいセッションとして接続し直してくる
+            logger.warning(f"failed to resume: {self.addr}:{self.port}: {e!r}")
+            return
+        if result.get("resent"):
+            logger.info(f"page resent {result['resent']} frames: {self.addr}:{self.port}")
+        for op in ops:
+            await self.q_in.put(op)
+
+    def _on_disconnect(self):
+        if self._connected.is_set():
+            self._notify("on_disconnect")
+        self._connected.clear()
+        self._unsent.update(self._in_flight)
+        self._in_flight.clear()
+        if "resume" in self.page_features and self.resume_timeout > 0 and self.replay is None:
+            # 同じページが再接続してくれば続きを受け取れるので、op や応答はしばらく待たせておく
+            if self._resume_timer is None:
+                self._resume_timer = asyncio.get_running_loop().call_later(self.resume_timeout, self._resume_expired)
+            return
+        self._fail_pending(ConnectionError(f"disconnected from Claude: {self.addr}:{self.port}"))
+
+    def _resume_expired(self):
+        self._resume_timer = None
+        self._fail_pending(ConnectionError(f"disconnected from Claude: {self.addr}:{self.port}"))
+
+    def _fail_pending(self, error: ConnectionError):
+        """待っている op と応答をすべて error で失敗させる"""
+        # ページが読み込み直されると、どのチャットを開いているか分からなくなる
+        self._chat_context = None
+        self._chat_empty = False
+        self._unsent.clear()
+        for future in [*self._results.values(), *self._stream_owners.values()]:
+            if not future.done():
+                future.set_exception(error)
+        self._results.clear()
+        self._stream_owners.clear()
+        self.tap.close_all(str(error))
+        for stream_id in list(self._streams):
+            self._release_stream(stream_id).close(error)
+
+    async def _configure_page(self):
+        # 応答は待たない。以降の op より先に届くので、最初のストリームからまとめて送られる
+        msg = {"id": next(self._ids), "op": "configure", "args": [self.batching.to_args()]}
+        await self.q_in.put(msg)
+
+    async def _configure_auto_approve(self):
+        args = [self.auto_approve_tools, self.auto_approve_patterns]
+        await self.q_in.put({"id": next(self._ids), "op": "auto_approve", "args": args})
+
+    def _release_stream(self, stream_id: int) -> Stream | None:
+        stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            self.buffer_stats.merge(stream.buffer.stats)
+            self._notify("on_stream_closed", stream)
+        return stream
+
+    def _notify(self, hook: str, *args):
+        for observer in self.observers:
             try:
-                v = self.q_out.get_nowait()
-                if isinstance(v, bytes) and v.startswith(b"event: ping\n") and not get_ping:
-                    continue
-                return v
-            except asyncio.QueueEmpty:
-                await asyncio.sleep(0.01)
-        return None
+                getattr(observer, hook)(self, *args)
+            except Exception:
+                # 計測の失敗で操作を止めない
+                logger.exception(f"observer {hook} failed")
 
     def clear_input_queue(self):
         while not self.q_in.empty():
             self.q_in.get_nowait()
 
     def clear_output_queue(self):
-        while not self.q_out.empty():
-            self.q_out.get_nowait()
+        for stream_id in list(self._streams):
+            self._release_stream(stream_id).discard()
 
     def clear_queue(self):
         self.clear_input_queue()
         self.clear_output_queue()
 
-    async def serve_communicate(self, message: str) -> AsyncIterator[str]:
-        with self.serve():
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    async def wait_connected(self, timeout: float | None = None) -> bool:
+        try:
+            async with asyncio.timeout(timeout):
+                await self._connected.wait()
+        except TimeoutError:
+            return False
+        return True
+
+    async def serve_communicate(self, message: str) -> AsyncIterator[ServerSentEvent]:
+        async with self.serve():
             async for msg in self.communicate(message):
                 yield msg
 
     @asynccontextmanager
-    async def serve(self):
-        async with websockets.serve(self.__handler, self.addr, self.port):
-            logger.info("websocket server launched")
+    async def _listen(self):
+        if self.replay is not None:
+            async with self._replay():
+                yield
+            return
+
+        # replay では使わないので、サーバを立てるときに読み込む
+        import websockets
 
-            # wait for inject.js
-            ping = await self.get(1.1, get_ping=True)
-            if ping is None or not ping.startswith(b"event: ping"):
-                logger.error("Failed to connect to Claude")
-                raise RuntimeError("Failed to connect to Claude")
+        with FrameRecorder(self.record) if self.record else nullcontext() as recorder:
+            self._recorder = recorder
+            try:
+                async with websockets.serve(self.__handler, self.addr, self.port, compression=self.compression):
+                    logger.info("websocket server launched")
+                    try:
+                        yield
+                    finally:
+                        await self._cancel_prewarm()
+                        if self._resume_task is not None:
+                            self._resume_task.cancel()
+                        self.clear_input_queue()
+            finally:
+                self._recorder = None
+                if self._resume_timer is not None:
+                    # サーバを閉じたので、ページが戻ってくることはない
+                    self._resume_timer.cancel()
+                    self._resume_expired()
 
+    @asynccontextmanager
+    async def _replay(self):
+        log = FrameLog(self.replay)
+        task = asyncio.create_task(self._replay_frames(log))
+        try:
             yield
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            self.clear_queue()
+            log.close()
+
+    async def _replay_frames(self, log: FrameLog):
+        """ログの受信フレームを websocket の代わりに流し込む
+
+        記録された op の id は、実際に送られた op の id に順に対応付けて書き換える。
+        replay_passive なら記録された op は待たずに読み飛ばし、送られた op はすぐに失敗させる。
+        """
+        loop = asyncio.get_running_loop()
+        speed = self.replay_speed
+        # 記録時の id -> 今回の id
+        ids: dict[int, int] = {}
+        live = None
+        t_start = None
+        passive = None
+        if self.replay_passive:
+            passive = asyncio.create_task(self._fail_sent(ConnectionError(f"passive replay: {self.replay}")))
+        try:
+            for frame in log:
+                if speed:
+                    if t_start is None:
+                        t_start = loop.time() - frame.t / speed
+                    delay = t_start + frame.t / speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                if frame.direction == SENT:
+                    if frame.binary or passive is not None:
+                        # 大きな入力の一部はページが応答しないので対応付けるものがない
+                        continue
+                    recorded = json.loads(frame.text)
+                    if "op" not in recorded:
+                        # ack
+                        continue
+                    while True:
+                        live = live or await self.q_in.get()
+                        if live is self.__CLOSE:
+                            return
+                        if isinstance(live, bytes) or "op" not in live:
+                            live = None
+                            continue
+                        if live["op"] == recorded["op"]:
+                            ids[recorded["id"]] = live["id"]
+                            live = None
+                            break
+                        if live["op"] == "configure":
+                            # 記録時とページ側の設定が違うだけなので捨てる
+                            live = None
+                            continue
+                        if recorded["op"] != "configure":
+                            logger.warning(f"replay mismatch: recorded {recorded['op']}, sent {live['op']}")
+                        break
+                    if speed:
+                        # 利用者の入力を待った時間は再生の間隔に含めない
+                        t_start = loop.time() - frame.t / speed
+                elif frame.binary:
+                    await self._on_chunk(frame.payload)
+                else:
+                    msg = json.loads(frame.text)
+                    if msg.get("type") == "result":
+                        msg["id"] = ids.get(msg["id"], -1)
+                    elif msg.get("type") == "stream" and msg.get("owner") is not None:
+                        msg["owner"] = ids.get(msg["owner"], -1)
+                    await self._on_control(msg)
+        finally:
+            if passive is not None:
+                passive.cancel()
+            self._on_disconnect()
+        logger.info(f"replay finished: {self.replay}")
+
+        # ログを読み切った後の op は失敗させる
+        await self._fail_sent(ConnectionError(f"replay finished: {self.replay}"), live)
+
+    async def _fail_sent(self, error: Exception, live: dict | bytes | None = None):
+        """replay で、ページに届かない op を error で失敗させる。閉じられるまで続ける"""
+        while (msg := live or await self.q_in.get()) is not self.__CLOSE:
+            live = None
+            if isinstance(msg, bytes) or "id" not in msg:
+                continue
+            for futures in (self._results, self._stream_owners):
+                future = futures.pop(msg["id"], None)
+                if future is not None and not future.done():
+                    future.set_exception(error)
 
-    async def communicate(self, message: str) -> AsyncIterator[ServerSentEvent]:
-        self.clear_queue()
+    async def _wait_inject(self):
+        # wait for inject.js
+        if not await self.wait_connected(1.1):
+            logger.error("Failed to connect to Claude")
+            raise RuntimeError("Failed to connect to Claude")
 
-        await self.put_chat(message)
-        await self.apply_chat()
+    @asynccontextmanager
+    async def serve(self):
+        async with self._listen():
+            await self._wait_inject()
+            yield
+
+    async def communicate(
+        self,
+        message: str,
+        *,
+        cache: bool = True,
+        timeout: float | None = None,
+        fresh: bool = False,
+        project: str | None = None,
+        attachments: Iterable[Attachment] = (),
+    ) -> AsyncIterator[ServerSentEvent]:
+        """message を送り、応答の SSE イベントを返す
+
+        途中で閉じる（aclose される、キャンセルされる）と、アプリの生成を止めてから戻る。
+        break で抜ける場合は contextlib.aclosing で囲むとその場で止まる。
+
+        Args:
+            cache: False なら Client にキャッシュが設定されていても使わない
+            timeout: 応答の終わりまでの期限（秒）。過ぎたら生成を止めて TimeoutError を送出する
+            fresh: True なら新しいチャットで送る。prepare_chat や prewarm で開いておいたチャットがあればそれを使う
+            project: 新しいチャットを開くプロジェクトの UUID か名前。指定すると fresh になる
+            attachments: message と一緒に送る添付ファイル
+        """
+        async with aclosing(self._communicate(message, None, cache, timeout, fresh, project, attachments)) as events:
+            async for event in events:
+                yield event
+
+    async def events(
+        self,
+        message: str,
+        *,
+        cache: bool = True,
+        timeout: float | None = None,
+        fresh: bool = False,
+        project: str | None = None,
+        attachments: Iterable[Attachment] = (),
+    ) -> AsyncIterator[Event]:
+        """communicate と同じだが、data を必要になるまでパースしない型付きのイベントを返す"""
+        async with aclosing(self._communicate(message, make_event, cache, timeout, fresh, project, attachments)) as events:
+            async for event in events:
+                yield event
+
+    async def stream_text(
+        self,
+        message: str,
+        *,
+        cache: bool = True,
+        timeout: float | None = None,
+        fresh: bool = False,
+        project: str | None = None,
+        attachments: Iterable[Attachment] = (),
+    ) -> AsyncIterator[str]:
+        """応答のテキストだけを届いた順に返す"""
+        async with aclosing(self._communicate(message, make_event, cache, timeout, fresh, project, attachments)) as events:
+            async for event in events:
+                if type(event) is ContentBlockDelta and (text := event.text) is not None:
+                    yield text
+
+    async def complete(
+        self,
+        message: str,
+        *,
+        thinking: bool = False,
+        tool_use: bool = False,
+        cache: bool = True,
+        timeout: float | None = None,
+        fresh: bool = False,
+        project: str | None = None,
+        attachments: Iterable[Attachment] = (),
+    ) -> Completion:
+        """応答を最後まで受け取ってまとめて返す
+
+        Args:
+            thinking: 思考過程のテキストも集める
+            tool_use: ツール呼び出しのブロックも集める
+            cache: False なら Client にキャッシュが設定されていても使わない
+            timeout: 応答の終わりまでの期限（秒）。過ぎたら生成を止めて TimeoutError を送出する
+            fresh: True なら新しいチャットで送る
+            project: 新しいチャットを開くプロジェクトの UUID か名前。指定すると fresh になる
+            attachments: message と一緒に送る添付ファイル
+        """
+        texts: list[str] = []
+        thoughts: list[str] = []
+        # content block の index -> (tool_use ブロック, 入力の JSON 断片)
+        tools: dict[int, tuple[dict, list[str]]] = {}
+        stop_reason = None
+        async with aclosing(self._communicate(message, make_event, cache, timeout, fresh, project, attachments)) as events:
+            async for event in events:
+                match event:
+                    case ContentBlockDelta():
+                        if (text := event.text) is not None:
+                            texts.append(text)
+                        elif thinking and (text := event.thinking) is not None:
+                            thoughts.append(text)
+                        elif tool_use and (text := event.partial_json) is not None and event.index in tools:
+                            tools[event.index][1].append(text)
+                    case ContentBlockStart() if tool_use:
+                        block = event.content_block
+                        if block.get("type") == "tool_use":
+                            tools[event.index] = (dict(block), [])
+                    case MessageDelta():
+                        stop_reason = event.stop_reason
+
+        tool_uses = []
+        for block, parts in tools.values():
+            if parts:
+                block["input"] = json.loads("".join(parts))
+            tool_uses.append(block)
+        return Completion(
+            text="".join(texts),
+            stop_reason=stop_reason,
+            thinking="".join(thoughts) if thinking else None,
+            tool_uses=tool_uses,
+        )
 
-        decoder = SSEDecoder()
+    def _cache_key(self, message: str, attachments: tuple[Attachment, ...] = ()) -> str | None:
+        # new_chat で開いたばかりのチャットでなければ、アプリ側の会話の中身が分からないので使わない
+        if self._chat_context is None or self._chat_turns > 0:
+            return None
+        context = self._chat_context
+        if attachments:
+            context = {**context, "attachments": [a.digest() for a in attachments]}
+        return self.cache.key(message, context)
 
+    async def _communicate(
+        self,
+        message: str,
+        factory: Callable | None,
+        use_cache: bool = True,
+        timeout: float | None = None,
+        fresh: bool = False,
+        project: str | None = None,
+        attachments: Iterable[Attachment] = (),
+    ) -> AsyncIterator[Any]:
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        fresh = fresh or project is not None
+        attachments = tuple(attachments)
+        if not self.observers:
+            async with aclosing(self._communicate_inner(message, factory, use_cache, deadline, fresh, project, attachments)) as events:
+                async for event in events:
+                    yield event
+            return
+
+        t0 = time.perf_counter()
+        last_token = None
+        tokens = 0
+        outcome = "cancelled"
         try:
-            while True:
-                msg = await self.get()
-                msg = msg.decode()
-                for line in msg.splitlines():
-                    event = decoder.decode(line)
-                    if not event:
-                        continue
-                    if event.event == "message_stop":
-                        yield event
-                        return
-                    if event.event == "error":
-                        raise SSEError(f"{self.addr}:{self.port}", event.data)
+            async with aclosing(self._communicate_inner(message, factory, use_cache, deadline, fresh, project, attachments)) as events:
+                async for event in events:
+                    if event.event == "content_block_delta":
+                        now = time.perf_counter()
+                        if last_token is None:
+                            self._notify("on_first_token", now - t0)
+                        else:
+                            self._notify("on_token", now - last_token)
+                        last_token = now
+                        tokens += 1
+                    elif event.event == "message_stop":
+                        outcome = "cached" if self._last_cached else "ok"
+                    yield event
+        except TimeoutError:
+            outcome = "timeout"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self._notify("on_response", time.perf_counter() - t0, tokens, outcome)
+
+    async def _communicate_inner(
+        self,
+        message: str,
+        factory: Callable | None,
+        use_cache: bool,
+        deadline: float | None,
+        fresh: bool = False,
+        project: str | None = None,
+        attachments: Iterable[Attachment] = (),
+    ) -> AsyncIterator[Any]:
+        try:
+            async with aclosing(
+                self._communicate_locked(message, factory, use_cache, deadline, fresh, project, attachments)
+            ) as events:
+                async for event in events:
                     yield event
         finally:
-            self.q_in.put_nowait(self.__CLOSE)
+            if fresh and self.prewarm:
+                # 応答を返し終えてから、次のプロンプト用のチャットを開く
+                self._schedule_prewarm(project)
+
+    async def _communicate_locked(
+        self,
+        message: str,
+        factory: Callable | None,
+        use_cache: bool,
+        deadline: float | None,
+        fresh: bool,
+        project: str | None,
+        attachments: tuple[Attachment, ...],
+    ) -> AsyncIterator[Any]:
+        async with self._chat_lock:
+            self._last_cached = False
+            if fresh:
+                if self._is_prepared(project):
+                    self._chat_turns = 0
+                else:
+                    async with asyncio.timeout_at(deadline):
+                        await self.new_chat(project)
+            key = None
+            if self.cache is not None:
+                key = self._cache_key(message, attachments) if use_cache else None
+                if key is None:
+                    self.cache.stats.bypassed += 1
+                elif (body := await self.cache.get(key)) is not None:
+                    # アプリには送っていないので、このチャットの続きはキャッシュの対象にしない
+                    self._chat_turns += 1
+                    self._last_cached = True
+                    for event in SSEParser(factory).feed(body):
+                        yield event
+                        if event.event == "message_stop":
+                            break
+                    return
+
+            async with asyncio.timeout_at(deadline):
+                await self.put_chat(message)
+                for attachment in attachments:
+                    await self.attach(attachment)
+                stream = await self._call_stream("apply_chat", [])
+            self._chat_turns += 1
+            self._chat_empty = False
+            self._active_stream = stream
+            self._cancel_requested = False
+
+            parser = SSEParser(factory)
+            chunks = [] if key is not None else None
+            observe = bool(self.observers)
+            last_chunk = None
+            loop = asyncio.get_running_loop()
+            done = False
+
+            try:
+                while True:
+                    try:
+                        chunk = await stream.get(None if deadline is None else max(deadline - loop.time(), 0))
+                    except ConnectionError:
+                        if self._cancel_requested:
+                            # cancel() で止めたときにページ側が読み込みの中断を伝えてくることがある
+                            return
+                        raise
+                    if chunk is None:
+                        raise TimeoutError(f"response timed out: {self.addr}:{self.port}")
+                    if not chunk:
+                        # cancel() で止められた場合も、message_stop なしでここに来る
+                        done = True
+                        return
+                    if observe:
+                        now = time.perf_counter()
+                        self._notify("on_chunk", len(chunk), None if last_chunk is None else now - last_chunk)
+                        last_chunk = now
+                    if chunks is not None:
+                        chunks.append(chunk)
+                    for event in parser.feed(chunk):
+                        if event.event == "message_stop":
+                            done = True
+                            if chunks is not None:
+                                await self.cache.put(key, b"".join(chunks))
+                            yield event
+                            return
+                        if event.event == "error":
+                            done = True
+                            raise SSEError(f"{self.addr}:{self.port}", event.data)
+                        yield event
+            finally:
+                self._active_stream = None
+                if not done and self._streams.get(stream.id) is stream:
+                    # 読み手がいなくなってもアプリは生成を続けるので、止めてから次の要求に渡す
+                    await self._stop_generation(stream)
+                if self._release_stream(stream.id) is not None:
+                    stream.discard()
+
+    async def _stop_generation(self, stream: Stream):
+        """アプリの生成を止め、ストリームが閉じるまで読み捨てる"""
+        try:
+            async with asyncio.timeout(self.stop_timeout):
+                await self.call_op("stop_generation", [])
+                try:
+                    while await stream.get():
+                        pass
+                except ConnectionError:
+                    # 止めるとページ側の読み込みは中断されたことになる
+                    pass
+        except (TimeoutError, ConnectionError, SSEError) as e:
+            logger.warning(f"failed to stop generation: {self.addr}:{self.port}: {e!r}")
+
+    async def cancel(self) -> bool:
+        """生成中の応答をアプリで止める。communicate などは message_stop を待たずに終わる
+
+        生成中でなければ何もせず False を返す。
+        """
+        if self._active_stream is None:
+            return False
+        self._cancel_requested = True
+        await self.call_op("stop_generation", [])
+        return True
 
     @asynccontextmanager
     async def run(self):
-        with self.process:
-            async with self.serve():
-                try:
-                    yield self
-                finally:
-                    await self.q_in.put(self.__CLOSE)
+        # 起動中に注入されたスクリプトが接続できるよう、先にサーバを立てておく
+        async with self._listen():
+            async with self.process or nullcontext():
+                await self._wait_inject()
+                yield self
 
     #
     # operations
     #
 
     async def apply_chat(self):
-        async for event in self.call_op("apply_chat", []):
-            if event.event == "error":
-                raise SSEError(f"{self.addr}:{self.port}", event.data)
+        await self.call_op("apply_chat", [])
 
     async def put_chat(self, text: str):
-        async for event in self.call_op("put_chat", [text]):
-            if event.event == "error":
-                raise SSEError(f"{self.addr}:{self.port}", event.data)
+        """チャット欄の内容を text に置き換える
+
+        upload_threshold 文字を超える text は、分割して送ってからエディタに貼り付ける。
+        """
+        if len(text) > self.upload_threshold and "upload" in self.page_features:
+            await self._paste(text.encode(), {"as": "text"})
+            return
+        await self.call_op("put_chat", [text])
+
+    async def attach(self, attachment: Attachment):
+        """チャット欄にファイルを添付する"""
+        options = {"as": "file", "name": attachment.name, "type": attachment.mime_type}
+        await self._paste(attachment.data, options)
+
+    async def _paste(self, data: bytes, options: dict) -> dict:
+        """data をバイナリフレームに分けて送り、paste op でエディタに貼り付ける"""
+        if "upload" not in self.page_features:
+            error = {"type": "not_supported_error", "message": "the page does not support uploads; inject the script again"}
+            raise SSEError(f"{self.addr}:{self.port}", json.dumps({"type": "error", "error": error}))
+        # ページは受け取り途中の upload を id の順に片付けるので、1 つずつ送る
+        async with self._upload_lock:
+            upload_id = next(self._ids)
+            for frame in upload_frames(upload_id, data, self.upload_chunk_size):
+                await self.q_in.put(frame)
+            result = await self.call_op("paste", [upload_id, options])
+        if result.get("bytes") != len(data):
+            # 途中のフレームがページに届かなかった
+            raise ConnectionError(f"upload {upload_id} was truncated: {result.get('bytes')} of {len(data)} bytes: {self.addr}:{self.port}")
+        return result
 
     async def clear_chat(self):
-        async for event in self.call_op("clear_chat", []):
-            if event.event == "error":
-                raise SSEError(f"{self.addr}:{self.port}", event.data)
-
-    async def call_op(self, name: str, args: list):
-        self.clear_queue()
-        await self.q_in.put({"op": name, "args": args})
-        result = await self.get(get_ping=True)
-        decoder = SSEDecoder()
-        for line in result.decode().splitlines():
-            event = decoder.decode(line)
-            if not event:
-                continue
-            yield event
+        await self.call_op("clear_chat", [])
+
+    async def new_chat(self, project_id: str | None = None) -> str:
+        """新しいチャットを開き、その URL のパスを返す
+
+        project_id はプロジェクトの UUID か名前。名前で開いたプロジェクトは UUID を覚えておき、
+        次からはプロジェクトの一覧から名前で探さずに開く。
+        """
+        target = self._project_ids.get(project_id, project_id) if project_id else project_id
+        try:
+            location = await self.call_op("new_chat", [target])
+        except SSEError:
+            # プロジェクトが消えたなど。次は名前で探し直す
+            if project_id is not None:
+                self._project_ids.pop(project_id, None)
+            raise
+        if project_id and (m := re.match(r"/project/([^/?#]+)", location or "")):
+            self._project_ids[project_id] = m.group(1)
+        self._chat_context = {"project": project_id}
+        self._chat_turns = 0
+        self._chat_empty = True
+        return location
+
+    def _is_prepared(self, project_id: str | None) -> bool:
+        return self._chat_empty and self._chat_context == {"project": project_id}
+
+    async def prepare_chat(self, project_id: str | None = None) -> bool:
+        """次の fresh な要求のために新しいチャットを開いておく
+
+        既に何も送っていないチャットが開いていれば何もせず False を返す。
+        """
+        async with self._chat_lock:
+            if self._is_prepared(project_id):
+                return False
+            await self.new_chat(project_id)
+            return True
+
+    def _schedule_prewarm(self, project_id: str | None):
+        self._prewarm_project = project_id
+        if self._prewarm_task is None or self._prewarm_task.done():
+            self._prewarm_task = asyncio.create_task(self._prewarm())
+
+    async def _prewarm(self):
+        try:
+            await self.prepare_chat(self._prewarm_project)
+        except (ConnectionError, SSEError) as e:
+            logger.warning(f"failed to prepare a chat: {self.addr}:{self.port}: {e!r}")
+
+    async def _cancel_prewarm(self):
+        task, self._prewarm_task = self._prewarm_task, None
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def subscribe(self, max_bytes: int = 1 << 20, *, owned: bool = True) -> TapSubscription:
+        """ページが中継するすべての SSE を、アプリ上で直接始まったチャットも含めて受け取る
+
+        購読者はいくつあってもよく、フレームはコピーせずに共有される。読むのが遅れて max_bytes を超えた
+        chunk はその購読者についてだけ捨てられ、Client や他の購読者を待たせることはない。
+        使い終わったら close() するか with 文で囲む。
+
+        Args:
+            max_bytes: 読まれていない chunk のバイト数の上限
+            owned: False なら communicate などこの Client の要求が開始したストリームは除く
+        """
+        return self.tap.subscribe(max_bytes, owned=owned)
+
+    async def set_auto_approve(
+        self,
+        tools: Iterable[str] | None = None,
+        patterns: Iterable[str] | None = None,
+    ) -> dict:
+        """自動的に許可する MCP ツールを差し替える。None を渡したものは変えない
+
+        再接続したページにも引き継がれる。ページ側の現在の設定を返す。
+        """
+        if tools is not None:
+            self.auto_approve_tools = list(tools)
+        if patterns is not None:
+            self.auto_approve_patterns = list(patterns)
+        self._auto_approve_changed = True
+        return await self.call_op("auto_approve", [self.auto_approve_tools, self.auto_approve_patterns])
+
+    async def auto_approve_stats(self, baseline: bool | None = None) -> dict:
+        """auto-approve.js の統計。observer が呼ばれた回数 (body_callbacks, portal_callbacks) と
+        その合計時間 (observer_ms)、承認したダイアログの数など
+
+        Args:
+            baseline: True にすると、以降 body 全体を監視する元の observer が呼ばれたはずの回数
+                (baseline_callbacks, baseline_mutations) と時間 (baseline_ms) も数える。その間は元の
+                observer と同じだけの負荷がかかるので、比べ終えたら False で止める。None なら変えない
+        """
+        return await self.call_op("auto_approve_stats", [] if baseline is None else [baseline])
+
+    async def ping(self, timeout: float | None = None) -> bool:
+        try:
+            async with asyncio.timeout(timeout):
+                await self.call_op("ping", [])
+        except (TimeoutError, ConnectionError, SSEError):
+            return False
+        return True
+
+    async def call_op(self, name: str, args: list, *, timeout: float | None = None) -> Any:
+        """op を送り、その op の応答を待って戻り値を返す。失敗時は SSEError を送出する
+
+        異なる op は並行に呼び出せる。timeout 秒を過ぎたら TimeoutError を送出する（ページ側の op は止まらない）。
+        """
+        op_id = next(self._ids)
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            async with asyncio.timeout(timeout):
+                result, _ = await self._send_op(op_id, name, args)
+                value = await result
+            ok = True
+            return value
+        finally:
+            self._results.pop(op_id, None)
+            self._in_flight.pop(op_id, None)
+            self._unsent.pop(op_id, None)
+            self._op_done(op_id, name, t0, ok)
+
+    async def _call_stream(self, name: str, args: list) -> Stream:
+        """op を送り、その op が開始する SSE ストリームを返す"""
+        op_id = next(self._ids)
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            result, waiter = await self._send_op(op_id, name, args, stream=True)
+            # op の応答より先にストリームが始まることがあるので両方を待つ
+            await asyncio.wait([result, waiter], return_when=asyncio.FIRST_COMPLETED)
+            if not waiter.done():
+                await result
+            stream = await waiter
+            ok = True
+            return stream
+        finally:
+            self._results.pop(op_id, None)
+            self._stream_owners.pop(op_id, None)
+            self._in_flight.pop(op_id, None)
+            self._unsent.pop(op_id, None)
+            self._op_done(op_id, name, t0, ok)
+
+    def _op_done(self, op_id: int, name: str, t0: float, ok: bool):
+        page_elapsed = self._page_elapsed.pop(op_id, None)
+        if self.observers:
+            self._notify("on_op", name, time.perf_counter() - t0, ok, page_elapsed)
+
+    async def _send_op(self, op_id: int, name: str, args: list, *, stream: bool = False):
+        loop = asyncio.get_running_loop()
+        msg = {"id": op_id, "op": name, "args": args}
+        result = loop.create_future()
+        self._results[op_id] = result
+        waiter = None
+        if stream:
+            msg["stream"] = True
+            waiter = loop.create_future()
+            self._stream_owners[op_id] = waiter
+        await self.q_in.put(msg)
+        return result, waiter
 
 
 class ReplError(Exception):
@@ -242,9 +1196,80 @@ class Command:
         return f"!{self.op} {' '.join(self.args)}"
 
 
+class LineReader:
+    """入力を別スレッドで 1 行ずつ読み、イベントループを止めずに渡す
+
+    prompt を与えると対話用になり、readline() が呼ばれるたびにプロンプトを出して 1 行読む。
+    省略すると paths のファイル（"-" は標準入力）を順に先読みし、max_lines 行まで溜めておく。
+    """
+
+    def __init__(self, paths: Iterable[str] = (), *, prompt: str | None = None, max_lines: int = 64):
+        self.paths = list(paths) or ["-"]
+        self.prompt = prompt
+        self._queue: asyncio.Queue[str | None] = asyncio.Queue(max_lines)
+        self._wanted = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def interactive(self) -> bool:
+        return self.prompt is not None
+
+    async def readline(self) -> str | None:
+        """次の行を返す。入力が終わったら None を返す"""
+        if self._thread is None:
+            # 入力待ちのまま終了できるように daemon にする
+            loop = asyncio.get_running_loop()
+            self._thread = threading.Thread(target=self._run, args=(loop,), name="repl-input", daemon=True)
+            self._thread.start()
+        self._wanted.set()
+        return await self._queue.get()
+
+    def _lines(self) -> Iterator[str]:
+        if self.interactive:
+            while True:
+                self._wanted.wait()
+                self._wanted.clear()
+                try:
+                    yield input(self.prompt)
+                except EOFError:
+                    # Ctrl+D、Windows では Ctrl+Z か、input() 中の Ctrl+C
+                    return
+        for path in self.paths:
+            if path == "-":
+                yield from (line.rstrip("\r\n") for line in sys.stdin)
+                continue
+            with open(path, encoding="utf-8") as f:
+                yield from (line.rstrip("\r\n") for line in f)
+
+    def _run(self, loop: asyncio.AbstractEventLoop):
+        def put(line: str | None):
+            asyncio.run_coroutine_threadsafe(self._queue.put(line), loop).result()
+
+        try:
+            for line in self._lines():
+                put(line)
+        except OSError as e:
+            logger.error(f"failed to read input: {e}")
+        except RuntimeError:
+            # イベントループが先に閉じた
+            return
+        try:
+            put(None)
+        except RuntimeError:
+            pass
+
+
 class ClaudeRepl:
-    def __init__(self, client: Client):
+    def __init__(self, client: Client, reader: LineReader | None = None, *, keep_going: bool = False):
+        """
+        Args:
+            reader: 入力。省略すると標準入力から対話的に読む
+            keep_going: 対話的でないとき、エラーが起きても次の行に進む
+        """
         self.client = client
+        self.reader = reader if reader is not None else LineReader(prompt="> ")
+        self.keep_going = keep_going
+        self.errors = 0
         self._context = None
 
     @asynccontextmanager
@@ -252,12 +1277,10 @@ class ClaudeRepl:
         async with self.client.run():
             yield self
 
-    def read(self) -> str:
-        print(">", end=" ", flush=True)
-        message = input()
-        return message
+    async def read(self) -> str | None:
+        return await self.reader.readline()
 
-    async def eval(self, message: str) -> AsyncIterator[str | ServerSentEvent]:
+    async def eval(self, message: str) -> AsyncIterator[str | Event]:
         parsed = self.parse_input(message)
 
         if isinstance(parsed, Command):
@@ -268,9 +1291,15 @@ class ClaudeRepl:
         try:
             async for msg in it:
                 yield msg
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError) as e:
+            # asyncio.run は Ctrl+C でメインタスクをキャンセルする。応答を読むのをやめた時点で
+            # Client がアプリの生成を止めているので、取り消して次の入力を待つ
+            if not self.reader.interactive:
+                # スクリプトは途中から続けても意味がないので、全体を止める
+                raise
+            if isinstance(e, asyncio.CancelledError):
+                asyncio.current_task().uncancel()
             print("interrupt")
-            self.client.clear_queue()
 
     def parse_input(self, message: str) -> str | Command:
         if not message.lstrip().startswith("!"):
@@ -279,41 +1308,49 @@ class ClaudeRepl:
         message = message.lstrip()[1:].strip()
         if len(message) == 0:
             raise ReplError('usage: "!op arg1 arg2 ..."')
-        op, *args = shlex.split(message)
+        try:
+            op, *args = shlex.split(message)
+        except ValueError as e:
+            raise ReplError(str(e)) from e
         return Command(op, args)
 
-    async def eval_command(self, command: Command) -> AsyncIterator[str | ServerSentEvent]:
+    async def eval_command(self, command: Command) -> AsyncIterator[str | Event]:
         try:
-            ok = True
-            async for msg in self.client.call_op(command.op, command.args):
-                if msg.event == "error":
-                    self.client.clear_queue()
-                    logger.error(f"Command Error: {msg.data}")
-                    ok = False
-                    yield msg
-            if ok:
-                yield f"command {command} success"
+            if command.op == "attach":
+                # ファイルの中身は op の引数では送れないので、Client に分割して送らせる
+                for path in command.args:
+                    await self.client.attach(Attachment.from_path(path))
+            else:
+                await self.client.call_op(command.op, command.args)
+        except OSError as e:
+            raise ReplError(str(e)) from e
         except SSEError as e:
+            logger.error(f"Command Error: {e}")
             raise ReplError(str(e)) from e
+        except Exception as e:
+            # 想定外の失敗でも REPL やスクリプトの実行は止めない
+            logger.exception(f"Command Error: {command}")
+            raise ReplError(f"{type(e).__name__}: {e}") from e
+        yield f"command {command} success"
 
-    async def eval_message(self, message: str) -> AsyncIterator[ServerSentEvent]:
+    async def eval_message(self, message: str) -> AsyncIterator[Event]:
         try:
-            async for msg in self.client.communicate(message):
+            async for msg in self.client.events(message):
                 yield msg
-        except SSEError as e:
+        except (SSEError, ConnectionError, TimeoutError) as e:
             raise ReplError(str(e)) from e
 
-    def print(self, msg: str | ServerSentEvent):
+    def print(self, msg: str | Event):
         if isinstance(msg, str):
             print(msg, flush=True)
             return
 
-        assert isinstance(msg, ServerSentEvent), msg
+        assert isinstance(msg, Event), msg
 
         if msg.event == "content_block_delta":
-            data = json.loads(msg.data)
-            text = data["delta"]["text"]
-            print(text.replace("\n\n", "\n"), end="", flush=True)
+            text = msg.text
+            if text is not None:
+                print(text.replace("\n\n", "\n"), end="", flush=True)
         elif msg.event == "content_block_stop":
             print(flush=True)
         elif msg.event == "error":
@@ -326,9 +1363,15 @@ class ClaudeRepl:
         while True:
             try:
                 # read
-                message = self.read()
-                if not message:
+                message = await self.read()
+                if message is None:
+                    if self.reader.interactive:
+                        print("closing...")
+                    return
+                if not message.strip():
                     continue
+                if not self.reader.interactive:
+                    logger.info(f"input: {message}")
 
                 # eval
                 stream = self.eval(message)
@@ -338,32 +1381,70 @@ class ClaudeRepl:
                     self.print(msg)
 
             except ReplError as e:
-                print(f"Error: {e}")
-                continue
-
-            except EOFError:
-                # read() 中に Ctrl+C が押された
-                print("Ctrl+C pressed. closing...")
-                return
-
-            except KeyboardInterrupt:
+                self.errors += 1
+                if self.reader.interactive:
+                    print(f"Error: {e}")
+                    continue
+                print(f"Error: {e}", file=sys.stderr, flush=True)
+                if not self.keep_going:
+                    return
+
+            except (KeyboardInterrupt, asyncio.CancelledError) as e:
+                # read() 中の Ctrl+C。asyncio.run がメインタスクをキャンセルする
+                if isinstance(e, asyncio.CancelledError):
+                    asyncio.current_task().uncancel()
                 print("Ctrl+C pressed. closing...")
                 return
 
 
-async def amain():
-    intp = ClaudeRepl(Client())
+async def amain(args: argparse.Namespace):
+    metrics = ClientMetrics()
+    client = Client(
+        record=args.record,
+        replay=args.replay,
+        replay_speed=args.replay_speed,
+        observers=[metrics] if args.metrics else (),
+        auto_approve_tools=args.auto_approve,
+        auto_approve_patterns=args.auto_approve_pattern,
+    )
+    if args.script or not sys.stdin.isatty():
+        reader = LineReader(args.script)
+    else:
+        reader = LineReader(prompt="> ")
+    intp = ClaudeRepl(client, reader, keep_going=args.keep_going)
+    exporting = metrics.registry.exporting(args.metrics, args.metrics_interval) if args.metrics else nullcontext()
     try:
-        async with intp.run():
+        async with intp.run(), exporting:
             await intp.repl()
     except asyncio.CancelledError:
         print(r"\(^^)/ closed \(^^)/")
+    return 1 if intp.errors and not reader.interactive else 0
 
 
 def main():
-    asyncio.run(amain())
+    parser = argparse.ArgumentParser(description="Claude for Desktop の REPL")
+    parser.add_argument(
+        "script",
+        nargs="*",
+        help="1 行に 1 つのメッセージか !op を書いたファイル（- は標準入力）。指定するか標準入力が端末でなければ、プロンプトを出さずに順に実行する",
+    )
+    parser.add_argument("--keep-going", action="store_true", help="スクリプトの実行中にエラーが起きても次の行に進む")
+    parser.add_argument("--record", help="送受信したフレームをこのファイルに追記する")
+    parser.add_argument("--replay", help="アプリを起動せず、記録したログを再生する")
+    parser.add_argument("--replay-speed", type=float, default=None, help="再生速度。省略時は待たずに再生する")
+    parser.add_argument("--metrics", help="計測値を書き出すファイル。拡張子が .prom なら Prometheus のテキスト形式、それ以外は JSON")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="計測値を書き出す間隔（秒）")
+    parser.add_argument("--auto-approve", action="append", default=[], metavar="TOOL", help="自動的に許可する MCP ツール")
+    parser.add_argument(
+        "--auto-approve-pattern", action="append", default=[], metavar="REGEX", help="自動的に許可する MCP ツール名の正規表現"
+    )
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(amain(args)))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
+    main()
@@ -0,0 +1,183 @@
+import re
+import json
+from json.decoder import scanstring
+from dataclasses import dataclass, field
+from typing import Any, ClassVar
+
+
+class Event:
+    """SSE の 1 イベント。data の JSON は読まれるまでパースしない
+
+    ServerSentEvent と同じく event / data / json() を持つ。
+    """
+
+    __slots__ = ("event", "_raw", "_json")
+
+    type: ClassVar[str | None] = None
+
+    def __init__(self, event: str | None, raw: bytes | bytearray):
+        self.event = event
+        self._raw = raw
+        self._json = None
+
+    @property
+    def raw(self) -> bytes | bytearray:
+        """data フィールドのバイト列"""
+        return self._raw
+
+    @property
+    def data(self) -> str:
+        return self._raw.decode()
+
+    def json(self) -> Any:
+        if self._json is None:
+            self._json = json.loads(self._raw)
+        return self._json
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(event={self.event!r}, data={self.data!r})"
+
+
+class MessageStart(Event):
+    __slots__ = ()
+    type = "message_start"
+
+    @property
+    def message(self) -> dict:
+        return self.json()["message"]
+
+
+class ContentBlockStart(Event):
+    __slots__ = ()
+    type = "content_block_start"
+
+    @property
+    def index(self) -> int:
+        return self.json()["index"]
+
+    @property
+    def content_block(self) -> dict:
+        return self.json()["content_block"]
+
+
+# delta の種類と、その本文が入っているキー
+_DELTA_KEYS = {
+    "text_delta": "text",
+    "thinking_delta": "thinking",
+    "input_json_delta": "partial_json",
+    "signature_delta": "signature",
+}
+# Claude の content_block_delta は {"type":...,"index":n,"delta":{"type":"text_delta","text":"..."}} の並びで届く。
+# この並びなら本文の文字列だけをデコードし、辞書を作らずに済ませる
+_DELTA_MARKERS = {t: f'"type":"{t}","{k}":"' for t, k in _DELTA_KEYS.items()}
+# 空白を挟んで整形されている場合
+_DELTA_PATTERNS = {t: re.compile(rf'"type":\s*"{t}",\s*"{k}":\s*"') for t, k in _DELTA_KEYS.items()}
+_DELTA_TYPE = re.compile(r'"delta":\s*\{\s*"type":\s*"([^"\\]*)"')
+
+
+class ContentBlockDelta(Event):
+    __slots__ = ()
+    type = "content_block_delta"
+
+    @property
+    def index(self) -> int:
+        return self.json()["index"]
+
+    @property
+    def delta(self) -> dict:
+        return self.json()["delta"]
+
+    def _scan(self, delta_type: str) -> str | None:
+        if self._json is None:
+            s = self._raw.decode()
+            marker = _DELTA_MARKERS[delta_type]
+            if (i := s.find(marker)) >= 0:
+                return scanstring(s, i + len(marker))[0]
+            if m := _DELTA_PATTERNS[delta_type].search(s):
+                return scanstring(s, m.end())[0]
+            if (m := _DELTA_TYPE.search(s)) and m.group(1) != delta_type:
+                # 別の種類の delta。同じ種類でキーの並びが違う場合（citations など）は辞書にして読む
+                return None
+        delta = self.json()["delta"]
+        if delta.get("type", "text_delta") != delta_type:
+            return None
+        return delta.get(_DELTA_KEYS[delta_type])
+
+    @property
+    def text(self) -> str | None:
+        """text_delta の本文。ほかの種類の delta なら None"""
+        return self._scan("text_delta")
+
+    @property
+    def thinking(self) -> str | None:
+        return self._scan("thinking_delta")
+
+    @property
+    def partial_json(self) -> str | None:
+        return self._scan("input_json_delta")
+
+
+class ContentBlockStop(Event):
+    __slots__ = ()
+    type = "content_block_stop"
+
+    @property
+    def index(self) -> int:
+        return self.json()["index"]
+
+
+class MessageDelta(Event):
+    __slots__ = ()
+    type = "message_delta"
+
+    @property
+    def stop_reason(self) -> str | None:
+        return self.json()["delta"].get("stop_reason")
+
+    @property
+    def usage(self) -> dict | None:
+        return self.json().get("usage")
+
+
+class MessageStop(Event):
+    __slots__ = ()
+    type = "message_stop"
+
+
+class Ping(Event):
+    __slots__ = ()
+    type = "ping"
+
+
+class Error(Event):
+    __slots__ = ()
+    type = "error"
+
+    @property
+    def error_type(self) -> str:
+        return self.json().get("error", {}).get("type", "unknown")
+
+    @property
+    def message(self) -> str:
+        return self.json().get("error", {}).get("message", "")
+
+
+_EVENT_TYPES: dict[str, type[Event]] = {
+    cls.type: cls
+    for cls in [MessageStart, ContentBlockStart, ContentBlockDelta, ContentBlockStop, MessageDelta, MessageStop, Ping, Error]
+}
+
+
+def make_event(event: str | None, data: bytes | bytearray, id: str | None = None, retry: int | None = None) -> Event:
+    """SSEParser の factory として使う。event の名前に応じた型のイベントを作る"""
+    return _EVENT_TYPES.get(event, Event)(event, data)
+
+
+@dataclass(slots=True)
+class Completion:
+    """Client.complete() の結果"""
+
+    text: str
+    stop_reason: str | None = None
+    thinking: str | None = None
+    tool_uses: list[dict] = field(default_factory=list)
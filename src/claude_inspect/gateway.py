@@ -0,0 +1,463 @@
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import logging
+from contextlib import AsyncExitStack, aclosing
+from dataclasses import dataclass
+from http import HTTPStatus
+
+from claude_inspect.buffer import PageBatching
+from claude_inspect.cache import ResponseCache
+from claude_inspect.client import Client, SSEError
+from claude_inspect.metrics import ClientMetrics
+from claude_inspect.pool import ClientPool
+
+
+logger = logging.getLogger(__name__)
+
+
+# リクエストヘッダとボディの上限
+MAX_HEADER_BYTES = 64 << 10
+MAX_BODY_BYTES = 16 << 20
+
+
+class HTTPError(Exception):
+    """Messages API と同じ形のエラー応答になる例外"""
+
+    def __init__(self, status: HTTPStatus, error_type: str, message: str, headers: dict[str, str] | None = None):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+        self.message = message
+        self.headers = headers or {}
+
+    def body(self) -> dict:
+        return {"type": "error", "error": {"type": self.error_type, "message": self.message}}
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+
+@dataclass
+class MessageRequest:
+    """/v1/messages のリクエストのうち、アプリに渡せる部分
+
+    アプリは会話をチャットとして自分で保持しているので、送るのは最後の user メッセージだけ。
+    インスタンスは呼び出し元をまたいで使い回すので、リクエストごとに新しいチャットを開き、
+    送れない会話の履歴（2 つ以上のメッセージ）は断る。
+    new_chat / project はこのゲートウェイ独自の拡張。new_chat=false を明示すると、インスタンスが
+    開いているチャットに続けて送る（インスタンスを 1 つの呼び出し元で占有するときだけ意味がある）。
+    """
+
+    prompt: str
+    stream: bool = False
+    model: str = "claude-desktop"
+    new_chat: bool = True
+    project: str | None = None
+
+    @classmethod
+    def parse(cls, body: bytes) -> "MessageRequest":
+        try:
+            obj = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid_request_error", f"invalid JSON: {e}") from e
+        if not isinstance(obj, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid_request_error", "request body must be an object")
+        messages = obj.get("messages")
+        if not isinstance(messages, list) or not messages:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid_request_error", "messages: field required")
+        last = messages[-1]
+        if not isinstance(last, dict) or last.get("role") != "user":
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid_request_error", "the last message must be from the user")
+        content = last.get("content")
+        if isinstance(content, list):
+            content = "\n".join(b.get("text", "") for b in content if isinstance(b, dict) and b.get("type") == "text")
+        if not isinstance(content, str) or not content:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid_request_error", "the last message has no text content")
+        new_chat = bool(obj.get("new_chat", True)) or obj.get("project") is not None
+        if new_chat and len(messages) > 1:
+            # 新しいチャットには最後のメッセージしか送れない。黙って落とすと文脈のない応答になる
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST,
+                "invalid_request_error",
+                'conversation history cannot be replayed; send only the last user message, or set "new_chat": false',
+            )
+        return cls(
+            prompt=content,
+            stream=bool(obj.get("stream", False)),
+            model=obj.get("model") or cls.model,
+            new_chat=new_chat,
+            project=obj.get("project"),
+        )
+
+
+class Gateway:
+    """ClientPool の前に置く HTTP サーバ。Messages API 風のリクエストを受けて応答を返す
+
+    リクエストは受付キューに並び、空いた Client から順に処理される。キューが max_queue に達していれば
+    429 を、queue_timeout 秒待っても Client が空かなければ 503 を返す。
+
+    - POST /v1/messages: stream=true なら SSE で、それ以外は Messages API と同じ形の JSON で返す
+    - GET /health: 稼働中のインスタンス数と待ち行列の長さ。稼働中のものがなければ 503
+    - GET /metrics: Prometheus のテキスト形式の計測値
+    """
+
+    def __init__(
+        self,
+        pool: ClientPool,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        max_queue: int = 32,
+        queue_timeout: float = 30.0,
+        request_timeout: float | None = 300.0,
+        metrics: ClientMetrics | None = None,
+    ):
+        """
+        Args:
+            max_queue: Client の空きを待てるリクエスト数。超えた分は 429 で断る
+            queue_timeout: Client の空きを待つ時間（秒）
+            request_timeout: 応答の終わりまでの期限（秒）
+            metrics: Client と共有する計測値。pool の Client の observers にも同じものを渡しておく
+        """
+        self.pool = pool
+        self.host = host
+        self.port = port
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.metrics = metrics or ClientMetrics()
+        self.queued = 0
+        self.inflight = 0
+
+        registry = self.metrics.registry
+        self._requests = registry.counter(
+            "claude_inspect_gateway_requests_total", "HTTP requests by path and status", ["path", "status"]
+        )
+        self._queue_seconds = registry.histogram(
+            "claude_inspect_gateway_queue_seconds", "time spent waiting for an idle instance", ["outcome"]
+        )
+        registry.gauge("claude_inspect_gateway_queued", "requests waiting for an idle instance", fn=lambda: self.queued)
+        registry.gauge("claude_inspect_gateway_inflight", "requests being answered", fn=lambda: self.inflight)
+        registry.gauge("claude_inspect_gateway_instances", "instances that are up", fn=lambda: len(self.pool.clients))
+        self._server: asyncio.Server | None = None
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        logger.info(f"gateway listening on http://{self.host}:{self.port}")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    #
+    # HTTP
+    #
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (request := await self._read_request(reader, writer)) is not None:
+                keep_alive = await self._dispatch(request, writer)
+                if not keep_alive or not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("gateway handler error")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Request | None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                logger.debug("connection closed in the middle of a request")
+            return None
+        except asyncio.LimitOverrunError:
+            await self._send_error(writer, HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "invalid_request_error", "headers too large"))
+            return None
+
+        request_line, *lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = request_line.split(" ", 2)
+        except ValueError:
+            await self._send_error(writer, HTTPError(HTTPStatus.BAD_REQUEST, "invalid_request_error", "malformed request line"))
+            return None
+        headers = {}
+        for line in lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            await self._send_error(writer, HTTPError(HTTPStatus.BAD_REQUEST, "invalid_request_error", "invalid Content-Length"))
+            return None
+        if length > MAX_BODY_BYTES:
+            await self._send_error(writer, HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "request_too_large", "request body too large"))
+            return None
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, path.split("?", 1)[0], headers, body)
+
+    async def _dispatch(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        """リクエストを処理する。同じ接続で次のリクエストを読めるなら True を返す"""
+        match request.method, request.path:
+            case "POST", "/v1/messages":
+                handler = self._messages
+            case "GET", "/health":
+                handler = self._health
+            case "GET", "/metrics":
+                handler = self._metrics
+            case _, "/v1/messages" | "/health" | "/metrics":
+                error = HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "invalid_request_error", f"method not allowed: {request.method}")
+                await self._send_error(writer, error, request.path)
+                return True
+            case _:
+                error = HTTPError(HTTPStatus.NOT_FOUND, "not_found_error", f"not found: {request.path}")
+                # 任意のパスでラベルが増えないようにまとめる
+                await self._send_error(writer, error, "other")
+                return True
+        try:
+            return await handler(request, writer)
+        except HTTPError as e:
+            await self._send_error(writer, e, request.path)
+            return True
+
+    async def _send(
+        self,
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        body: bytes,
+        content_type: str,
+        path: str,
+        headers: dict[str, str] | None = None,
+    ):
+        self._requests.inc(path=path, status=str(status.value))
+        head = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}"]
+        head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: HTTPStatus, obj, path: str, headers: dict[str, str] | None = None):
+        await self._send(writer, status, json.dumps(obj, ensure_ascii=False).encode(), "application/json", path, headers)
+
+    async def _send_error(self, writer: asyncio.StreamWriter, error: HTTPError, path: str = ""):
+        await self._send_json(writer, error.status, error.body(), path, error.headers)
+
+    #
+    # endpoints
+    #
+
+    async def _health(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        instances = len(self.pool.clients)
+        obj = {
+            "status": "ok" if instances else "unavailable",
+            "instances": instances,
+            "idle": self.pool.idle,
+            "queued": self.queued,
+            "inflight": self.inflight,
+        }
+        status = HTTPStatus.OK if instances else HTTPStatus.SERVICE_UNAVAILABLE
+        await self._send_json(writer, status, obj, request.path)
+        return True
+
+    async def _metrics(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        body = self.metrics.registry.render_prometheus().encode()
+        await self._send(writer, HTTPStatus.OK, body, "text/plain; version=0.0.4", request.path)
+        return True
+
+    async def _messages(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        message = MessageRequest.parse(request.body)
+        if self.queued >= self.max_queue:
+            self._queue_seconds.observe(0, outcome="rejected")
+            raise HTTPError(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                "rate_limit_error",
+                f"too many queued requests ({self.queued})",
+                {"Retry-After": str(max(1, round(self.queue_timeout / 2)))},
+            )
+
+        try:
+            response = await self._admit(message, request, writer)
+        except ConnectionError as e:
+            # インスタンスとの接続が切れた。pool は作り直しを始めている
+            if message.stream:
+                return False
+            raise HTTPError(HTTPStatus.BAD_GATEWAY, "api_error", str(e)) from e
+        if response is None:
+            return False
+        # 応答は pool.acquire() を抜けてから書く。呼び出し側の切断をインスタンスの障害と取り違えないように
+        await self._send_json(writer, HTTPStatus.OK, response, request.path)
+        return True
+
+    async def _admit(self, message: MessageRequest, request: Request, writer: asyncio.StreamWriter) -> dict | None:
+        """インスタンスが空くのを待って要求を処理する。ストリームでなければ応答の本文を返す"""
+        t0 = time.perf_counter()
+        self.queued += 1
+        async with AsyncExitStack() as stack:
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    client = await stack.enter_async_context(self.pool.acquire())
+            except TimeoutError:
+                self._queue_seconds.observe(time.perf_counter() - t0, outcome="timeout")
+                raise HTTPError(
+                    HTTPStatus.SERVICE_UNAVAILABLE,
+                    "overloaded_error",
+                    f"no instance became idle within {self.queue_timeout} s",
+                    {"Retry-After": str(max(1, round(self.queue_timeout / 2)))},
+                ) from None
+            finally:
+                self.queued -= 1
+            self._queue_seconds.observe(time.perf_counter() - t0, outcome="admitted")
+
+            self.inflight += 1
+            try:
+                if message.stream:
+                    await self._stream(client, message, request, writer)
+                    return None
+                return await self._complete(client, message)
+            finally:
+                self.inflight -= 1
+
+    async def _complete(self, client: Client, message: MessageRequest) -> dict:
+        try:
+            completion = await client.complete(
+                message.prompt,
+                tool_use=True,
+                timeout=self.request_timeout,
+                fresh=message.new_chat,
+                project=message.project,
+            )
+        except TimeoutError:
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, "timeout_error", "response timed out") from None
+        except SSEError as e:
+            raise HTTPError(HTTPStatus.BAD_GATEWAY, "api_error", str(e)) from e
+        content = [{"type": "text", "text": completion.text}, *completion.tool_uses]
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": message.model,
+            "content": content,
+            "stop_reason": completion.stop_reason,
+            "stop_sequence": None,
+        }
+
+    async def _stream(self, client: Client, message: MessageRequest, request: Request, writer: asyncio.StreamWriter):
+        # 長さが分からないので、送り終えたら接続を閉じて終端を伝える
+        head = "HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        writer.write(head.encode("latin-1"))
+        status = HTTPStatus.OK
+        try:
+            async with aclosing(client.events(
+                message.prompt, timeout=self.request_timeout, fresh=message.new_chat, project=message.project
+            )) as events:
+                async for event in events:
+                    # event: のない SSE は仕様上 "message"
+                    name = event.event.encode() if event.event else b"message"
+                    # 複数行のデータは行ごとに data: を付ける。受け取った側で改行でつなぎ直される
+                    data = b"".join(b"data: " + line + b"\n" for line in bytes(event.raw).split(b"\n"))
+                    writer.write(b"event: " + name + b"\n" + data + b"\n")
+                    try:
+                        await writer.drain()
+                    except ConnectionError:
+                        # 呼び出し側が切断した。events を閉じればアプリの生成も止まる
+                        logger.info(f"caller disconnected during a response from {client.addr}:{client.port}")
+                        return
+        except (TimeoutError, SSEError, ConnectionError) as e:
+            # ヘッダは送ってしまったので、エラーはイベントとして伝える
+            status = HTTPStatus.GATEWAY_TIMEOUT if isinstance(e, TimeoutError) else HTTPStatus.BAD_GATEWAY
+            error_type = "timeout_error" if isinstance(e, TimeoutError) else "api_error"
+            error = {"type": "error", "error": {"type": error_type, "message": str(e)}}
+            writer.write(b"event: error\ndata: " + json.dumps(error).encode() + b"\n\n")
+            try:
+                await writer.drain()
+            except ConnectionError:
+                # 呼び出し側も切断していた。ここで送出すると pool が健全なインスタンスを作り直してしまう
+                logger.info(f"caller disconnected before an error from {client.addr}:{client.port}")
+            if isinstance(e, ConnectionError):
+                # pool にインスタンスを作り直させる
+                raise
+        finally:
+            self._requests.inc(path=request.path, status=str(status.value))
+
+
+async def amain(args: argparse.Namespace):
+    cache = ResponseCache(args.cache, ttl=args.cache_ttl) if args.cache else None
+    metrics = ClientMetrics()
+    pool = ClientPool(
+        args.instances,
+        exe_path=args.exe,
+        base_port=args.base_port,
+        attach=args.attach,
+        inject_mode=args.inject_mode,
+        batching=None if args.no_batching else PageBatching(),
+        cache=cache,
+        observers=[metrics],
+        prewarm=args.prewarm,
+    )
+    gateway = Gateway(
+        pool,
+        host=args.host,
+        port=args.port,
+        max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout,
+        request_timeout=args.timeout,
+        metrics=metrics,
+    )
+    try:
+        async with pool.run(), gateway:
+            await gateway.serve_forever()
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claude for Desktop を Messages API 風の HTTP で公開する")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=8080, help="待ち受けるポート番号")
+    parser.add_argument("-n", "--instances", type=int, default=1, help="起動するインスタンス数")
+    parser.add_argument("--base-port", type=int, default=9223, help="最初のインスタンスとの websocket のポート番号")
+    parser.add_argument("--exe", default=r"%LOCALAPPDATA%\AnthropicClaude\claude.exe")
+    parser.add_argument("--attach", action="store_true", help="起動済みのインスタンスに接続する")
+    parser.add_argument("--inject-mode", choices=["console", "cdp"], default="console", help="スクリプトの注入方法")
+    parser.add_argument("--no-batching", action="store_true", help="ページ側でチャンクをまとめずに送らせる")
+    parser.add_argument("--max-queue", type=int, default=32, help="インスタンスの空きを待てるリクエスト数")
+    parser.add_argument("--queue-timeout", type=float, default=30.0, help="インスタンスの空きを待つ時間（秒）")
+    parser.add_argument("--timeout", type=float, default=300.0, help="応答の終わりまでの期限（秒）")
+    parser.add_argument("--cache", help="応答をキャッシュする SQLite ファイル。new_chat するリクエストだけが対象")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="キャッシュの有効期間（秒）")
+    parser.add_argument("--prewarm", action="store_true", help="new_chat するリクエスト用の新しいチャットを応答の合間に開いておく")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    asyncio.run(amain(args))
+
+
+if __name__ == "__main__":
+    main()
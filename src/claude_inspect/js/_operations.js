@@ -1,120 +1,241 @@
-({
-    /**
-     * operations:
-     *   - apply_chat()
-     *   - put_chat(text: string)
-     *   - clear_chat()
-     *   - new_chat(project_id: string?)
-     */
+(function() {
+    const defaultTimeout = 5000; // 5s
 
-    apply_chat: function() {
+    /*
+     * Resolves with the first truthy value of check(), re-evaluated only when the DOM under
+     * `target` changes or one of `events` ([EventTarget, type]) fires. Rejects after `timeout` ms.
+     */
+    function waitUntil(check, {target = document.body, events = [], timeout = defaultTimeout, what = 'condition'} = {}) {
         return new Promise((resolve, reject) => {
-            const inputElem = document.querySelector('.ProseMirror p');
-            if (!inputElem) {
-                reject('Input element not found');
+            const value = check();
+            if (value) {
+                resolve(value);
                 return;
             }
-            
-            inputElem.dispatchEvent(new KeyboardEvent('keydown', {key: 'Enter'}));
-            
-            function check() {
-                const inputElem = document.querySelector('.ProseMirror p');
-                if (inputElem.textContent === '') {
-                    resolve();
-                } else {
-                    setTimeout(check, 10);
+            const t0 = performance.now();
+            const observer = new MutationObserver(test);
+            const timer = setTimeout(() => {
+                cleanup();
+                reject(new Error(`timeout: ${what}: ${Math.round(performance.now() - t0)} / ${timeout} ms`));
+            }, timeout);
+            function cleanup() {
+                observer.disconnect();
+                clearTimeout(timer);
+                for (const [eventTarget, type] of events) {
+                    eventTarget.removeEventListener(type, test);
                 }
             }
-            setTimeout(check, 10);
-        });
-    },
-
-    put_chat: function(text) {
-        return new Promise((resolve, reject) => {
-            const inputElem = document.querySelector('.ProseMirror p');
-            if (inputElem) {
-                inputElem.innerText = text;
-                resolve();
+            function test() {
+                let value;
+                try {
+                    value = check();
+                } catch (e) {
+                    cleanup();
+                    reject(e);
+                    return;
+                }
+                if (value) {
+                    cleanup();
+                    resolve(value);
+                }
             }
-            else {
-                reject('Input element not found');
+            observer.observe(target, {childList: true, subtree: true, characterData: true});
+            for (const [eventTarget, type] of events) {
+                eventTarget.addEventListener(type, test);
             }
         });
-    },
+    }
 
-    clear_chat: function() {
-        return new Promise((resolve, reject) => {
-            const inputElem = document.querySelector('.ProseMirror p');
-            if (inputElem) {
-                inputElem.innerText = '';
-                resolve();
+    // SPA navigations change the URL without a DOM event of their own; the Navigation API reports
+    // them where available, and the route's re-render is caught by the MutationObserver otherwise
+    const navigationEvents = [[window, 'popstate']];
+    if (window.navigation) {
+        navigationEvents.push([window.navigation, 'currententrychange']);
+    }
+
+    function inputElement() {
+        const inputElem = document.querySelector('.ProseMirror p');
+        if (!inputElem) {
+            throw new Error('Input element not found');
+        }
+        return inputElem;
+    }
+
+    function followLink(elem, timeout = defaultTimeout) {
+        const targetPath = (new URL(elem.href)).pathname;
+        elem.click();
+        return waitUntil(() => location.pathname === targetPath && targetPath, {
+            events: navigationEvents,
+            timeout,
+            what: `navigate to ${targetPath} (at ${location.pathname})`,
+        });
+    }
+
+    // the payload of an upload received by inject.js; uploads are sent one at a time, so older
+    // ones were abandoned by the server and are dropped as well
+    function takeUpload(uploadId, type) {
+        const upload = window.__uploads.get(uploadId);
+        if (upload === void 0) {
+            throw new Error(`upload ${uploadId} not found`);
+        }
+        for (const id of window.__uploads.keys()) {
+            if (id <= uploadId) {
+                window.__uploads.delete(id);
+            }
+        }
+        return new Blob(upload.chunks, {type});
+    }
+
+    const uuidPattern = /^[A-Za-z0-9]{8}(-[A-Za-z0-9]{4}){3}-[A-Za-z0-9]{12}$/;
+
+    // project name -> "/project/<uuid>", remembered from every scan of the project list
+    const projectHrefs = new Map();
+
+    function scanProjects() {
+        for (const elem of document.querySelectorAll('a[href^="/project/"] > *:first-child')) {
+            projectHrefs.set(elem.textContent.trim(), elem.closest('a').getAttribute('href'));
+        }
+    }
+
+    return {
+        /**
+         * operations:
+         *   - apply_chat()
+         *   - put_chat(text: string)
+         *   - clear_chat()
+         *   - paste(upload_id: number, {as: "text" | "file", name?: string, type?: string}) -> {bytes, chars?, files?}
+         *   - new_chat(project_id: string?)
+         *   - stop_generation() -> boolean
+         *   - ping()
+         */
+
+        apply_chat: async function() {
+            inputElement().dispatchEvent(new KeyboardEvent('keydown', {key: 'Enter'}));
+            // the editor empties itself once the message has been sent. the first message of a new
+            // chat navigates from /new to /chat/<uuid>, which may mount a new editor, so watch the
+            // whole body and the navigation rather than the editor found now
+            await waitUntil(() => document.querySelector('.ProseMirror p')?.textContent === '', {
+                events: navigationEvents,
+                what: 'input cleared',
+            });
+        },
+
+        put_chat: async function(text) {
+            inputElement().innerText = text;
+        },
+
+        clear_chat: async function() {
+            inputElement().innerText = '';
+        },
+
+        // inserts an upload through the editor's paste handling, either as text replacing the input
+        // (like put_chat) or as an attached file, and confirms that it arrived in full
+        paste: async function(upload_id, {as = 'text', name = 'paste.txt', type = 'text/plain'} = {}) {
+            const blob = takeUpload(upload_id, type);
+            const editor = document.querySelector('.ProseMirror');
+            if (!editor) {
+                throw new Error('Input element not found');
+            }
+            const data = new DataTransfer();
+            let text;
+            if (as === 'file') {
+                data.items.add(new File([blob], name, {type}));
             } else {
-                reject('Input element not found');
+                text = await blob.text();
+                data.setData('text/plain', text);
+                inputElement().innerText = '';
             }
-        });
-    },
-
-    new_chat: function(project_id) {
-        function followLink([elem, timeout = 1000]) {
-            console.log(timeout);
-            return new Promise((resolve, reject) => {
-                if (!elem) {
-                    reject('link element not found');
-                    return;
-                }
-                const targetPath = (new URL(elem.href)).pathname;
-                const t0 = performance.now();
-                function check() {
-                    if (location.pathname === targetPath) {
-                        resolve(targetPath);
-                    } else {
-                        const t1 = performance.now();
-                        if (t1 - t0 > timeout) {
-                            reject(`timeout: ${t1 - t0} / ${timeout}: ${targetPath} / ${location.pathname}`);
-                        } else {
-                            setTimeout(check, 10);
-                        }
+            editor.focus();
+            const event = new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true});
+            // the editor cancels the event once it has taken the data
+            const handled = !editor.dispatchEvent(event);
+
+            if (as === 'file') {
+                if (!handled) {
+                    const fileInput = document.querySelector('input[type="file"]');
+                    if (!fileInput) {
+                        throw new Error(`file ${name} was not accepted`);
                     }
+                    fileInput.files = data.files;
+                    fileInput.dispatchEvent(new Event('change', {bubbles: true}));
                 }
-                elem.click();
-                setTimeout(check, 10);
-            });
-        }
-        
-        if (project_id === void 0 || project_id === null || project_id === '') {
-            return new Promise((resolve, reject) => {
+                return {bytes: blob.size, files: 1};
+            }
+
+            if (!handled) {
+                inputElement().innerText = text;
+            }
+            // line breaks become paragraphs, so only the other characters are compared
+            const chars = text.replace(/[\r\n]/g, '').length;
+            try {
+                await waitUntil(() => editor.textContent.length === chars, {
+                    target: editor,
+                    timeout: defaultTimeout + text.length / 1000,
+                    what: 'pasted text',
+                });
+            } catch (e) {
+                throw new Error(`pasted text has ${editor.textContent.length} of ${chars} characters; `
+                    + 'the app may have turned it into an attachment');
+            }
+            return {bytes: blob.size, chars};
+        },
+
+        new_chat: async function(project_id) {
+            if (project_id === void 0 || project_id === null || project_id === '') {
                 const newChatElem = document.querySelector('a[href="/new"]');
-                resolve([newChatElem]);
-            }).then(followLink);
-        } else {
-            return (new Promise((resolve, reject) => {
-                const projectElem = document.querySelector(`a[href="/projects"]`);
-                resolve([projectElem])
-            }))
-            .then(followLink)
-            .then(() => {
-                const uuid = /^[A-Za-z0-9]{8}(-[A-Za-z0-9]{4}){3}-[A-Za-z0-9]{12}$/;
-                let targetElem = null;
-                if (uuid.test(project_id)) {
-                    targetElem = document.querySelector(`a[href="/project/${project_id}"]`);
-                } else {
-                    const projects = document.querySelectorAll(`a[href^="/project/"] > *:first-child`);
-                    targetElem = Array.from(projects).find(elem => elem.textContent.trim() === project_id);
-                }
-                if (!targetElem) {
-                    reject(`project ${project_id} aws not found`);
-                    return;
-                }
-                while (targetElem.tagName !== 'A') {
-                    targetElem = targetElem.parentElement;
+                if (!newChatElem) {
+                    throw new Error('link element not found: /new');
                 }
-                if (!targetElem) {
-                    reject(`project ${project_id} aws not found`);
-                    return;
-                }
-                return followLink([targetElem]);
-            });
-        }
-    },
+                return await followLink(newChatElem);
+            }
+
+            // a project opened before, or given by its UUID, is entered directly when the current
+            // page links to it (e.g. the breadcrumb of a project chat)
+            const href = uuidPattern.test(project_id) ? `/project/${project_id}` : projectHrefs.get(project_id);
+            const directElem = href && document.querySelector(`a[href="${href}"]`);
+            if (directElem) {
+                return await followLink(directElem);
+            }
+
+            const projectsElem = document.querySelector('a[href="/projects"]');
+            if (!projectsElem) {
+                throw new Error('link element not found: /projects');
+            }
+            await followLink(projectsElem);
+
+            // the project list renders after the navigation
+            const findProject = href
+                ? () => document.querySelector(`a[href="${href}"]`)
+                : () => {
+                    scanProjects();
+                    const found = projectHrefs.get(project_id);
+                    return found && document.querySelector(`a[href="${found}"]`);
+                };
+            let targetElem;
+            try {
+                targetElem = await waitUntil(findProject, {what: `project ${project_id}`});
+            } catch (e) {
+                projectHrefs.delete(project_id);
+                throw new Error(`project ${project_id} was not found`);
+            }
+            return await followLink(targetElem);
+        },
+
+        // clicks the stop button while a response is being generated, and waits until it is gone;
+        // false if nothing was being generated
+        stop_generation: async function() {
+            const stopButton = () => document.querySelector('button[aria-label="Stop response"]');
+            const button = stopButton();
+            if (!button) {
+                return false;
+            }
+            button.click();
+            await waitUntil(() => !stopButton(), {what: 'generation stopped'});
+            return true;
+        },
 
-})
\ No newline at end of file
+        ping: async function() {
+            return 'pong';
+        },
+    };
+})()
@@ -1,55 +1,210 @@
 // https://gist.githubusercontent.com/Richard-Weiss/95f8bf90b55a3a41b4ae0ddd7a614942/raw/551191d897498708abcc97f928d63f463aa17f1c/claude_mcp_auto_approve.js
 
-// Array of trusted tool names
-const trustedTools = $AUTO_APPROVE_TOOLS;
+if (window.__autoApprove !== void 0) {
+    // injected again (a console retry, or CDP evaluating the bundle once more): keep the observers
+    // that are already running and only take over the trusted tools of this injection
+    window.__autoApprove.configure({tools: __config.auto_approve_tools, patterns: __config.auto_approve_patterns});
+    return;
+}
+
+// trusted tool names, and regular expressions (source strings) matched against the whole tool name
+const trusted = {tools: [], patterns: [], regexps: []};
+
+function configure({tools, patterns} = {}) {
+    if (tools) {
+        trusted.tools = Array.from(tools);
+    }
+    if (patterns) {
+        trusted.regexps = patterns.map(p => new RegExp(`^(?:${p})$`));
+        trusted.patterns = Array.from(patterns);
+    }
+    return {tools: trusted.tools, patterns: trusted.patterns};
+}
+
+configure({tools: __config.auto_approve_tools ?? [], patterns: __config.auto_approve_patterns ?? []});
+
+function isTrusted(toolName) {
+    return trusted.tools.includes(toolName) || trusted.regexps.some(p => p.test(toolName));
+}
 
 // Cooldown tracking
 let lastClickTime = 0;
 const COOLDOWN_MS = 1000; // 1 second cooldown
 
-const observer = new MutationObserver((mutations) => {
-    // Check if we're still in cooldown
+// log a given kind of message at most once per interval
+const LOG_INTERVAL_MS = 5000;
+const lastLogTime = new Map();
+function logRateLimited(kind, ...args) {
     const now = Date.now();
-    if (now - lastClickTime < COOLDOWN_MS) {
-        console.log('🕒 Still in cooldown period, skipping...');
+    if (now - (lastLogTime.get(kind) ?? -Infinity) < LOG_INTERVAL_MS) {
         return;
     }
+    lastLogTime.set(kind, now);
+    console.log(...args);
+}
 
-    console.log('🔍 Checking mutations...');
-    
-    const dialog = document.querySelector('[role="dialog"]');
-    if (!dialog) return;
+const stats = {
+    // mutation batches seen by the body observer (direct children only)
+    body_callbacks: 0,
+    // mutation batches seen by the observers on portal roots
+    portal_callbacks: 0,
+    dialogs: 0,
+    approved: 0,
+    untrusted: 0,
+    cooldown_skips: 0,
+    observer_ms: 0,
+    // what an observer on the whole body subtree, as in the original gist, does for the same
+    // mutations; only counted while measuring the baseline (see measureBaseline)
+    baseline_callbacks: 0,
+    baseline_mutations: 0,
+    baseline_ms: 0,
+};
 
-    const buttonWithDiv = dialog.querySelector('button div');
-    if (!buttonWithDiv) return;
+// a dialog is handled once, as soon as its tool request is complete
+const handled = new WeakSet();
 
-    const toolText = buttonWithDiv.textContent;
-    if (!toolText) return;
-
-    console.log('📝 Found tool request:', toolText);
-    
+// returns true once nothing more is to be done with the dialog
+function checkDialog(dialog) {
+    if (handled.has(dialog)) {
+        return true;
+    }
+    const buttonWithDiv = dialog.querySelector('button div');
+    const toolText = buttonWithDiv?.textContent;
+    if (!toolText) {
+        return false;
+    }
     const toolName = toolText.match(/Run (\S+) from/)?.[1];
-    if (!toolName) return;
+    if (!toolName) {
+        return false;
+    }
 
+    if (!isTrusted(toolName)) {
+        handled.add(dialog);
+        stats.dialogs++;
+        stats.untrusted++;
+        console.log('❌ Tool not in trusted list:', toolName);
+        return true;
+    }
+    const allowButton = Array.from(dialog.querySelectorAll('button'))
+        .find(button => button.textContent.includes('Allow for This Chat'));
+    if (!allowButton) {
+        return false;
+    }
+    handled.add(dialog);
+    stats.dialogs++;
     console.log('🛠️ Tool name:', toolName);
-    
-    if (trustedTools.includes(toolName)) {
-        const allowButton = Array.from(dialog.querySelectorAll('button'))
-            .find(button => button.textContent.includes('Allow for This Chat'));
-        
-        if (allowButton) {
-            console.log('🚀 Auto-approving tool:', toolName);
-            lastClickTime = now; // Set cooldown
-            allowButton.click();
+    approve(dialog, allowButton, toolName);
+    return true;
+}
+
+function approve(dialog, allowButton, toolName) {
+    const now = Date.now();
+    if (now - lastClickTime < COOLDOWN_MS) {
+        // retry once the cooldown is over instead of on every mutation
+        stats.cooldown_skips++;
+        logRateLimited('cooldown', '🕒 Still in cooldown period, retrying later...');
+        setTimeout(() => dialog.isConnected && approve(dialog, allowButton, toolName), COOLDOWN_MS - (now - lastClickTime));
+        return;
+    }
+    console.log('🚀 Auto-approving tool:', toolName);
+    lastClickTime = now; // Set cooldown
+    stats.approved++;
+    allowButton.click();
+}
+
+function findDialogs(node) {
+    if (node.nodeType !== Node.ELEMENT_NODE) {
+        return [];
+    }
+    const dialogs = Array.from(node.querySelectorAll('[role="dialog"]'));
+    return node.matches('[role="dialog"]') ? [node, ...dialogs] : dialogs;
+}
+
+function checkDialogs(node) {
+    for (const dialog of findDialogs(node)) {
+        checkDialog(dialog);
+    }
+}
+
+// the app itself; everything else under <body> is a portal root
+function isAppRoot(node) {
+    return node.querySelector('main, .ProseMirror') !== null;
+}
+
+// dialogs are rendered into portals under <body>, either as a new child of <body> or inside a
+// portal root that is already there, and their content may arrive after the dialog element.
+// every portal root is therefore watched with its subtree for as long as it is attached; the
+// chat lives under the app root, so streaming tokens never wake these observers
+const portals = new Map();
+
+function watchPortal(node) {
+    if (node.nodeType !== Node.ELEMENT_NODE || portals.has(node) || isAppRoot(node)) {
+        return;
+    }
+    checkDialogs(node);
+    const portalObserver = new MutationObserver(() => {
+        const t0 = performance.now();
+        stats.portal_callbacks++;
+        if (isAppRoot(node)) {
+            // the app rendered into a node that was still empty when it was picked up
+            unwatchPortal(node);
+        } else {
+            checkDialogs(node);
+        }
+        stats.observer_ms += performance.now() - t0;
+    });
+    portalObserver.observe(node, {childList: true, subtree: true, characterData: true});
+    portals.set(node, portalObserver);
+}
+
+function unwatchPortal(node) {
+    portals.get(node)?.disconnect();
+    portals.delete(node);
+}
+
+const observer = new MutationObserver((mutations) => {
+    const t0 = performance.now();
+    stats.body_callbacks++;
+    for (const mutation of mutations) {
+        for (const node of mutation.removedNodes) {
+            unwatchPortal(node);
+        }
+        for (const node of mutation.addedNodes) {
+            watchPortal(node);
         }
-    } else {
-        console.log('❌ Tool not in trusted list:', toolName);
     }
+    stats.observer_ms += performance.now() - t0;
 });
 
-// Start observing
-console.log('👀 Starting observer for trusted tools:', trustedTools);
-observer.observe(document.body, {
-    childList: true,
-    subtree: true
-});
+console.log('👀 Starting observer for trusted tools:', trusted.tools, trusted.patterns);
+observer.observe(document.body, {childList: true});
+for (const node of document.body.children) {
+    watchPortal(node);
+}
+
+// counts what the gist's observer (the whole body subtree, a document-wide query per callback)
+// would do, so the stats can be compared with it; this costs as much as that observer did
+let baselineObserver = null;
+
+function measureBaseline(enabled) {
+    if (enabled && baselineObserver === null) {
+        baselineObserver = new MutationObserver((mutations) => {
+            const t0 = performance.now();
+            stats.baseline_callbacks++;
+            stats.baseline_mutations += mutations.length;
+            document.querySelector('[role="dialog"]')?.querySelector('button div');
+            stats.baseline_ms += performance.now() - t0;
+        });
+        baselineObserver.observe(document.body, {childList: true, subtree: true, characterData: true});
+    } else if (!enabled && baselineObserver !== null) {
+        baselineObserver.disconnect();
+        baselineObserver = null;
+    }
+}
+
+// used by the "auto_approve" and "auto_approve_stats" ops of inject.js
+window.__autoApprove = {
+    configure,
+    stats: () => ({...stats, watching: portals.size, measuring_baseline: baselineObserver !== null}),
+    measureBaseline,
+};
@@ -1,18 +1,171 @@
-console.log('connected', $SERVER_URL);
-
-const url = $SERVER_URL;
+const url = __config.server_url;
 const reconnectDelay = 1000; // 1s
 
+/*
+ * protocol:
+ *   server -> page (text):
+ *     {"id": number, "op": string, "args": any[], "stream"?: true}
+ *     {"ack": number}
+ *   page -> server (text):
+ *     {"type": "ping", "features": string[], "session": string, "seq": number, "last_op": number}
+ *     {"type": "result", "id": number, "ok": true, "value": any, "elapsed_ms": number}
+ *     {"type": "result", "id": number, "ok": false, "error": {"type": string, "message": string}, "elapsed_ms": number}
+ *     {"type": "stream", "state": "open", "stream": number, "owner": number | null, "url": string}
+ *     {"type": "stream", "state": "close", "stream": number, "error"?: string}
+ *   server -> page (binary):
+ *     uint32be upload id + a part of a large input, in order, before the op that consumes it
+ *   page -> server (binary):
+ *     uint32be stream id + raw SSE chunk
+ *
+ * An op sent with "stream": true owns the next SSE response that the page receives.
+ *
+ * features:
+ *   "coalesce": the server may send the "configure" op to batch SSE chunks of a stream into
+ *               one binary frame, flushed after flush_interval_ms or once flush_bytes are pending.
+ *   "auto_approve": the "auto_approve" op replaces the trusted tools of auto-approve.js, and
+ *                   "auto_approve_stats" reports how often its observers ran, next to how
+ *                   often the original whole-body observer would have.
+ *   "upload": large inputs arrive as binary frames and are inserted by the "paste" op
+ *             of _operations.js, instead of being sent inside the op's JSON.
+ *   "resume": every frame to the server except the ping is numbered from 0 within the page's
+ *             session, and kept until the server acknowledges it with {"ack": n} (all frames
+ *             before n). After connecting, the page holds its frames back until the server sends
+ *             the "resume" op with the number of frames it has received, then sends the missed
+ *             ones again in order. A long generation thus survives a dropped connection.
+ */
+
+const features = ['coalesce', 'auto_approve', 'upload', 'resume'];
+
+// frames kept for the server to ask for again after a reconnect; the oldest are given up
+// beyond this many bytes
+const resumeBytes = 16 << 20;
+
+if (window.__outbox === void 0) {
+    window.__outbox = {
+        session: crypto.randomUUID(),
+        nextSeq: 0,
+        // [seq, data] of the frames not acknowledged yet, in order
+        frames: [],
+        byteLength: 0,
+        // set from connecting until the "resume" op
+        paused: false,
+        // the last op received, so the server can tell which ops never arrived
+        lastOp: 0,
+    };
+}
+const outbox = window.__outbox;
+
+function frameLength(data) {
+    return typeof data === 'string' ? data.length : data.byteLength;
+}
+
+function acknowledge(seq) {
+    while (outbox.frames.length && outbox.frames[0][0] < seq) {
+        outbox.byteLength -= frameLength(outbox.frames.shift()[1]);
+    }
+}
+
+// sends the frames from `seq` on again and lets new frames through
+function resume(seq) {
+    const oldest = outbox.frames.length ? outbox.frames[0][0] : outbox.nextSeq;
+    if (seq < oldest || seq > outbox.nextSeq) {
+        // some frames are gone; reconnect as a new session, so the server gives up on what it was waiting for
+        const error = new Error(`cannot resume from frame ${seq}: frames ${oldest} to ${outbox.nextSeq} are kept`);
+        Object.assign(outbox, {session: crypto.randomUUID(), nextSeq: 0, frames: [], byteLength: 0});
+        window.__socket.close();
+        throw error;
+    }
+    outbox.paused = false;
+    acknowledge(seq);
+    for (const [, data] of outbox.frames) {
+        window.__socket.send(data);
+    }
+    return {resent: outbox.frames.length};
+}
+
+// large inputs being received, keyed by upload id; taken by the "paste" op
+if (window.__uploads === void 0) {
+    window.__uploads = new Map();
+}
+
+function receiveUpload(data) {
+    const uploadId = new DataView(data).getUint32(0);
+    let upload = window.__uploads.get(uploadId);
+    if (upload === void 0) {
+        upload = {chunks: [], byteLength: 0};
+        window.__uploads.set(uploadId, upload);
+    }
+    upload.chunks.push(new Uint8Array(data, 4));
+    upload.byteLength += data.byteLength - 4;
+}
+
+function sendControl(obj) {
+    window.__send?.(JSON.stringify(obj));
+}
+
+// micro-batching of SSE chunks; disabled until the server enables it
+const framing = {flushInterval: 0, flushBytes: 0};
+const pendingChunks = new Map();
+
+function sendFrame(streamId, chunks, byteLength) {
+    const frame = new Uint8Array(4 + byteLength);
+    new DataView(frame.buffer).setUint32(0, streamId);
+    let offset = 4;
+    for (const chunk of chunks) {
+        frame.set(chunk, offset);
+        offset += chunk.byteLength;
+    }
+    window.__send?.(frame);
+}
+
+function flushChunks(streamId) {
+    const pending = pendingChunks.get(streamId);
+    if (pending === void 0) {
+        return;
+    }
+    pendingChunks.delete(streamId);
+    clearTimeout(pending.timer);
+    sendFrame(streamId, pending.chunks, pending.byteLength);
+}
+
+function sendChunk(streamId, value) {
+    if (!framing.flushInterval) {
+        sendFrame(streamId, [value], value.byteLength);
+        return;
+    }
+    let pending = pendingChunks.get(streamId);
+    if (pending === void 0) {
+        pending = {chunks: [], byteLength: 0, timer: setTimeout(() => flushChunks(streamId), framing.flushInterval)};
+        pendingChunks.set(streamId, pending);
+    }
+    pending.chunks.push(value);
+    pending.byteLength += value.byteLength;
+    if (framing.flushBytes && pending.byteLength >= framing.flushBytes) {
+        flushChunks(streamId);
+    }
+}
+
+function closeStream(streamId, error) {
+    flushChunks(streamId);
+    sendControl(error === void 0
+        ? {type: 'stream', state: 'close', stream: streamId}
+        : {type: 'stream', state: 'close', stream: streamId, error: String(error)});
+}
+
 function connectWebSocket() {
     delete window.__socket;
     delete window.__send;
     const socket = new WebSocket(url);
+    socket.binaryType = 'arraybuffer';
     socket.addEventListener('open', function(e) {
         console.log(`connected: ${url}`, e);
-        window.__send?.((new TextEncoder()).encode('event: ping\ndata: {"type": "ping"}\n\n'));
+        outbox.paused = true;
+        socket.send(JSON.stringify({type: 'ping', features, session: outbox.session, seq: outbox.nextSeq, last_op: outbox.lastOp}));
     });
     socket.addEventListener('close', function(e) {
         console.log(`disconnected: ${url}`, e);
+        // the server gives up on inputs that were not pasted yet
+        window.__uploads.clear();
         console.log(`Attempting to reconnect in ${reconnectDelay/1000} seconds...`);
         setTimeout(connectWebSocket, reconnectDelay);
     });
@@ -20,18 +173,27 @@ function connectWebSocket() {
         console.warn('websocket error', event);
     });
     socket.addEventListener('message', function(event) {
-        console.debug(event);
-        const obj = JSON.parse(event.data);
-        const op = obj.op;
-        const args = obj.args ?? [];
-        //const ev = new CustomEvent('operation', {detail: {op, args}});
-        //document.dispatchEvent(ev);
-        window.__operations.push({op, args});
+        if (typeof event.data === 'string') {
+            console.debug(event);
+            const msg = JSON.parse(event.data);
+            if (msg.ack !== void 0) {
+                acknowledge(msg.ack);
+            } else {
+                window.__dispatch(msg);
+            }
+        } else {
+            receiveUpload(event.data);
+        }
     });
     window.__socket = socket;
-    window.__send = function(event) {
-        if (window.__socket?.readyState === WebSocket.OPEN) {
-            window.__socket.send(event);
+    window.__send = function(data) {
+        outbox.frames.push([outbox.nextSeq++, data]);
+        outbox.byteLength += frameLength(data);
+        while (outbox.byteLength > resumeBytes && outbox.frames.length > 1) {
+            outbox.byteLength -= frameLength(outbox.frames.shift()[1]);
+        }
+        if (!outbox.paused && window.__socket?.readyState === WebSocket.OPEN) {
+            window.__socket.send(data);
         }
     };
 }
@@ -48,27 +210,45 @@ if (window.__socket === void 0) {
 
 if (window.__fetch === void 0) {
     // hook SSE
-    orig_fetch = window.fetch;
+    window.__fetch = window.fetch;
+    window.__streamOwners = [];
+    let nextStreamId = 1;
     window.fetch = async function(...args) {
-        const response = await orig_fetch.apply(window, args);
+        const response = await window.__fetch.apply(window, args);
         const contentType = response?.headers.get('Content-Type');
         if (contentType?.includes('text/event-stream') && response.body) {
+            const streamId = nextStreamId++;
+            const owner = window.__streamOwners.shift() ?? null;
+            sendControl({type: 'stream', state: 'open', stream: streamId, owner, url: location.href});
             const orig_getReader = response.body.getReader;
             response.body.getReader = function (...args) {
                 const reader = orig_getReader.apply(response.body, ...args);
                 const orig_read = reader.read;
                 reader.read = async function (...args) {
-                    const read_result = await orig_read.apply(reader, args);
+                    let read_result;
+                    try {
+                        read_result = await orig_read.apply(reader, args);
+                    } catch (e) {
+                        closeStream(streamId, e);
+                        throw e;
+                    }
                     if (!read_result) {
                         return read_result;
                     }
                     const { done, value } = read_result;
-                    if (!done && value !== undefined && value !== void 0) {
-                        //console.log(value);
-                        window.__send?.(value);
+                    if (done) {
+                        closeStream(streamId);
+                    } else if (value !== undefined && value !== void 0) {
+                        sendChunk(streamId, value);
                     }
                     return read_result;
                 };
+                // stopping a response may cancel the reader instead of aborting the fetch
+                const orig_cancel = reader.cancel;
+                reader.cancel = function (...args) {
+                    closeStream(streamId, args[0] ?? 'cancelled');
+                    return orig_cancel.apply(reader, args);
+                };
                 return reader;
             };
         }
@@ -76,57 +256,60 @@ if (window.__fetch === void 0) {
     };
 }
 
-if (window.__operations === void 0) {
-    window.__operations = [];
-    setTimeout(process, 10);
-}
-
 const operations = ($OPERATIONS);
 
-async function process1() {
-    if (window.__operations.length == 0) {
-        return false;
-    }
-    
-    console.debug('start operation');
-    
-    const {op, args} = window.__operations[0];
-    console.log('operation:', op, args);
-    const func = operations[op];
-    if (!func) {
-        throw new Error('operation not found: ' + op);
-    }
-
-    await func(...args);
-    
-    console.debug('complete operation');
-    return true;
-}
-
-function process() {
-    process1().then(done => {
-        if (done) {
-            window.__operations.shift();
-            if (window.__send) {
-                console.debug('start reponse');
-                const msg = 'event: ping\ndata: {"type": "ping"}\n\n';
-                const obj = (new TextEncoder()).encode(msg);
-                window.__send?.(obj);
-                console.debug('complete response');
-            }
+// ops handled by this script itself rather than the page
+const builtins = {
+    configure: function({flush_interval_ms = 0, flush_bytes = 0} = {}) {
+        framing.flushInterval = flush_interval_ms;
+        framing.flushBytes = flush_bytes;
+        return {flush_interval_ms, flush_bytes};
+    },
+    // replaces the trusted tools and/or patterns of auto-approve.js; null leaves one unchanged
+    auto_approve(tools = null, patterns = null) {
+        return window.__autoApprove.configure({tools, patterns});
+    },
+    // true/false starts/stops counting what the original whole-body observer would have done
+    auto_approve_stats(baseline = null) {
+        if (baseline !== null) {
+            window.__autoApprove.measureBaseline(baseline);
         }
-    }).catch((e) => {
-        // delete all operations
-        console.error(e);
-        window.__operations.splice(0);
-        if (window.__send) {
-            const errMsg = 'event: error\ndata: {"type": "error", "error": {"type": "javascript_error", "message": ' + JSON.stringify(e.toString()) + '}}\n\n';
-            const errObj = (new TextEncoder()).encode(errMsg);
-            window.__send?.(errObj);
+        return window.__autoApprove.stats();
+    },
+    resume,
+};
+
+if (window.__dispatch === void 0) {
+    // every op runs as soon as it arrives; replies are matched by id on the server side
+    window.__dispatch = function({id, op, args = [], stream = false}) {
+        console.log('operation:', id, op, args);
+        outbox.lastOp = Math.max(outbox.lastOp, id);
+        if (stream) {
+            window.__streamOwners.push(id);
         }
-    }).finally(() => {
-        setTimeout(process, 10);
-    });
+        // time spent in the page, so the server can tell it apart from the round trip
+        const t0 = performance.now();
+        Promise.resolve().then(() => {
+            const func = builtins[op] ?? operations[op];
+            if (!func) {
+                throw new Error('operation not found: ' + op);
+            }
+            return func(...args);
+        }).then(value => {
+            sendControl({type: 'result', id, ok: true, value: value ?? null, elapsed_ms: performance.now() - t0});
+        }).catch(e => {
+            console.error(e);
+            const i = window.__streamOwners.indexOf(id);
+            if (i >= 0) {
+                window.__streamOwners.splice(i, 1);
+            }
+            sendControl({
+                type: 'result', id, ok: false,
+                error: {type: 'javascript_error', message: String(e)},
+                elapsed_ms: performance.now() - t0,
+            });
+        });
+    };
 }
 
-console.log("ready!");
\ No newline at end of file
+console.log("ready!");
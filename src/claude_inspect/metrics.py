@@ -0,0 +1,365 @@
+import os
+import json
+import math
+import asyncio
+import logging
+import bisect
+from contextlib import asynccontextmanager
+from typing import Callable, Iterable
+
+
+logger = logging.getLogger(__name__)
+
+
+# 秒単位の既定のバケット。1ms から 60s まで
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._series: dict[tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[k]) for k in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, series in sorted(self._series.items()):
+            lines += self._render_series(key, series)
+        return lines
+
+    def _render_series(self, key: tuple[str, ...], series) -> list[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(series)}"]
+
+    def snapshot(self) -> list[dict]:
+        return [{"labels": dict(zip(self.label_names, key)), "value": series} for key, series in self._series.items()]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._series.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), fn: Callable[[], float] | None = None):
+        super().__init__(name, help, labels)
+        # fn を指定すると出力のたびに値を取り直す（ラベルなしのみ）
+        self._fn = fn
+
+    def set(self, value: float, **labels: str):
+        self._series[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._series.get(self._key(labels), 0)
+
+    def _collect(self):
+        if self._fn is not None:
+            self._series[()] = self._fn()
+
+    def render(self) -> list[str]:
+        self._collect()
+        return super().render()
+
+    def snapshot(self) -> list[dict]:
+        self._collect()
+        return super().snapshot()
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n: int):
+        self.counts = [0] * n
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets) + 1)
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def _render_series(self, key: tuple[str, ...], series: _HistogramSeries) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, n in zip((*self.buckets, math.inf), series.counts):
+            cumulative += n
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+        lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+    def quantile(self, q: float, **labels: str) -> float | None:
+        """バケットの上限から分位点を近似する"""
+        series = self._series.get(self._key(labels))
+        if series is None or series.count == 0:
+            return None
+        rank = q * series.count
+        cumulative = 0
+        for bound, n in zip((*self.buckets, math.inf), series.counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self) -> list[dict]:
+        return [
+            {
+                "labels": dict(zip(self.label_names, key)),
+                "buckets": dict(zip(map(_format_value, (*self.buckets, math.inf)), series.counts)),
+                "sum": series.sum,
+                "count": series.count,
+            }
+            for key, series in self._series.items()
+        ]
+
+
+class MetricsRegistry:
+    """メトリクスをまとめて Prometheus のテキスト形式か JSON で書き出す"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                raise ValueError(f"metric {metric.name} already registered with a different type or labels")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = (), fn: Callable[[], float] | None = None) -> Gauge:
+        return self._register(Gauge(name, help, labels, fn))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def get(self, name: str) -> _Metric | None:
+        return self._metrics.get(name)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: {"type": m.type, "series": m.snapshot()} for name, m in self._metrics.items()}
+
+    def write(self, path: str):
+        """拡張子が .prom ならテキスト形式で、それ以外は JSON で書き出す。途中の状態は見せない"""
+        if path.endswith(".prom"):
+            text = self.render_prometheus()
+        else:
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=1)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as io:
+            io.write(text)
+        os.replace(tmp, path)
+
+    @asynccontextmanager
+    async def exporting(self, path: str, interval: float = 10.0):
+        """interval 秒ごとと、抜けるときに path へ書き出す"""
+
+        async def loop():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    self.write(path)
+                except OSError as e:
+                    logger.warning(f"failed to write metrics: {e}")
+
+        task = asyncio.create_task(loop())
+        try:
+            yield self
+        finally:
+            task.cancel()
+            self.write(path)
+
+
+class ClientObserver:
+    """Client の各段階で呼ばれるフック。必要なメソッドだけを上書きする
+
+    時間はすべて秒。client を受け取るので、1 つのオブザーバを複数の Client で共有できる。
+    """
+
+    def on_connect(self, client, features: set[str]):
+        """ページが接続した（再接続を含む）"""
+
+    def on_disconnect(self, client):
+        """ページとの接続が切れた"""
+
+    def on_op(self, client, op: str, elapsed: float, ok: bool, page_elapsed: float | None):
+        """op の往復が終わった。page_elapsed はページ側での処理時間（報告があれば）"""
+
+    def on_stream_open(self, client, stream):
+        pass
+
+    def on_stream_closed(self, client, stream):
+        """ストリームを手放した。stream.buffer.stats でバッファの水位を見られる"""
+
+    def on_first_token(self, client, elapsed: float):
+        """communicate の開始から最初の content_block_delta まで"""
+
+    def on_chunk(self, client, nbytes: int, gap: float | None):
+        """チャンクを受け取った。gap は前のチャンクからの間隔"""
+
+    def on_token(self, client, gap: float):
+        """2 つ目以降の content_block_delta を受け取った。gap は前のトークンからの間隔"""
+
+    def on_response(self, client, elapsed: float, tokens: int, outcome: str):
+        """応答が終わった。outcome は "ok", "error", "timeout", "cancelled", "cached" のいずれか"""
+
+
+class ClientMetrics(ClientObserver):
+    """ClientObserver のフックを MetricsRegistry に記録する"""
+
+    def __init__(self, registry: MetricsRegistry | None = None, *, prefix: str = "claude_inspect"):
+        self.registry = registry = registry or MetricsRegistry()
+        p = prefix
+        self.connects = registry.counter(f"{p}_connects_total", "page connections, including reconnects", ["instance"])
+        self.disconnects = registry.counter(f"{p}_disconnects_total", "page disconnections", ["instance"])
+        self.op_seconds = registry.histogram(f"{p}_op_seconds", "op round-trip time", ["instance", "op", "outcome"])
+        self.page_op_seconds = registry.histogram(
+            f"{p}_page_op_seconds", "time spent in _operations.js as reported by the page", ["instance", "op"]
+        )
+        self.ttft_seconds = registry.histogram(f"{p}_ttft_seconds", "time to first content_block_delta", ["instance"])
+        self.chunk_gap_seconds = registry.histogram(
+            f"{p}_inter_chunk_seconds",
+            "gap between SSE chunks",
+            ["instance"],
+            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+        )
+        self.token_gap_seconds = registry.histogram(
+            f"{p}_inter_token_seconds",
+            "gap between content_block_delta events",
+            ["instance"],
+            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+        )
+        self.chunk_bytes = registry.counter(f"{p}_chunk_bytes_total", "SSE bytes received", ["instance"])
+        self.tokens = registry.counter(f"{p}_tokens_total", "content_block_delta events received", ["instance"])
+        self.response_seconds = registry.histogram(
+            f"{p}_response_seconds", "time from communicate to the end of the response", ["instance", "outcome"]
+        )
+        self.tokens_per_second = registry.histogram(
+            f"{p}_tokens_per_second",
+            "content_block_delta events per second of each response",
+            ["instance"],
+            buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000),
+        )
+        self.streams_open = registry.gauge(f"{p}_streams_open", "SSE streams being read", ["instance"])
+        self.buffer_high_water = registry.histogram(
+            f"{p}_stream_buffer_high_water_bytes",
+            "peak buffered bytes per stream",
+            ["instance"],
+            buckets=(1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20),
+        )
+        self.buffer_blocked = registry.counter(
+            f"{p}_stream_buffer_blocked_total", "writes that waited for buffer space", ["instance"]
+        )
+
+    @staticmethod
+    def _instance(client) -> str:
+        return f"{client.addr}:{client.port}"
+
+    def on_connect(self, client, features: set[str]):
+        self.connects.inc(instance=self._instance(client))
+
+    def on_disconnect(self, client):
+        self.disconnects.inc(instance=self._instance(client))
+
+    def on_op(self, client, op: str, elapsed: float, ok: bool, page_elapsed: float | None):
+        instance = self._instance(client)
+        self.op_seconds.observe(elapsed, instance=instance, op=op, outcome="ok" if ok else "error")
+        if page_elapsed is not None:
+            self.page_op_seconds.observe(page_elapsed, instance=instance, op=op)
+
+    def on_stream_open(self, client, stream):
+        self.streams_open.inc(instance=self._instance(client))
+
+    def on_stream_closed(self, client, stream):
+        instance = self._instance(client)
+        self.streams_open.dec(instance=instance)
+        stats = stream.buffer.stats
+        self.buffer_high_water.observe(stats.high_water_bytes, instance=instance)
+        if stats.blocked:
+            self.buffer_blocked.inc(stats.blocked, instance=instance)
+
+    def on_first_token(self, client, elapsed: float):
+        self.ttft_seconds.observe(elapsed, instance=self._instance(client))
+
+    def on_chunk(self, client, nbytes: int, gap: float | None):
+        instance = self._instance(client)
+        self.chunk_bytes.inc(nbytes, instance=instance)
+        if gap is not None:
+            self.chunk_gap_seconds.observe(gap, instance=instance)
+
+    def on_token(self, client, gap: float):
+        self.token_gap_seconds.observe(gap, instance=self._instance(client))
+
+    def on_response(self, client, elapsed: float, tokens: int, outcome: str):
+        instance = self._instance(client)
+        self.response_seconds.observe(elapsed, instance=instance, outcome=outcome)
+        self.tokens.inc(tokens, instance=instance)
+        if outcome == "ok" and tokens and elapsed > 0:
+            self.tokens_per_second.observe(tokens / elapsed, instance=instance)
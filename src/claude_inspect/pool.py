@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Callable, Iterable, Literal
+
+from claude_inspect.buffer import BufferConfig, PageBatching
+from claude_inspect.cache import ResponseCache
+from claude_inspect.client import Client
+from claude_inspect.metrics import ClientObserver
+from claude_inspect.sse import ServerSentEvent
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Member:
+    def __init__(self, index: int, client: Client):
+        self.index = index
+        self.client = client
+        self.stack = AsyncExitStack()
+        self.ready = False
+        self.dead = False
+        self.busy = False
+        self.failures = 0
+
+
+class ClientPool:
+    """複数の Claude for Desktop インスタンスを束ね、空いているものに communicate を振り分けるクラス
+
+    各インスタンスは一度に 1 つの要求だけを処理する。空きを待つ要求は到着順に割り当てられる。
+    inject.js への ping に応答しなくなったインスタンスは停止して作り直す。
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        *,
+        exe_path: str = r"%LOCALAPPDATA%\AnthropicClaude\claude.exe",
+        wd: str | list[str] | None = None,
+        addr: str = "127.0.0.1",
+        base_port: int = 9223,
+        attach: bool = False,
+        inject_mode: Literal["console", "cdp"] = "console",
+        debugging_base_port: int = 9222,
+        buffer: BufferConfig | None = None,
+        batching: PageBatching | None = None,
+        cache: ResponseCache | None = None,
+        observers: Iterable[ClientObserver] = (),
+        prewarm: bool = False,
+        factory: Callable[[int], Client] | None = None,
+        health_interval: float = 10.0,
+        health_timeout: float = 3.0,
+        max_failures: int = 2,
+    ):
+        """
+        Args:
+            size: インスタンス数
+            wd: 作業ディレクトリ。リストならインスタンスごとに指定する
+            base_port: i 番目のインスタンスは base_port + i で待ち受ける
+            attach: True なら起動せず、既にスクリプトが注入されたインスタンスの接続を待つ
+            inject_mode: スクリプトの注入方法。"cdp" なら i 番目のインスタンスは debugging_base_port + i を使う
+            buffer: 各 Client のストリームのバッファ設定
+            batching: 各 Client のページ側でチャンクをまとめる設定
+            cache: 全 Client で共有する応答のキャッシュ
+            observers: 全 Client で共有するフック。ClientMetrics なら instance ラベルで区別される
+            prewarm: 各 Client で次のプロンプト用の新しいチャットを開いておく（Client の prewarm）
+            factory: i 番目の Client を作る関数。指定すると exe_path, wd, addr, base_port, attach, inject_mode,
+                debugging_base_port, buffer, batching, cache, observers, prewarm は使わない
+        """
+        if factory is None:
+            observers = tuple(observers)
+
+            def factory(i: int) -> Client:
+                member_wd = wd[i] if isinstance(wd, list) else wd
+                return Client(
+                    exe_path,
+                    member_wd,
+                    addr,
+                    base_port + i,
+                    attach=attach,
+                    inject_mode=inject_mode,
+                    debugging_port=debugging_base_port + i,
+                    buffer=buffer,
+                    batching=batching,
+                    cache=cache,
+                    observers=observers,
+                    prewarm=prewarm,
+                )
+
+        self.size = size
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.max_failures = max_failures
+        self._factory = factory
+        self._members: list[_Member | None] = [None] * size
+        self._idle: asyncio.Queue[_Member] = asyncio.Queue()
+        self._tasks: set[asyncio.Task] = set()
+        self._closing = False
+
+    def _alive(self) -> list[_Member]:
+        return [m for m in self._members if m is not None and m.ready and not m.dead]
+
+    @property
+    def clients(self) -> list[Client]:
+        return [m.client for m in self._alive()]
+
+    @property
+    def idle(self) -> int:
+        return sum(1 for m in self._alive() if not m.busy)
+
+    @asynccontextmanager
+    async def run(self):
+        self._closing = False
+        await asyncio.gather(*(self._start(i) for i in range(self.size)))
+        if not self.clients:
+            raise RuntimeError("Failed to start any Claude instance")
+        for member in self._members:
+            if member is not None and member.dead:
+                self._spawn(self._replace(member))
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            yield self
+        finally:
+            self._closing = True
+            monitor.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*(self._stop(m) for m in self._members if m is not None))
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Client]:
+        """空いている Client を 1 つ借りる。返却されるまで他の要求には割り当てない"""
+        while True:
+            member = await self._idle.get()
+            if not member.dead:
+                break
+        member.busy = True
+        try:
+            yield member.client
+        except ConnectionError:
+            self._mark_dead(member)
+            raise
+        finally:
+            member.busy = False
+            if member.dead:
+                self._spawn(self._replace(member))
+            else:
+                self._idle.put_nowait(member)
+
+    async def communicate(self, message: str) -> AsyncIterator[ServerSentEvent]:
+        async with self.acquire() as client:
+            async for event in client.communicate(message):
+                yield event
+
+    async def _start(self, index: int) -> bool:
+        member = _Member(index, self._factory(index))
+        self._members[index] = member
+        try:
+            await member.stack.enter_async_context(member.client.run())
+        except Exception:
+            logger.exception(f"failed to start instance #{index}")
+            member.dead = True
+            await self._stop(member)
+            return False
+        logger.info(f"instance #{index} ready on port {member.client.port}")
+        member.ready = True
+        self._idle.put_nowait(member)
+        return True
+
+    async def _stop(self, member: _Member):
+        try:
+            await member.stack.aclose()
+        except Exception:
+            logger.exception(f"failed to stop instance #{member.index}")
+
+    async def _replace(self, member: _Member):
+        if self._members[member.index] is not member:
+            return
+        logger.warning(f"replacing instance #{member.index}")
+        await self._stop(member)
+        delay = 1.0
+        while not self._closing and not await self._start(member.index):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _mark_dead(self, member: _Member):
+        if not member.dead:
+            logger.warning(f"instance #{member.index} is not responding")
+            member.dead = True
+
+    async def _check(self, member: _Member):
+        if await member.client.ping(self.health_timeout):
+            member.failures = 0
+            return
+        member.failures += 1
+        if member.failures >= self.max_failures:
+            self._mark_dead(member)
+            if not member.busy:
+                # 貸し出し中のものは返却時に作り直す
+                self._spawn(self._replace(member))
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self._check(m) for m in self._alive()))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
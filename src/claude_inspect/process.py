@@ -1,12 +1,13 @@
 import os
 import time
-import subprocess
+import asyncio
 import logging
+import weakref
+from contextlib import AsyncExitStack
+from typing import Awaitable, Callable, Literal
 
-from claco.sender import Sender
-
+from claude_inspect.backend import PlatformBackend
 from claude_inspect.script_wrapper import wrap_script_code, wrap_script_file
-import claude_inspect.win as win
 
 
 logger = logging.getLogger(__name__)
@@ -30,127 +31,226 @@ def _load_scripts(
     return result
 
 
+# 起動中のインスタンスが使っているウィンドウ。同時に起動したインスタンス同士で取り合わないようにする
+_claimed_windows: set[int] = set()
+# Console へのキー入力はタイトルで対象を探すので、同時に行わない。
+# asyncio.Lock はイベントループに結び付くので、同期版の start() / stop() のように asyncio.run を
+# 繰り返しても使えるよう、ループごとに作る
+_inject_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+
+def _inject_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _inject_locks.get(loop)
+    if lock is None:
+        lock = _inject_locks[loop] = asyncio.Lock()
+    return lock
+
+
 class ClaudeDesktopProcess:
     """Claude for Desktop の操作を行うクラス"""
 
+    MAIN_APP_TITLE = "Claude"
+    DEVTOOLS_TITLE = "Developer Tools - https://claude.ai/"
+
     def __init__(
         self,
         exe_path: str,
         wd: str,
         inject_script: str | None = None,
+        *,
+        backend: PlatformBackend | None = None,
+        ready: Callable[[float], Awaitable[bool]] | None = None,
+        inject_mode: Literal["console", "cdp"] = "console",
+        debugging_port: int = 9222,
     ):
+        """
+        Args:
+            backend: OS 依存の操作。省略時は WinBackend
+            ready: 注入したスクリプトの準備完了を待つ関数。タイムアウト秒を受け取り、準備できたら True を返す。
+                省略時は入力が終わった時点で完了とみなす
+            inject_mode: "console" なら DevTools の Console にキー入力で注入する。
+                "cdp" なら --remote-debugging-port で起動し、Chrome DevTools Protocol で評価する
+            debugging_port: inject_mode="cdp" のときのリモートデバッグ用ポート
+        """
+        if backend is None:
+            from claude_inspect.backend import WinBackend
+
+            backend = WinBackend()
+
         self.exe_path = exe_path
         self.wd = wd
         self.inject_script = inject_script
+        self.backend = backend
+        self.ready = ready
+        self.inject_mode = inject_mode
+        self.debugging_port = debugging_port
         self.minimize = True
+        self.window_timeout = 10.0
+        self.inject_retries = 3
+        self.ready_timeout = 2.0
         self._pid = None
         self._dev_tools_pid = None
-        self._keysender = Sender()
-        self.MAIN_APP_TITLE = "Claude"
-        self.DEVTOOLS_TITLE = "Developer Tools - https://claude.ai/"
+        self._hwnds: list[int] = []
+        # cdp モードでは、再読み込み後も注入されるようにセッションを開いたままにする
+        self._cdp = AsyncExitStack()
+
+    async def _open_claude(self):
+        if self.inject_mode == "cdp":
+            return await self._open_claude_cdp()
 
-    def _open_claude(self, timeout=3.0):
         env = os.environ.copy()
         env["CLAUDE_DEV_TOOLS"] = "detach"
         # env["CLAUDE_DEV"] = "1"
 
-        startupinfo = subprocess.STARTUPINFO()
-        # ウィンドウを最小化するフラグを設定
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        startupinfo.wShowWindow = 6  # SW_MINIMIZE
-
-        process = subprocess.Popen(
-            [
-                self.exe_path,
-                # f"--remote-debugging-port={self.port}",
-                # f"--remote-allow-origins=http://localhost:{self.port}",
-            ],
-            cwd=self.wd,
-            env=env,
-            startupinfo=startupinfo,
-        )
-
-        if process.poll() is not None:
-            raise RuntimeError("Failed to start process")
+        pid = self.backend.spawn(self.exe_path, self.wd, env)
 
         # ウィンドウが表示されるまで待機
-        t0 = time.time()
-        hwnd_main = None
-        hwnd_dev_tools = None
-        while time.time() - t0 < timeout:
-            if hwnd_main is None:
-                hwnd_main = win.find_window_by_title(self.MAIN_APP_TITLE)
-            if hwnd_dev_tools is None:
-                hwnd_dev_tools = win.find_window_by_title(self.DEVTOOLS_TITLE)
-            if hwnd_main and hwnd_dev_tools:
-                break
-            time.sleep(0.01)
+        hwnd_main, hwnd_dev_tools = await asyncio.gather(
+            self._claim_window(self.MAIN_APP_TITLE),
+            self._claim_window(self.DEVTOOLS_TITLE),
+        )
 
         if hwnd_main == hwnd_dev_tools:
             # detach できてない
             logger.warning(f"Failed to detach devtools")
-            win.terminate_process(process.pid)
+            self._release_windows()
+            await self.backend.terminate_process(pid)
             return None
 
         pid_main = None
         pid_dev_tools = None
         if hwnd_main:
-            pid_main = win.get_pid_from_hwnd(hwnd_main)
+            pid_main = self.backend.get_pid_from_hwnd(hwnd_main)
         if hwnd_dev_tools:
-            pid_dev_tools = win.get_pid_from_hwnd(hwnd_dev_tools)
+            pid_dev_tools = self.backend.get_pid_from_hwnd(hwnd_dev_tools)
         if not pid_main or not pid_dev_tools:
+            self._release_windows()
             if pid_main:
-                win.terminate_process(pid_main)
+                await self.backend.terminate_process(pid_main)
             if pid_dev_tools and (pid_main is None or pid_main != pid_dev_tools):
-                win.terminate_process(pid_dev_tools)
+                await self.backend.terminate_process(pid_dev_tools)
             logger.warning(f"Failed to detect main window and/or devtools window")
             return None
 
         # Console を表示してスクリプトを注入
-        if self.inject_script:
-            time.sleep(3)
-            win.click_window_at_position(hwnd_dev_tools, 146, 14)  # Console タブをクリック
-            h, e = self._keysender.sends(
-                self.MAIN_APP_TITLE,
-                [(self.inject_script, False), ("{Enter}", True)],
-                window_title=self.DEVTOOLS_TITLE,
-            )
-            if not h:
-                logger.warning(f"Failed to send keys: {e}")
-            time.sleep(1)
+        if self.inject_script and not await self._inject(hwnd_dev_tools):
+            logger.warning(f"Failed to inject script")
+            await self._terminate(pid_main, pid_dev_tools)
+            return None
 
         if self.minimize:
-            win.minimize_window(hwnd_main)
-            win.minimize_window(hwnd_dev_tools)
+            self.backend.minimize_window(hwnd_main)
+            self.backend.minimize_window(hwnd_dev_tools)
 
         return pid_main, pid_dev_tools
 
-    def start(self):
+    async def _open_claude_cdp(self):
+        env = os.environ.copy()
+        args = [f"--remote-debugging-port={self.debugging_port}"]
+
+        pid = self.backend.spawn(self.exe_path, self.wd, env, args)
+
+        hwnd_main = await self._claim_window(self.MAIN_APP_TITLE)
+        pid_main = self.backend.get_pid_from_hwnd(hwnd_main) if hwnd_main else None
+        if not pid_main:
+            self._release_windows()
+            await self.backend.terminate_process(pid)
+            logger.warning(f"Failed to detect main window")
+            return None
+
+        if self.inject_script and not await self._inject_cdp():
+            logger.warning(f"Failed to inject script")
+            await self._terminate(pid_main, None)
+            return None
+
+        if self.minimize:
+            self.backend.minimize_window(hwnd_main)
+
+        return pid_main, None
+
+    async def _inject_cdp(self) -> bool:
+        from claude_inspect.cdp import CDPError, CDPSession, wait_target
+
+        for attempt in range(self.inject_retries):
+            try:
+                target = await wait_target(self.debugging_port, timeout=self.window_timeout)
+                session = await self._cdp.enter_async_context(CDPSession.connect(target["webSocketDebuggerUrl"]))
+                await session.add_script_on_new_document(self.inject_script)
+                await session.evaluate(self.inject_script)
+            except (OSError, TimeoutError, CDPError) as e:
+                logger.warning(f"{attempt + 1}/{self.inject_retries}: CDP injection failed: {e}")
+                await self._cdp.aclose()
+                continue
+            if self.ready is None or await self.ready(self.ready_timeout):
+                return True
+            logger.warning(f"{attempt + 1}/{self.inject_retries}: script not ready, retrying...")
+            await self._cdp.aclose()
+        return False
+
+    async def _claim_window(self, title: str) -> int | None:
+        hwnd = await self.backend.wait_window(title, self.window_timeout, _claimed_windows)
+        if hwnd:
+            # 見つけた時点で確保し、同時に起動している他のインスタンスに渡さない
+            _claimed_windows.add(hwnd)
+            self._hwnds.append(hwnd)
+        return hwnd
+
+    def _release_windows(self):
+        _claimed_windows.difference_update(self._hwnds)
+        self._hwnds = []
+
+    async def _inject(self, hwnd_dev_tools: int) -> bool:
+        # 固定時間待つ代わりに、注入したスクリプトからの接続を準備完了の合図にする
+        # Console の準備が間に合わず入力が失われた場合は入力し直す
+        for attempt in range(self.inject_retries):
+            async with _inject_lock():
+                sent = await self.backend.inject(
+                    self.MAIN_APP_TITLE,
+                    self.DEVTOOLS_TITLE,
+                    hwnd_dev_tools,
+                    self.inject_script,
+                )
+            if sent and self.ready is None:
+                return True
+            if sent and await self.ready(self.ready_timeout):
+                return True
+            logger.warning(f"{attempt + 1}/{self.inject_retries}: script not ready, retrying...")
+        return False
+
+    async def _terminate(self, pid_main: int, pid_dev_tools: int | None):
+        self._release_windows()
+        await self._cdp.aclose()
+        exitcode = await self.backend.terminate_process(pid_main)
+        if pid_dev_tools is not None and pid_main != pid_dev_tools:
+            await self.backend.terminate_process(pid_dev_tools)
+        return exitcode
+
+    async def astart(self):
         if self._pid is not None or self._dev_tools_pid is not None:
             raise RuntimeError(f"Process already started: {self._pid}, {self._dev_tools_pid}")
 
+        t0 = time.perf_counter()
         RETRY = 3
         result = None
         for retry in range(RETRY):
-            result = self._open_claude()
+            result = await self._open_claude()
             if result is not None:
                 break
             logger.warning(f"{retry}/{RETRY}: failed to detect main window and/or devtools window, retrying...")
-            time.sleep(0.5)
+            await asyncio.sleep(0.5)
         if result is None:
             raise RuntimeError("Failed to start process")
 
         pid_main, pid_dev_tools = result
-        logger.info(f"{pid_main=}, {pid_dev_tools=}")
+        logger.info(f"{pid_main=}, {pid_dev_tools=}, startup={time.perf_counter() - t0:.3f}s")
         self._pid = pid_main
         self._dev_tools_pid = pid_dev_tools
 
-    def stop(self):
+    async def astop(self):
         if self._pid is None:
             raise RuntimeError("Process not started")
-        exitcode = win.terminate_process(self._pid)
-        if self._pid != self._dev_tools_pid:
-            win.terminate_process(self._dev_tools_pid)
+        exitcode = await self._terminate(self._pid, self._dev_tools_pid)
         if exitcode is None:
             raise RuntimeError("Failed to terminate process")
         logger.info(f"{exitcode=}")
@@ -158,9 +258,22 @@ class ClaudeDesktopProcess:
         self._dev_tools_pid = None
         return exitcode
 
+    def start(self):
+        asyncio.run(self.astart())
+
+    def stop(self):
+        return asyncio.run(self.astop())
+
     def __enter__(self):
         self.start()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop()
+
+    async def __aenter__(self):
+        await self.astart()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.astop()
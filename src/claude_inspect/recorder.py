@@ -0,0 +1,123 @@
+import os
+import mmap
+import time
+import struct
+import logging
+from dataclasses import dataclass
+from typing import Iterator
+
+
+logger = logging.getLogger(__name__)
+
+
+# ファイル先頭のマジックとバージョン
+MAGIC = b"CIREC\x00\x01\n"
+
+# 各フレームの前に置くヘッダ: 時刻 (UNIX 秒, float64), 向き (u8), 種類 (u8), 長さ (u32)
+_HEADER = struct.Struct("<dBBI")
+
+# 向き
+RECV = 0  # ページ -> Client
+SENT = 1  # Client -> ページ
+
+
+@dataclass(slots=True)
+class Frame:
+    """記録された 1 フレーム。payload はログを mmap した領域をそのまま指す"""
+
+    t: float
+    direction: int
+    binary: bool
+    payload: memoryview
+
+    @property
+    def text(self) -> str:
+        return str(self.payload, "utf-8")
+
+
+class FrameRecorder:
+    """websocket のフレームを追記専用のログに書き出すクラス
+
+    書き込みはバッファし、flush_interval ごとにまとめてディスクに書く。
+    """
+
+    def __init__(self, path: str, *, flush_interval: float = 0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self._io = open(path, "ab")
+        if self._io.tell() == 0:
+            self._io.write(MAGIC)
+        self._last_flush = time.monotonic()
+
+    def write(self, direction: int, msg: str | bytes | bytearray | memoryview):
+        binary = not isinstance(msg, str)
+        payload = msg if binary else msg.encode("utf-8")
+        self._io.write(_HEADER.pack(time.time(), direction, binary, len(payload)))
+        self._io.write(payload)
+        self.frames += 1
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._io.flush()
+            self._last_flush = now
+
+    def flush(self):
+        self._io.flush()
+
+    def close(self):
+        if not self._io.closed:
+            self._io.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FrameLog:
+    """FrameRecorder が書いたログを mmap して読むクラス
+
+    フレームの中身はコピーせず memoryview として返す。書き込み途中で切れた末尾のフレームは無視する。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as io:
+            size = os.fstat(io.fileno()).st_size
+            if size < len(MAGIC):
+                raise ValueError(f"not a frame log: {path}")
+            self._mmap = mmap.mmap(io.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"not a frame log: {path}")
+        self._view = memoryview(self._mmap)
+
+    def __iter__(self) -> Iterator[Frame]:
+        view = self._view
+        size = len(view)
+        unpack_from = _HEADER.unpack_from
+        header_size = _HEADER.size
+        offset = len(MAGIC)
+        while offset + header_size <= size:
+            t, direction, binary, length = unpack_from(view, offset)
+            offset += header_size
+            if offset + length > size:
+                logger.warning(f"truncated frame at {offset - header_size} in {self.path}")
+                return
+            yield Frame(t, direction, bool(binary), view[offset : offset + length])
+            offset += length
+
+    def close(self):
+        try:
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            # 読み手がまだフレームを参照している。参照がなくなれば GC で閉じられる
+            logger.debug(f"frame log still referenced: {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -26,4 +26,4 @@ def wrap_script_file(path: str, name: str | None = None) -> str:
 
 def load_script_file(name: str) -> str:
     with importlib.resources.path("claude_inspect.js", name) as path:
-        return wrap_script_file(path, name.rstrip(".js"))
+        return wrap_script_file(path, name.removesuffix(".js"))
@@ -0,0 +1,510 @@
+import json
+import time
+import uuid
+import random
+import asyncio
+import logging
+from http import HTTPStatus
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import websockets
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SimulatorConfig:
+    """DesktopSimulator の振る舞い
+
+    Attributes:
+        response_tokens: 1 回の応答に含める content_block_delta の数
+        tokens: 応答に使うトークン。順に繰り返して使う
+        chunk_size: ネットワークチャンクのバイト数。None ならイベントごとに送る
+        tokens_per_sec: 生成速度。None なら待たずに送る
+        first_token_delay: apply_chat から最初のトークンまでの遅延（秒）
+        op_latency: 各 op の処理にかかる時間（秒）
+        op_error_rate: op が javascript_error で失敗する確率
+        stream_error_rate: 応答の途中で event: error を返す確率
+        disconnect_rate: 応答の途中で websocket を切断する確率
+        reconnect_delay: 切断後に再接続するまでの時間（秒）。inject.js と同じく 1 秒
+        resume: inject.js と同じく、送ったフレームを ack まで取っておき、再接続後に送り直す（"resume"）。
+            False なら切断中のフレームは捨て、disconnect_rate で切断した応答はそこで終わる
+        resume_bytes: 取っておくフレームのバイト数の上限
+        seed: 乱数のシード
+    """
+
+    response_tokens: int = 200
+    tokens: list[str] = field(default_factory=lambda: ["Hello", ",", " world", "!", " こんにちは", "。", "\n\n"])
+    chunk_size: int | None = None
+    tokens_per_sec: float | None = None
+    first_token_delay: float = 0.0
+    op_latency: float = 0.0
+    op_error_rate: float = 0.0
+    stream_error_rate: float = 0.0
+    disconnect_rate: float = 0.0
+    reconnect_delay: float = 1.0
+    resume: bool = True
+    resume_bytes: int = 16 << 20
+    seed: int | None = None
+
+
+def make_sse_response(tokens: list[str], *, error_at: int | None = None) -> list[bytes]:
+    """Claude の応答と同じ並びの SSE イベントを作る"""
+
+    def event(name: str, data: dict) -> bytes:
+        # Claude と同じく空白を含まない JSON
+        return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n".encode()
+
+    events = [
+        event("message_start", {"type": "message_start", "message": {"id": "msg_sim", "type": "message", "role": "assistant", "content": []}}),
+        event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+    ]
+    for i, token in enumerate(tokens):
+        if i == error_at:
+            events.append(event("error", {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}}))
+            return events
+        delta = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}}
+        events.append(event("content_block_delta", delta))
+    events += [
+        event("content_block_stop", {"type": "content_block_stop", "index": 0}),
+        event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}}),
+        event("message_stop", {"type": "message_stop"}),
+    ]
+    return events
+
+
+class DesktopSimulator:
+    """inject.js の代わりに Client の websocket サーバへ接続し、Claude for Desktop のページを模倣するクラス
+
+    _operations.js の op に応答し、apply_chat では設定に従って SSE 応答を流す。
+    """
+
+    def __init__(self, url: str, config: SimulatorConfig | None = None):
+        self.url = url
+        self.config = config or SimulatorConfig()
+        self.rng = random.Random(self.config.seed)
+        # ページの状態
+        self.input = ""
+        self.location = "/new"
+        self.sent_prompts: list[str] = []
+        # チャットごとに送られたプロンプト。new_chat で新しいチャットが始まる
+        self.chats: list[list[str]] = [[]]
+        # 添付されたファイル（名前, MIME タイプ, 中身）。apply_chat で送られる
+        self.attachments: list[tuple[str, str, bytes]] = []
+        self.sent_attachments: list[list[tuple[str, str, bytes]]] = []
+        # 受信途中の大きな入力。upload id -> 中身
+        self._uploads: dict[int, bytearray] = {}
+        # inject.js の outbox と同じく、番号を振って ack まで取っておくフレーム
+        self.session = uuid.uuid4().hex
+        self._next_seq = 0
+        self._outbox: deque[tuple[int, str | bytes]] = deque()
+        self._outbox_bytes = 0
+        self._paused = False
+        self._last_op = 0
+        self.resumed = 0
+        self.chunks_sent = 0
+        self.frames_sent = 0
+        # configure op で設定される、チャンクをまとめて送る設定（秒, バイト）
+        self.flush_interval = 0.0
+        self.flush_bytes = 0
+        # auto_approve op で設定される、自動承認するツール
+        self.auto_approve_tools: list[str] = []
+        self.auto_approve_patterns: list[str] = []
+        # 生成中の応答と、stop_generation で止められたときに立てるフラグ
+        self._generating: asyncio.Event | None = None
+        self._stop_requested = False
+        self.stopped = 0
+        self._pending: dict[int, bytearray] = {}
+        self._flush_timers: dict[int, asyncio.TimerHandle] = {}
+        self._ws: websockets.ClientConnection | None = None
+        self._next_stream_id = 1
+        self._stream_owners: list[int] = []
+        self._tasks: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def run(self):
+        """接続と再接続を繰り返す"""
+        try:
+            while True:
+                try:
+                    async with websockets.connect(self.url, max_size=None) as ws:
+                        self._ws = ws
+                        features = ["coalesce", "auto_approve", "upload"]
+                        if self.config.resume:
+                            features.append("resume")
+                            self._paused = True
+                        ping = {"type": "ping", "features": features, "session": self.session, "seq": self._next_seq, "last_op": self._last_op}
+                        await ws.send(json.dumps(ping))
+                        async for msg in ws:
+                            if isinstance(msg, bytes):
+                                # 後に続く paste op より先に届くよう、その場で受け取る
+                                self._receive_upload(msg)
+                                continue
+                            msg = json.loads(msg)
+                            if "ack" in msg:
+                                self._acknowledge(msg["ack"])
+                                continue
+                            self._last_op = max(self._last_op, msg["id"])
+                            self._spawn(self._dispatch(msg))
+                except (OSError, websockets.ConnectionClosed):
+                    pass
+                finally:
+                    self._ws = None
+                    self._uploads.clear()
+                await asyncio.sleep(self.config.reconnect_delay)
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+
+    async def _send(self, data: str | bytes):
+        if self.config.resume:
+            self._outbox.append((self._next_seq, data))
+            self._next_seq += 1
+            self._outbox_bytes += len(data)
+            while self._outbox_bytes > self.config.resume_bytes and len(self._outbox) > 1:
+                self._outbox_bytes -= len(self._outbox.popleft()[1])
+            if self._paused:
+                return
+        # inject.js の __send と同じく、切断中のフレームは送らない
+        ws = self._ws
+        if ws is None:
+            return
+        try:
+            await ws.send(data)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _send_control(self, obj: dict):
+        await self._send(json.dumps(obj))
+
+    async def _send_chunk(self, stream_id: int, chunk: bytes):
+        self.chunks_sent += 1
+        if not self.flush_interval:
+            await self._send_frame(stream_id, chunk)
+            return
+        # inject.js と同じく、時間かバイト数のどちらかに達するまでまとめる
+        pending = self._pending.get(stream_id)
+        if pending is None:
+            pending = self._pending[stream_id] = bytearray()
+            self._flush_timers[stream_id] = asyncio.get_running_loop().call_later(
+                self.flush_interval, lambda: self._spawn(self._flush(stream_id))
+            )
+        pending += chunk
+        if self.flush_bytes and len(pending) >= self.flush_bytes:
+            await self._flush(stream_id)
+
+    async def _flush(self, stream_id: int):
+        timer = self._flush_timers.pop(stream_id, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(stream_id, None)
+        if pending:
+            await self._send_frame(stream_id, bytes(pending))
+
+    async def _send_frame(self, stream_id: int, data: bytes):
+        self.frames_sent += 1
+        await self._send(stream_id.to_bytes(4) + data)
+
+    def _acknowledge(self, seq: int):
+        while self._outbox and self._outbox[0][0] < seq:
+            self._outbox_bytes -= len(self._outbox.popleft()[1])
+
+    def _receive_upload(self, msg: bytes):
+        upload_id = int.from_bytes(msg[:4])
+        self._uploads.setdefault(upload_id, bytearray()).extend(memoryview(msg)[4:])
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, msg: dict):
+        op_id, op, args = msg["id"], msg["op"], msg.get("args", [])
+        if msg.get("stream"):
+            self._stream_owners.append(op_id)
+        t0 = time.perf_counter()
+        try:
+            func = getattr(self, f"op_{op}", None)
+            if func is None:
+                raise RuntimeError(f"operation not found: {op}")
+            if self.config.op_latency:
+                await asyncio.sleep(self.config.op_latency)
+            if self.rng.random() < self.config.op_error_rate:
+                raise RuntimeError(f"injected error: {op}")
+            value = await func(*args)
+        except Exception as e:
+            if op_id in self._stream_owners:
+                self._stream_owners.remove(op_id)
+            error = {"type": "javascript_error", "message": f"Error: {e}"}
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            await self._send_control({"type": "result", "id": op_id, "ok": False, "error": error, "elapsed_ms": elapsed_ms})
+        else:
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            await self._send_control({"type": "result", "id": op_id, "ok": True, "value": value, "elapsed_ms": elapsed_ms})
+
+    #
+    # operations
+    #
+
+    async def op_ping(self):
+        return "pong"
+
+    async def op_configure(self, options: dict | None = None):
+        options = options or {}
+        self.flush_interval = options.get("flush_interval_ms", 0) / 1000
+        self.flush_bytes = options.get("flush_bytes", 0)
+        return options
+
+    async def op_auto_approve(self, tools: list[str] | None = None, patterns: list[str] | None = None):
+        if tools is not None:
+            self.auto_approve_tools = list(tools)
+        if patterns is not None:
+            self.auto_approve_patterns = list(patterns)
+        return {"tools": self.auto_approve_tools, "patterns": self.auto_approve_patterns}
+
+    async def op_auto_approve_stats(self, baseline: bool | None = None):
+        # ツールの確認ダイアログは出さず DOM もないので、数えるものはない
+        return {
+            "body_callbacks": 0,
+            "portal_callbacks": 0,
+            "dialogs": 0,
+            "approved": 0,
+            "observer_ms": 0,
+            "baseline_callbacks": 0,
+            "baseline_mutations": 0,
+            "baseline_ms": 0,
+        }
+
+    async def op_resume(self, seq: int):
+        oldest = self._outbox[0][0] if self._outbox else self._next_seq
+        if not oldest <= seq <= self._next_seq:
+            # inject.js と同じく、新しいセッションとして接続し直す
+            self.session = uuid.uuid4().hex
+            self._next_seq = 0
+            self._outbox.clear()
+            self._outbox_bytes = 0
+            if self._ws is not None:
+                await self._ws.close()
+            raise RuntimeError(f"cannot resume from frame {seq}: frames {oldest} to {self._next_seq} are kept")
+        self._acknowledge(seq)
+        # 送り直している間に溜まったフレームも、送り終えてから通す。送り直したフレームの ack で
+        # 先頭が捨てられていくので、位置は番号から求める
+        ws = self._ws
+        sent = seq
+        while sent < self._next_seq:
+            await ws.send(self._outbox[sent - self._outbox[0][0]][1])
+            sent += 1
+        self._paused = False
+        if sent > seq:
+            self.resumed += 1
+        return {"resent": sent - seq}
+
+    async def op_stop_generation(self):
+        generating = self._generating
+        if generating is None:
+            return False
+        self._stop_requested = True
+        await generating.wait()
+        return True
+
+    async def op_put_chat(self, text: str):
+        self.input = text
+
+    async def op_clear_chat(self):
+        self.input = ""
+
+    async def op_paste(self, upload_id: int, options: dict | None = None):
+        options = options or {}
+        data = self._uploads.pop(upload_id, None)
+        if data is None:
+            raise RuntimeError(f"upload {upload_id} not found")
+        for old in [i for i in self._uploads if i < upload_id]:
+            del self._uploads[old]
+        if options.get("as") == "file":
+            self.attachments.append((options.get("name", "paste.txt"), options.get("type", "text/plain"), bytes(data)))
+            return {"bytes": len(data), "files": 1}
+        self.input = data.decode()
+        return {"bytes": len(data), "chars": len(self.input.replace("\r", "").replace("\n", ""))}
+
+    async def op_new_chat(self, project_id: str | None = None):
+        self.location = f"/project/{project_id}" if project_id else "/new"
+        if self.chats[-1]:
+            self.chats.append([])
+        return self.location
+
+    async def op_apply_chat(self):
+        if not self.input:
+            raise RuntimeError("Input element not found")
+        self.sent_prompts.append(self.input)
+        self.chats[-1].append(self.input)
+        self.sent_attachments.append(self.attachments)
+        self.input = ""
+        self.attachments = []
+        self._spawn(self._respond())
+
+    def start_chat(self, prompt: str = ""):
+        """人がアプリ上で直接送信したチャットを模倣する。どの op にも属さないストリームが流れる"""
+        self.sent_prompts.append(prompt)
+        self._spawn(self._respond(claimed=False))
+
+    async def _respond(self, claimed: bool = True):
+        self._generating = generating = asyncio.Event()
+        self._stop_requested = False
+        try:
+            await self._generate(claimed)
+        finally:
+            self._generating = None
+            generating.set()
+
+    async def _generate(self, claimed: bool):
+        config = self.config
+        rng = self.rng
+        stream_id = self._next_stream_id
+        self._next_stream_id += 1
+        owner = self._stream_owners.pop(0) if claimed and self._stream_owners else None
+        await self._send_control(
+            {"type": "stream", "state": "open", "stream": stream_id, "owner": owner, "url": f"https://claude.ai{self.location}"}
+        )
+
+        n = config.response_tokens
+        tokens = [config.tokens[i % len(config.tokens)] for i in range(n)]
+        error_at = rng.randrange(n) if n and rng.random() < config.stream_error_rate else None
+        disconnect_at = rng.randrange(n) if n and rng.random() < config.disconnect_rate else None
+        events = make_sse_response(tokens, error_at=error_at)
+
+        if config.first_token_delay:
+            await asyncio.sleep(config.first_token_delay)
+        interval = 1 / config.tokens_per_sec if config.tokens_per_sec else 0.0
+
+        buf = bytearray()
+        for i, event in enumerate(events):
+            if self._stop_requested:
+                # アプリと同じく、読み込みを中断してストリームを閉じる
+                self.stopped += 1
+                await self._flush(stream_id)
+                await self._send_control(
+                    {"type": "stream", "state": "close", "stream": stream_id, "error": "AbortError: BodyStreamBuffer was aborted"}
+                )
+                return
+            if i - 2 == disconnect_at and self._ws is not None:
+                await self._ws.close()
+                if not config.resume:
+                    return
+            if config.chunk_size is None:
+                await self._send_chunk(stream_id, event)
+            else:
+                buf += event
+                while len(buf) >= config.chunk_size:
+                    await self._send_chunk(stream_id, bytes(buf[: config.chunk_size]))
+                    del buf[: config.chunk_size]
+            if interval and event.startswith(b"event: content_block_delta"):
+                await asyncio.sleep(interval)
+        if buf:
+            await self._send_chunk(stream_id, bytes(buf))
+        await self._flush(stream_id)
+        await self._send_control({"type": "stream", "state": "close", "stream": stream_id})
+
+
+class CDPSimulator:
+    """Chrome DevTools Protocol のリモートデバッグ用エンドポイントを模倣するクラス
+
+    /json/list でページを 1 つ公開し、Runtime.evaluate と Page.addScriptToEvaluateOnNewDocument に応答する。
+    評価されたスクリプトは on_evaluate に渡されるので、DesktopSimulator の接続などに使う。
+    """
+
+    def __init__(
+        self,
+        port: int,
+        host: str = "127.0.0.1",
+        *,
+        url: str = "https://claude.ai/new",
+        on_evaluate: Callable[[str], Awaitable[None] | None] | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.url = url
+        self.on_evaluate = on_evaluate
+        self.evaluated: list[str] = []
+        self.scripts_on_new_document: dict[str, str] = {}
+        self._server = None
+
+    @property
+    def target(self) -> dict:
+        return {
+            "id": "SIMULATOR",
+            "type": "page",
+            "title": "Claude",
+            "url": self.url,
+            "webSocketDebuggerUrl": f"ws://{self.host}:{self.port}/devtools/page/SIMULATOR",
+        }
+
+    async def __aenter__(self):
+        self._server = await websockets.serve(self._handler, self.host, self.port, process_request=self._process_request)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _process_request(self, connection, request):
+        if request.path in ("/json", "/json/list"):
+            response = connection.respond(HTTPStatus.OK, json.dumps([self.target]))
+            response.headers["Content-Type"] = "application/json"
+            return response
+        return None
+
+    async def _evaluate(self, script: str):
+        self.evaluated.append(script)
+        if self.on_evaluate is not None:
+            result = self.on_evaluate(script)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def reload(self):
+        """ページの再読み込みを模倣し、登録済みのスクリプトを評価する"""
+        for source in list(self.scripts_on_new_document.values()):
+            await self._evaluate(source)
+
+    def crash(self):
+        """アプリの異常終了を模倣し、各セッションの接続を close フレームなしで切る"""
+        for connection in self._server.connections:
+            connection.transport.abort()
+
+    async def _handler(self, ws: websockets.ServerConnection):
+        # 登録はセッションごとで、切断されたら消える
+        registered = []
+        try:
+            async for msg in ws:
+                req = json.loads(msg)
+                method, params = req["method"], req.get("params", {})
+                if method == "Runtime.evaluate":
+                    await self._evaluate(params["expression"])
+                    result = {"result": {"type": "undefined"}}
+                elif method == "Page.addScriptToEvaluateOnNewDocument":
+                    identifier = str(len(self.scripts_on_new_document) + 1)
+                    self.scripts_on_new_document[identifier] = params["source"]
+                    registered.append(identifier)
+                    result = {"identifier": identifier}
+                else:
+                    await ws.send(json.dumps({"id": req["id"], "error": {"code": -32601, "message": f"'{method}' wasn't found"}}))
+                    continue
+                await ws.send(json.dumps({"id": req["id"], "result": result}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for identifier in registered:
+                self.scripts_on_new_document.pop(identifier, None)
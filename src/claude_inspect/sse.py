@@ -0,0 +1,172 @@
+import re
+import json
+from typing import Any, Callable
+
+
+class ServerSentEvent:
+    """SSE の 1 イベント。anthropic._streaming.ServerSentEvent と同じ属性を持つ
+
+    anthropic SDK は読み込みが重いので、使うところだけを持っている。
+    """
+
+    __slots__ = ("_event", "_data", "_id", "_retry")
+
+    def __init__(self, *, event: str | None = None, data: str | None = None, id: str | None = None, retry: int | None = None):
+        self._event = event or None
+        self._data = "" if data is None else data
+        self._id = id
+        self._retry = retry
+
+    @property
+    def event(self) -> str | None:
+        return self._event
+
+    @property
+    def data(self) -> str:
+        return self._data
+
+    @property
+    def id(self) -> str | None:
+        return self._id
+
+    @property
+    def retry(self) -> int | None:
+        return self._retry
+
+    def json(self) -> Any:
+        return json.loads(self._data)
+
+    def __repr__(self) -> str:
+        return f"ServerSentEvent(event={self.event}, data={self.data}, id={self.id}, retry={self.retry})"
+
+
+# event と data が 1 行ずつのイベント。改行が \n だけのチャンクに使う
+_SIMPLE_EVENT = re.compile(rb"event: ?([^\n]*)\ndata: ?([^\n]*)\n\n")
+
+
+class SSEParser:
+    """チャンク境界を気にせずバイト列を流し込めるインクリメンタルな SSE パーサ
+
+    行の途中で切れたバイト列は次の feed まで保持する。UTF-8 の改行バイトは
+    マルチバイト文字の途中に現れないので、デコードは完成した行の値に対してだけ行えばよく、
+    途中で切れたコードポイントもそのまま持ち越される。
+
+    https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+    """
+
+    def __init__(self, factory: Callable[[str | None, bytes, str | None, int | None], Any] | None = None):
+        """
+        Args:
+            factory: (event, data, id, retry) からイベントを作る関数。data はデコード前のバイト列。
+                省略時は ServerSentEvent を作る
+        """
+        self._factory = factory
+        self._buf = bytearray()
+        self._skip_lf = False
+        self._event: str | None = None
+        self._data: list[bytes] = []
+        self._id: str | None = None
+        self._retry: int | None = None
+
+    @property
+    def pending(self) -> int:
+        """まだ行として完結していないバイト数"""
+        return len(self._buf)
+
+    def feed(self, chunk: bytes | bytearray | memoryview) -> list[Any]:
+        """チャンクを追加し、完結したイベントを返す"""
+        if self._skip_lf and chunk:
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+
+        events = []
+        buf = self._buf
+        if buf:
+            buf += chunk
+            data = buf
+        else:
+            # 持ち越しがなければ bytearray に溜めずにそのまま走査する
+            data = chunk if isinstance(chunk, bytes) else bytes(chunk)
+            if not self._data and self._event is None and self._retry is None and data.find(b"\r") < 0:
+                # 前のイベントが完結していれば、よくある "event: ..." と "data: ..." の 2 行だけの
+                # イベントを先頭から正規表現でまとめて切り出す
+                pos = self._match_events(data, events)
+                if pos == len(data):
+                    return events
+                data = data[pos:]
+
+        if data.find(b"\r") >= 0:
+            data = self._normalize_newlines(data)
+
+        # 改行の探索と行の切り出しは bytes.split に任せ、値だけをデコードする
+        lines = data.split(b"\n")
+        rest = lines.pop()
+        if rest:
+            self._buf = bytearray(rest)
+        else:
+            buf.clear()
+
+        append = self._data.append
+        for line in lines:
+            if not line:
+                if self._data or self._event or self._id or self._retry is not None:
+                    events.append(self._dispatch())
+                    append = self._data.append
+            elif line.startswith(b"data:"):
+                append(line[6:] if line[5:6] == b" " else line[5:])
+            elif line.startswith(b"event:"):
+                self._event = (line[7:] if line[6:7] == b" " else line[6:]).decode()
+            elif line[0] != 0x3A:  # ":" で始まる行はコメント
+                self._field(line)
+        return events
+
+    def _match_events(self, data: bytes, events: list[Any]) -> int:
+        """data の先頭から続く 2 行のイベントを events に加え、読んだバイト数を返す"""
+        match = _SIMPLE_EVENT.match
+        factory = self._factory
+        pos = 0
+        end = len(data)
+        while pos < end and (m := match(data, pos)) is not None:
+            name, raw = m.groups()
+            if factory is not None:
+                events.append(factory(name.decode(), raw, self._id, None))
+            else:
+                events.append(ServerSentEvent(event=name.decode(), data=raw.decode(), id=self._id))
+            pos = m.end()
+        return pos
+
+    def _normalize_newlines(self, data: bytes | bytearray) -> bytes | bytearray:
+        # \r\n と \r を \n に揃える。末尾の \r は次のチャンク先頭の \n と対かもしれないので覚えておく
+        self._skip_lf = data.endswith(b"\r")
+        return data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+    def _field(self, line: bytes | bytearray):
+        name, _, value = bytes(line).partition(b":")
+        if value.startswith(b" "):
+            value = value[1:]
+        if name == b"event":
+            self._event = value.decode()
+        elif name == b"data":
+            self._data.append(value)
+        elif name == b"id":
+            if b"\0" not in value:
+                self._id = value.decode()
+        elif name == b"retry":
+            try:
+                self._retry = int(value)
+            except ValueError:
+                pass
+
+    def _dispatch(self) -> Any:
+        data = self._data
+        raw = data[0] if len(data) == 1 else b"\n".join(data)
+        if self._factory is not None:
+            event = self._factory(self._event, raw, self._id, self._retry)
+        else:
+            event = ServerSentEvent(event=self._event, data=raw.decode(), id=self._id, retry=self._retry)
+        # NOTE: 仕様に従い id はリセットしない
+        self._event = None
+        self._data = []
+        self._retry = None
+        return event
@@ -0,0 +1,239 @@
+import sys
+import json
+import codecs
+import time
+import asyncio
+import argparse
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Literal
+
+from claude_inspect.buffer import Chunk
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class TapFrame:
+    """ページが中継した SSE の 1 フレーム
+
+    data は受信したフレームをそのまま指す読み取り専用のバッファで、全購読者で共有される。
+    購読者が書き換えてはいけない。
+
+    Attributes:
+        stream: ストリームの id。ページとの接続中は一意
+        kind: "open" でストリームが始まり、"chunk" が続き、"close" で終わる
+        url: そのストリームを開いたページの URL（チャットの URL）
+        owned: Client の要求（communicate など）が開始したストリームなら True。アプリ上で直接始まったものは False
+        data: kind="chunk" のときの SSE のバイト列。それ以外では空
+        error: kind="close" で、ストリームが異常終了したときの理由
+        t: 受信した時刻（UNIX 秒）
+    """
+
+    stream: int
+    kind: Literal["open", "chunk", "close"]
+    url: str | None
+    owned: bool
+    data: Chunk = b""
+    error: str | None = None
+    t: float = 0.0
+
+
+@dataclass
+class TapStats:
+    frames: int = 0
+    bytes: int = 0
+    dropped: int = 0
+    dropped_bytes: int = 0
+    high_water_bytes: int = 0
+
+
+class TapSubscription:
+    """Client.subscribe() が返す購読。フレームを届いた順に返す
+
+    溜めておけるのは max_bytes まで。読むのが遅れて溢れた chunk は捨て、stats.dropped に数える。
+    open と close は溢れていても必ず届くので、ストリームの区切りは失われない。
+    """
+
+    def __init__(self, max_bytes: int, *, owned: bool = True, on_close: Callable[["TapSubscription"], None] | None = None):
+        """
+        Args:
+            max_bytes: 読まれていない chunk のバイト数の上限
+            owned: False なら Client の要求が開始したストリームは届けない
+        """
+        self.max_bytes = max_bytes
+        self.owned = owned
+        self.stats = TapStats()
+        self._frames: deque[TapFrame] = deque()
+        self._nbytes = 0
+        self._readable = asyncio.Event()
+        self._closed = False
+        self._on_close = on_close
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def offer(self, frame: TapFrame):
+        """フレームを渡す。待たない"""
+        if self._closed or (frame.owned and not self.owned):
+            return
+        n = len(frame.data)
+        if n and self._nbytes + n > self.max_bytes:
+            self.stats.dropped += 1
+            self.stats.dropped_bytes += n
+            return
+        self._frames.append(frame)
+        self._nbytes += n
+        if self._nbytes > self.stats.high_water_bytes:
+            self.stats.high_water_bytes = self._nbytes
+        self._readable.set()
+
+    def get_nowait(self) -> TapFrame | None:
+        if not self._frames:
+            return None
+        frame = self._frames.popleft()
+        self._nbytes -= len(frame.data)
+        self.stats.frames += 1
+        self.stats.bytes += len(frame.data)
+        return frame
+
+    async def get(self, timeout: float | None = None) -> TapFrame | None:
+        """次のフレームを返す。購読が閉じられたかタイムアウトしたら None を返す"""
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        while (frame := self.get_nowait()) is None:
+            if self._closed:
+                return None
+            self._readable.clear()
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await self._readable.wait()
+            except TimeoutError:
+                return None
+        return frame
+
+    def close(self):
+        """購読をやめる。溜まっているフレームは読み出せる"""
+        if self._closed:
+            return
+        self._closed = True
+        self._readable.set()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> TapFrame:
+        frame = await self.get()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Tap:
+    """Client が受け取った SSE のフレームを購読者に配るクラス"""
+
+    def __init__(self):
+        self.subscribers: list[TapSubscription] = []
+        # 開いているストリームの id -> (url, owned)
+        self._streams: dict[int, tuple[str | None, bool]] = {}
+
+    def subscribe(self, max_bytes: int = 1 << 20, *, owned: bool = True) -> TapSubscription:
+        subscription = TapSubscription(max_bytes, owned=owned, on_close=self.subscribers.remove)
+        self.subscribers.append(subscription)
+        return subscription
+
+    def _broadcast(self, frame: TapFrame):
+        for subscription in self.subscribers:
+            subscription.offer(frame)
+
+    def open(self, stream_id: int, url: str | None, owned: bool):
+        self._streams[stream_id] = (url, owned)
+        if self.subscribers:
+            self._broadcast(TapFrame(stream_id, "open", url, owned, t=time.time()))
+
+    def chunk(self, stream_id: int, data: Chunk):
+        if not self.subscribers:
+            return
+        info = self._streams.get(stream_id)
+        if info is not None:
+            self._broadcast(TapFrame(stream_id, "chunk", *info, data=data, t=time.time()))
+
+    def close(self, stream_id: int, error: str | None = None):
+        info = self._streams.pop(stream_id, None)
+        if info is not None and self.subscribers:
+            self._broadcast(TapFrame(stream_id, "close", *info, error=error, t=time.time()))
+
+    def close_all(self, error: str):
+        for stream_id in list(self._streams):
+            self.close(stream_id, error)
+
+
+async def amain(args: argparse.Namespace):
+    from claude_inspect.client import Client
+
+    # tap は op を送らないので、記録された op を待たずに再生する
+    client = Client(exe_path=args.exe, port=args.port, attach=args.attach, replay=args.replay, replay_passive=True)
+    out = open(args.output, "a", encoding="utf-8") if args.output else sys.stdout
+    # 接続前から購読しておけば、最初のストリームも取りこぼさない
+    subscription = client.subscribe(args.max_bytes)
+    # フレームの境界で分かれたマルチバイト文字を繋ぐため、ストリームごとに復号器を持つ
+    decoders: dict[int, codecs.IncrementalDecoder] = {}
+
+    def write(frame: TapFrame, **fields):
+        record = {"t": frame.t, "stream": frame.stream, "kind": frame.kind, "url": frame.url, "owned": frame.owned, **fields}
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    try:
+        async with client.run():
+            async for frame in subscription:
+                if frame.kind == "chunk":
+                    decoder = decoders.get(frame.stream)
+                    if decoder is None:
+                        decoder = decoders[frame.stream] = codecs.getincrementaldecoder("utf-8")("replace")
+                    if data := decoder.decode(frame.data):
+                        write(frame, data=data)
+                else:
+                    decoder = decoders.pop(frame.stream, None)
+                    if decoder is not None and (data := decoder.decode(b"", final=True)):
+                        # 途中で切れた文字の残り
+                        write(TapFrame(frame.stream, "chunk", frame.url, frame.owned, t=frame.t), data=data)
+                    write(frame, **({} if frame.error is None else {"error": frame.error}))
+                out.flush()
+    finally:
+        subscription.close()
+        if subscription.stats.dropped:
+            logger.warning(f"dropped {subscription.stats.dropped} chunks ({subscription.stats.dropped_bytes} bytes)")
+        if out is not sys.stdout:
+            out.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claude for Desktop が受け取る SSE をすべて JSONL に書き出す")
+    parser.add_argument("-o", "--output", help="追記する JSONL。省略時は標準出力")
+    parser.add_argument("--port", type=int, default=9223, help="websocket のポート番号")
+    parser.add_argument("--exe", default=r"%LOCALAPPDATA%\AnthropicClaude\claude.exe")
+    parser.add_argument("--attach", action="store_true", help="起動済みのインスタンスに接続する")
+    parser.add_argument("--replay", help="アプリを起動せず、記録したログを再生する")
+    parser.add_argument("--max-bytes", type=int, default=16 << 20, help="書き出しが遅れたときに溜めておくバイト数")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    try:
+        asyncio.run(amain(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Iterator
+
+
+# 1 フレームで送るペイロードのバイト数
+DEFAULT_CHUNK_SIZE = 256 << 10
+
+
+@dataclass(frozen=True)
+class Attachment:
+    """プロンプトに添付するファイル。アプリにはエディタへの貼り付けとして渡す"""
+
+    name: str
+    data: bytes
+    mime_type: str = "text/plain"
+
+    @classmethod
+    def from_path(cls, path: str, mime_type: str | None = None) -> "Attachment":
+        """ファイルを読み込む。mime_type を省略すると拡張子から推測する"""
+        with open(path, "rb") as f:
+            data = f.read()
+        if mime_type is None:
+            import mimetypes
+
+            mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return cls(os.path.basename(path), data, mime_type)
+
+    def digest(self) -> str:
+        """キャッシュのキーに使う、名前と中身のハッシュ"""
+        h = hashlib.sha256()
+        h.update(f"{self.name}\0{self.mime_type}\0".encode())
+        h.update(self.data)
+        return h.hexdigest()
+
+
+def upload_frames(upload_id: int, data: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """data をページに送るバイナリフレーム（uint32be の upload id + ペイロードの一部）に分ける"""
+    header = upload_id.to_bytes(4)
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield header + view[start : start + chunk_size]
+    if not view:
+        # 空でもページ側に upload を作らせる
+        yield header
@@ -1,4 +1,3 @@
-import time
 import ctypes
 from ctypes import wintypes
 
@@ -7,6 +6,8 @@ SW_MINIMIZE = 6
 PROCESS_TERMINATE = 0x0001
 PROCESS_QUERY_INFORMATION = 0x0400
 STILL_ACTIVE = 259
+SYNCHRONIZE = 0x00100000
+WAIT_OBJECT_0 = 0x00000000
 
 # 必要なWindows API関数を定義
 user32 = ctypes.WinDLL("user32", use_last_error=True)
@@ -37,6 +38,19 @@ kernel32.GetExitCodeProcess.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes
 user32.SendMessageW.restype = ctypes.c_void_p
 user32.SendMessageW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
 
+WNDENUMPROC = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
+user32.EnumWindows.restype = wintypes.BOOL
+user32.EnumWindows.argtypes = [WNDENUMPROC, wintypes.LPARAM]
+
+user32.GetWindowTextLengthW.restype = ctypes.c_int
+user32.GetWindowTextLengthW.argtypes = [wintypes.HWND]
+
+user32.GetWindowTextW.restype = ctypes.c_int
+user32.GetWindowTextW.argtypes = [wintypes.HWND, wintypes.LPWSTR, ctypes.c_int]
+
+kernel32.WaitForSingleObject.restype = wintypes.DWORD
+kernel32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+
 
 def find_window_by_title(title):
     """ウィンドウタイトルからウィンドウハンドルを取得"""
@@ -46,6 +60,24 @@ def find_window_by_title(title):
     return hwnd
 
 
+def find_windows_by_title(title):
+    """ウィンドウタイトルが一致するトップレベルウィンドウをすべて取得"""
+    result = []
+
+    @WNDENUMPROC
+    def callback(hwnd, lparam):
+        n = user32.GetWindowTextLengthW(hwnd)
+        if n == len(title):
+            buf = ctypes.create_unicode_buffer(n + 1)
+            user32.GetWindowTextW(hwnd, buf, n + 1)
+            if buf.value == title:
+                result.append(hwnd)
+        return True
+
+    user32.EnumWindows(callback, 0)
+    return result
+
+
 def get_pid_from_hwnd(hwnd):
     """ウィンドウハンドルからプロセスIDを取得"""
     pid = wintypes.DWORD()
@@ -58,9 +90,9 @@ def minimize_window(hwnd):
     return user32.ShowWindow(hwnd, SW_MINIMIZE)
 
 
-def terminate_process(pid):
+def terminate_process(pid, timeout_ms=1000):
     # プロセスを開く
-    h_process = kernel32.OpenProcess(PROCESS_TERMINATE | PROCESS_QUERY_INFORMATION, False, pid)
+    h_process = kernel32.OpenProcess(PROCESS_TERMINATE | PROCESS_QUERY_INFORMATION | SYNCHRONIZE, False, pid)
     if not h_process:
         return None
 
@@ -72,8 +104,8 @@ def terminate_process(pid):
     exit_code = None
     actual_exit_code = wintypes.DWORD()
     if result:
-        # プロセスが完全に終了するまで少し待機
-        time.sleep(0.1)
+        # プロセスが完全に終了するまで待機（終了した時点で戻る）
+        kernel32.WaitForSingleObject(h_process, timeout_ms)
 
         if kernel32.GetExitCodeProcess(h_process, ctypes.byref(actual_exit_code)):
             exit_code = actual_exit_code.value
@@ -0,0 +1,38 @@
+"""chat-batch の入力と出力（チェックポイント）の読み込みを確かめる
+
+    $ uv run python -m unittest discover tests
+"""
+
+import os
+import tempfile
+import unittest
+
+from claude_inspect.batch import load_done, read_items
+
+
+class BatchFilesTest(unittest.TestCase):
+    def write(self, text: str) -> str:
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_unreadable_input_lines_become_errors(self):
+        path = self.write('{"id": "a", "prompt": "hi"}\n{bad\n{"id": "c"}\n[1]\n\n{"prompt": "x"}\n')
+        items = list(read_items(path))
+        self.assertEqual([(item.id, item.line, item.error is None) for item in items], [
+            ("a", 1, True),
+            ("2", 2, False),
+            ("c", 3, False),
+            ("4", 4, False),
+            ("6", 6, True),
+        ])
+
+    def test_unreadable_checkpoint_lines_are_skipped(self):
+        path = self.write('[1, 2]\n{"text": "no id"}\n{"id": "a", "text": "t"}\n{"id": "b", "error": "e"}\n{"id": "c", "te')
+        self.assertEqual(load_done(path), {"a"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+"""ChunkBuffer の溢れたときの振る舞いと、Client が受け付ける設定を確かめる
+
+    $ uv run python -m unittest discover tests
+"""
+
+import asyncio
+import unittest
+
+from claude_inspect.buffer import BufferConfig, ChunkBuffer
+from claude_inspect.client import Client
+
+
+EVENTS = [f'event: content_block_delta\ndata: {{"index": {i}}}\n\n'.encode() for i in range(100)]
+
+
+async def read_all(buffer: ChunkBuffer) -> bytes:
+    data = bytearray()
+    while chunk := await buffer.get():
+        data += chunk
+    return bytes(data)
+
+
+class ChunkBufferTest(unittest.IsolatedAsyncioTestCase):
+    async def test_no_chunk_is_lost(self):
+        # 読み手が遅れても、block と spill はイベントを欠かさずに順番どおり渡す
+        for policy in ("block", "spill"):
+            with self.subTest(policy=policy):
+                buffer = ChunkBuffer(BufferConfig(max_bytes=64, policy=policy, coalesce=0))
+                reader = asyncio.create_task(read_all(buffer))
+                for event in EVENTS:
+                    await buffer.put(event)
+                buffer.close()
+                self.assertEqual(await reader, b"".join(EVENTS))
+
+    def test_client_refuses_drop(self):
+        # 欠けたチャンクは SSEParser が前後のイベントとつなげてしまうので、communicate が読むバッファには使わせない
+        with self.assertRaises(ValueError):
+            Client(attach=True, buffer=BufferConfig(policy="drop"))
+
+
+if __name__ == "__main__":
+    unittest.main()
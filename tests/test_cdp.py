@@ -0,0 +1,37 @@
+"""CDPSession を CDPSimulator につなぎ、接続が切れたときに待っている呼び出しが失敗することを確かめる
+
+    $ uv run python -m unittest discover tests
+"""
+
+import asyncio
+import unittest
+
+from claude_inspect.cdp import CDPSession, wait_target
+from claude_inspect.simulator import CDPSimulator
+
+
+DEBUGGING_PORT = 9590
+
+
+class CDPSessionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_evaluate(self):
+        async with CDPSimulator(DEBUGGING_PORT) as sim:
+            target = await wait_target(DEBUGGING_PORT)
+            async with CDPSession.connect(target["webSocketDebuggerUrl"]) as session:
+                await session.evaluate("1 + 1")
+        self.assertEqual(sim.evaluated, ["1 + 1"])
+
+    async def test_closed_during_evaluate(self):
+        # 評価の途中でアプリが落ちても、evaluate は待ち続けずに ConnectionError で失敗する
+        async with CDPSimulator(DEBUGGING_PORT, on_evaluate=lambda script: sim.crash()) as sim:
+            target = await wait_target(DEBUGGING_PORT)
+            async with CDPSession.connect(target["webSocketDebuggerUrl"]) as session:
+                with self.assertRaises(ConnectionError):
+                    await asyncio.wait_for(session.evaluate("1 + 1"), 5.0)
+                # 切れた後に送ったものも同じく失敗する
+                with self.assertRaises(ConnectionError):
+                    await asyncio.wait_for(session.evaluate("2 + 2"), 5.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
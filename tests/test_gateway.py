@@ -0,0 +1,104 @@
+"""Gateway を DesktopSimulator の前に置き、HTTP で要求を送って確かめる
+
+    $ uv run python -m unittest discover tests
+"""
+
+import json
+import asyncio
+import unittest
+
+from claude_inspect.events import Event
+from claude_inspect.gateway import Gateway, MessageRequest, Request
+from claude_inspect.pool import ClientPool
+from claude_inspect.simulator import DesktopSimulator, SimulatorConfig
+from claude_inspect.sse import SSEParser
+
+
+POOL_PORT = 9570
+GATEWAY_PORT = 9580
+
+
+async def post(body: dict) -> tuple[int, bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", GATEWAY_PORT)
+    data = json.dumps(body).encode()
+    writer.write(f"POST /v1/messages HTTP/1.1\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), payload
+
+
+def user(text: str) -> dict:
+    return {"role": "user", "content": text}
+
+
+class GatewayTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sim = DesktopSimulator(f"ws://127.0.0.1:{POOL_PORT}", SimulatorConfig(response_tokens=5, reconnect_delay=0.05))
+        self.pool = ClientPool(1, attach=True, base_port=POOL_PORT, health_interval=100)
+        self.gateway = Gateway(self.pool, port=GATEWAY_PORT)
+        self.stack = [self.sim, self.pool.run(), self.gateway]
+        for context in self.stack:
+            await context.__aenter__()
+
+    async def asyncTearDown(self):
+        for context in reversed(self.stack):
+            await context.__aexit__(None, None, None)
+
+    async def test_callers_do_not_share_a_chat(self):
+        # 1 つのインスタンスに続けて送っても、2 つ目は 1 つ目の会話に続かない
+        status, _ = await post({"messages": [user("first caller")]})
+        self.assertEqual(status, 200)
+        status, _ = await post({"messages": [user("second caller")], "stream": True})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.sim.chats[-2:], [["first caller"], ["second caller"]])
+
+    async def test_continue_is_opt_in(self):
+        await post({"messages": [user("one")]})
+        status, _ = await post({"messages": [user("one"), {"role": "assistant", "content": "a"}, user("two")], "new_chat": False})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.sim.chats[-1], ["one", "two"])
+
+    async def test_history_is_rejected(self):
+        status, payload = await post({"messages": [user("one"), {"role": "assistant", "content": "a"}, user("two")]})
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(payload)["error"]["type"], "invalid_request_error")
+        self.assertEqual(self.sim.sent_prompts, [])
+
+
+class MultiLineClient:
+    """data が複数行のイベントを返す Client の代わり"""
+
+    addr, port = "127.0.0.1", POOL_PORT
+
+    async def events(self, message: str, **kwargs):
+        yield Event("message_start", b'{"type":\n"message_start"}')
+        yield Event(None, b"first\n\nthird")
+
+
+class Sink:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data: bytes):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+class StreamTest(unittest.IsolatedAsyncioTestCase):
+    async def test_multi_line_data(self):
+        # 複数行の data は行ごとに data: を付けて送り、受け取った側で元どおりにつながる
+        gateway = Gateway(ClientPool(1, attach=True, base_port=POOL_PORT), port=GATEWAY_PORT)
+        sink = Sink()
+        request = Request("POST", "/v1/messages", {}, b"")
+        await gateway._stream(MultiLineClient(), MessageRequest(prompt="hi", stream=True), request, sink)
+        _, _, body = bytes(sink.data).partition(b"\r\n\r\n")
+        events = SSEParser().feed(body)
+        self.assertEqual([(e.event, e.data) for e in events], [("message_start", '{"type":\n"message_start"}'), ("message", "first\n\nthird")])
+
+
+if __name__ == "__main__":
+    unittest.main()
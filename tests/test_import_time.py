@@ -0,0 +1,40 @@
+"""コマンドの各モジュールの読み込み時間が予算内で、重い依存を読み込まないことを確かめる
+
+    $ uv run python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_import import BUDGET_MS, MODULES, forbidden_imports, measure  # noqa: E402
+
+
+# 計測のぶれを吸収するため、最も速かった回で比べる
+REPEAT = 3
+
+
+class ImportTimeTest(unittest.TestCase):
+    def setUp(self):
+        # 計測は別のインタプリタで行うので、インストールしていないチェックアウトでも src から読み込めるようにする
+        path = os.environ.get("PYTHONPATH")
+        src = os.path.normpath(os.path.join(ROOT, "src"))
+        patcher = mock.patch.dict(os.environ, {"PYTHONPATH": os.pathsep.join([src, path]) if path else src})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_budget(self):
+        for module in MODULES:
+            with self.subTest(module=module):
+                totals, rows = measure(module, REPEAT)
+                self.assertLessEqual(min(totals) / 1e3, BUDGET_MS)
+                self.assertEqual(forbidden_imports(rows), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
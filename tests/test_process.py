@@ -0,0 +1,59 @@
+"""ClaudeDesktopProcess を FakeBackend と CDPSimulator で起動・停止して確かめる
+
+    $ uv run python -m unittest discover tests
+"""
+
+import asyncio
+import unittest
+
+from claude_inspect.backend import FakeBackend
+from claude_inspect.process import ClaudeDesktopProcess
+from claude_inspect.simulator import CDPSimulator
+
+
+DEBUGGING_PORT = 9595
+
+
+def names(backend: FakeBackend) -> list[str]:
+    return [name for _, name, _ in backend.events]
+
+
+class EventLoopTest(unittest.TestCase):
+    def test_inject_from_two_event_loops(self):
+        # 同期版の start() / stop() はそれぞれ asyncio.run を呼ぶ。ループが変わっても、
+        # 同時に起動したインスタンスの注入が前のループの Lock に引っかからない
+        backend = FakeBackend(window_delay=0.01, inject_delay=0.01)
+
+        async def start_stop(processes: list[ClaudeDesktopProcess]):
+            await asyncio.gather(*(process.astart() for process in processes))
+            await asyncio.gather(*(process.astop() for process in processes))
+
+        for _ in range(2):
+            processes = [ClaudeDesktopProcess("claude.exe", ".", "/* script */", backend=backend) for _ in range(2)]
+            asyncio.run(asyncio.wait_for(start_stop(processes), 10.0))
+        self.assertEqual(names(backend).count("inject"), 4)
+
+        process = ClaudeDesktopProcess("claude.exe", ".", "/* script */", backend=backend)
+        process.start()
+        process.stop()
+        self.assertEqual(names(backend).count("inject"), 5)
+
+
+class CDPInjectTest(unittest.IsolatedAsyncioTestCase):
+    async def test_closed_during_evaluate(self):
+        # 1 回目の評価の途中で接続が切れても、待ち続けずに注入をやり直す
+        def on_evaluate(script: str):
+            if len(sim.evaluated) == 1:
+                sim.crash()
+
+        backend = FakeBackend(window_delay=0.01)
+        process = ClaudeDesktopProcess("claude.exe", ".", "/* script */", backend=backend, inject_mode="cdp", debugging_port=DEBUGGING_PORT)
+        async with CDPSimulator(DEBUGGING_PORT, on_evaluate=on_evaluate) as sim:
+            await asyncio.wait_for(process.astart(), 10.0)
+            await process.astop()
+        self.assertEqual(sim.evaluated, ["/* script */", "/* script */"])
+        self.assertEqual(names(backend).count("spawn"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()